@@ -0,0 +1,347 @@
+import os
+import time
+import threading
+from flask import Blueprint, request, render_template, jsonify, session, redirect, url_for, flash, Response, \
+    stream_with_context, current_app
+from database import get_db_connection, get_sync_status, get_resumable_run, enqueue_ingest_job, get_pending_jobs, \
+    is_ingest_running, request_job_cancel, list_crawler_urls, reschedule_crawler_urls, list_recent_jobs, \
+    get_job_result, EVALUATION_MODE
+from batch_questions import read_questions, questions_from_list, submit_evaluation
+from config import ADMIN_URLS_PER_PAGE, ADMIN_STREAM_MAX_SECONDS, ADMIN_STREAM_IDLE_RETRY_SECONDS, \
+    ADMIN_STREAM_ACTIVITY_CHECK_SECONDS, PROGRESS_FLUSH_SECONDS
+
+# Admin panel jako samostatný blueprint - registruje se jen v plné roli aplikace (viz application.py)
+admin_bp = Blueprint("admin", __name__)
+
+ADMIN_PASSWORD = "studijkojede"
+
+
+@admin_bp.route("/admin", methods=["GET", "POST"])
+def admin_login():
+    if session.get("logged_in"):
+        return redirect(url_for("admin.admin_dashboard"))
+
+    if request.method == "POST":
+        password = request.form.get("password")
+        if password == ADMIN_PASSWORD:
+            session["logged_in"] = True
+            return redirect(url_for("admin.admin_dashboard"))
+        else:
+            return render_template("admin_login.html", error="Špatné heslo!")
+
+    return render_template("admin_login.html")
+
+
+@admin_bp.route("/admin/dashboard", methods=["GET", "POST"])
+def admin_dashboard():
+    if not session.get("logged_in"):
+        return redirect(url_for("admin.admin_login"))
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    if request.method == "POST":
+        new_url = request.form.get("new_url")
+        if new_url:
+            try:
+                cursor.execute("INSERT INTO crawler_urls (url) VALUES (%s)", (new_url,))
+                conn.commit()
+            except:
+                pass  # Ignorujeme duplikáty
+
+    conn.close()
+
+    # Seznam URL po stránkách s hledáním - se sitemapami jich jsou tisíce
+    search = request.args.get("q", "").strip()
+    page = max(request.args.get("page", 1, type=int), 1)
+    urls, urls_total = list_crawler_urls(search, page, ADMIN_URLS_PER_PAGE)
+    pages = max((urls_total + ADMIN_URLS_PER_PAGE - 1) // ADMIN_URLS_PER_PAGE, 1)
+
+    # Získáme aktuální stav aktualizací pro zobrazení na dashboardu
+    status_data = get_sync_status()
+    # Nedokončený běh (např. po pádu serveru), na který lze navázat
+    resumable_mode = get_resumable_run()
+    # Fronta úloh pro ingest worker (worker.py)
+    jobs = get_pending_jobs()
+    # Evaluace sad otázek (stejná fronta, zpracovává je také worker)
+    evaluations = list_recent_jobs(EVALUATION_MODE)
+
+    return render_template("admin_dashboard.html", urls=urls, urls_total=urls_total, search=search, page=page,
+                           pages=pages, status_data=status_data, resumable_mode=resumable_mode, jobs=jobs,
+                           evaluations=evaluations)
+
+
+@admin_bp.route("/admin/delete/<int:url_id>")
+def admin_delete_url(url_id):
+    if not session.get("logged_in"):
+        return redirect(url_for("admin.admin_login"))
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM crawler_urls WHERE id = %s", (url_id,))
+    cursor.execute("DELETE FROM crawler_pdf_links WHERE page_id = %s", (url_id,))
+    conn.commit()
+    conn.close()
+
+    return redirect(request.referrer or url_for("admin.admin_dashboard"))
+
+
+@admin_bp.route("/admin/import_sitemap", methods=["POST"])
+def admin_import_sitemap():
+    """Hromadně přidá URL ze sitemap.xml (i sitemap indexu), volitelně jen pod zadaným prefixem."""
+    if not session.get("logged_in"):
+        return redirect(url_for("admin.admin_login"))
+
+    from sitemaps import import_sitemap
+    sitemap_url = request.form.get("sitemap_url", "").strip()
+    url_prefix = request.form.get("url_prefix", "").strip()
+    if sitemap_url:
+        try:
+            count = import_sitemap(sitemap_url, url_prefix)
+            flash(f"Ze sitemapy bylo načteno {count} URL adres. Nové a změněné projde příští web sync.", "success")
+        except Exception as e:
+            flash(f"Sitemapu se nepodařilo načíst: {e}", "error")
+    return redirect(url_for("admin.admin_dashboard"))
+
+
+@admin_bp.route("/admin/recrawl")
+@admin_bp.route("/admin/recrawl/<int:url_id>")
+def admin_recrawl(url_id=None):
+    """Naplánuje URL (bez ID všechny) k projití při příštím web syncu."""
+    if not session.get("logged_in"):
+        return redirect(url_for("admin.admin_login"))
+
+    reschedule_crawler_urls(url_id)
+    return redirect(request.referrer or url_for("admin.admin_dashboard"))
+
+
+@admin_bp.route("/admin/api/status")
+def admin_api_status():
+    """Vrací aktuální stav indexace jako JSON pro AJAX polling ve frontendu."""
+    if not session.get("logged_in"):
+        return jsonify({"error": "Unauthorized"}), 401
+
+    return jsonify(get_sync_status())
+
+
+class StatusFeed:
+    """
+    Stav indexace sdílený všemi SSE spojeními procesu. Jediné vlákno čte sync_status nejvýše jednou
+    za PROGRESS_FLUSH_SECONDS (častěji ho worker stejně nezapisuje) a zda indexace běží nebo čeká ve frontě
+    jednou za ADMIN_STREAM_ACTIVITY_CHECK_SECONDS - zátěž DB nezávisí na počtu otevřených dashboardů.
+    Vlákno běží, jen dokud je někdo připojený. Každá změna stavu zvýší `version`, spojení na ni čekají.
+    """
+
+    def __init__(self, interval=PROGRESS_FLUSH_SECONDS, activity_interval=ADMIN_STREAM_ACTIVITY_CHECK_SECONDS):
+        self.interval = interval
+        self.activity_interval = activity_interval
+        self.version = 0
+        self.status = None
+        self.active = False
+        self._subscribers = 0
+        self._thread = None
+        self._cond = threading.Condition()
+
+    def subscribe(self):
+        with self._cond:
+            self._subscribers += 1
+            if self._thread is None:
+                # Stav z doby, kdy nikdo nebyl připojený, je zastaralý - spojení počkají na nové čtení
+                self.status = None
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def unsubscribe(self):
+        with self._cond:
+            self._subscribers -= 1
+
+    def wait(self, version, timeout):
+        """Počká na stav novější než `version` (nejdéle `timeout` s). Vrací (verze, stav, aktivní)."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.version != version and self.status is not None, timeout)
+            return self.version, self.status, self.active
+
+    def _run(self):
+        last_activity_check = None
+        while True:
+            with self._cond:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            try:
+                status = get_sync_status()
+                active = self.active
+                now = time.monotonic()
+                if last_activity_check is None or now - last_activity_check >= self.activity_interval:
+                    active = is_ingest_running() or bool(get_pending_jobs())
+                    last_activity_check = now
+                with self._cond:
+                    if status != self.status or active != self.active:
+                        self.status, self.active = status, active
+                        self.version += 1
+                        self._cond.notify_all()
+            except Exception as e:
+                print(f"⚠️ Stav indexace pro dashboard nelze načíst: {e}")
+            time.sleep(self.interval)
+
+
+status_feed = StatusFeed()
+
+
+@admin_bp.route("/admin/api/status/stream")
+def admin_api_status_stream():
+    """
+    Server-Sent Events: posílá stav indexace jen když se změní (místo AJAX pollingu každou vteřinu).
+    Stav z DB čte jednou za proces sdílený status_feed, spojení jen čekají na jeho novou verzi. Spojení
+    drží vlákno serveru, proto je krátkodobé: bez běžící indexace se pošle jen aktuální stav a prohlížeč
+    se znovu připojí až za ADMIN_STREAM_IDLE_RETRY_SECONDS, jinak se zavře nejpozději po ADMIN_STREAM_MAX_SECONDS.
+    """
+    if not session.get("logged_in"):
+        return jsonify({"error": "Unauthorized"}), 401
+
+    def generate():
+        started = time.monotonic()
+        version = 0
+        status_feed.subscribe()
+        try:
+            yield "retry: 2000\n\n"
+            while time.monotonic() - started < ADMIN_STREAM_MAX_SECONDS:
+                new_version, status, active = status_feed.wait(version, timeout=15)
+                if new_version != version and status is not None:
+                    version = new_version
+                    yield f"data: {current_app.json.dumps(status)}\n\n"
+                else:
+                    # Komentář udrží spojení otevřené přes proxy
+                    yield ": keepalive\n\n"
+                if not active:
+                    yield f"retry: {ADMIN_STREAM_IDLE_RETRY_SECONDS * 1000}\n\n"
+                    return
+            # Po ADMIN_STREAM_MAX_SECONDS se EventSource sám připojí znovu
+        finally:
+            status_feed.unsubscribe()
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
+
+
+@admin_bp.route("/admin/trigger_sync/<mode>")
+def admin_trigger_sync(mode):
+    """Zařadí ingest do fronty - zpracuje ho samostatný proces worker.py."""
+    if not session.get("logged_in"):
+        return redirect(url_for("admin.admin_login"))
+
+    # Zkontrolujeme, jestli už indexace zrovna neběží (platný zámek workeru) nebo nečeká ve frontě.
+    # Evaluace (i ta, která zrovna drží zámek) indexaci neblokuje - worker ji vezme po ní.
+    pending = get_pending_jobs()
+    evaluating = any(job["mode"] == EVALUATION_MODE and job["status"] == "running" for job in pending)
+    is_busy = (is_ingest_running() and not evaluating) or any(job["mode"] != EVALUATION_MODE for job in pending)
+
+    if mode in ["all", "web", "csv", "drive", "bulk", "resume"] and not is_busy:
+        enqueue_ingest_job(mode)
+        flash("Aktualizace byla zařazena do fronty. Spustí ji ingest worker.", "success")
+
+    # Hned se vrátíme na dashboard, kde se chytí AJAX a ukáže ti hezký progress
+    return redirect(url_for("admin.admin_dashboard"))
+
+
+@admin_bp.route("/admin/cancel_job/<int:job_id>")
+def admin_cancel_job(job_id):
+    """Zruší čekající úlohu, nebo požádá běžící worker o ukončení."""
+    if not session.get("logged_in"):
+        return redirect(url_for("admin.admin_login"))
+
+    request_job_cancel(job_id)
+    return redirect(url_for("admin.admin_dashboard"))
+
+
+@admin_bp.route("/admin/upload_csv", methods=["POST"])
+def admin_upload_csv():
+    """Zpracuje upload CSV souboru a uloží ho do složky data."""
+    if not session.get("logged_in"):
+        return redirect(url_for("admin.admin_login"))
+
+    if 'csv_file' not in request.files:
+        flash("Nebyl vybrán žádný soubor k nahrání.", "error")
+        return redirect(url_for("admin.admin_dashboard"))
+
+    file = request.files['csv_file']
+
+    if file.filename == '':
+        flash("Nebyl vybrán žádný soubor k nahrání.", "error")
+        return redirect(url_for("admin.admin_dashboard"))
+
+    if file and file.filename.endswith('.csv'):
+        os.makedirs('data', exist_ok=True)
+        save_path = os.path.join('data', 'predmety.csv')
+        # Přes dočasný soubor - běžící indexace dočte původní CSV, navázání po pádu pozná nové podle hashe
+        file.save(save_path + '.upload')
+        os.replace(save_path + '.upload', save_path)
+        # Zde jsme přidali úspěšnou hlášku!
+        flash("Paráda! Nové CSV s předměty bylo úspěšně nahráno. Nyní můžeš spustit aktualizaci tabulky.", "success")
+    else:
+        flash("Chyba: Prosím, nahraj pouze soubor ve formátu .csv.", "error")
+
+    return redirect(url_for("admin.admin_dashboard"))
+
+
+@admin_bp.route("/admin/batch_questions", methods=["POST"])
+def admin_batch_questions():
+    """
+    Zařadí sadu otázek (soubor v UTF-8 nebo JSON {"questions": [...]}) k evaluaci do fronty ingest workeru,
+    výsledek JSONL se pak stáhne z dashboardu (/admin/batch_questions/<id>).
+    """
+    if not session.get("logged_in"):
+        return jsonify({"error": "Unauthorized"}), 401
+
+    payload = request.get_json(silent=True)
+    try:
+        if "questions_file" in request.files:
+            # UnicodeDecodeError je ValueError - soubor v jiném kódování je chyba vstupu, ne serveru
+            try:
+                lines = request.files["questions_file"].read().decode("utf-8-sig").splitlines()
+            except UnicodeDecodeError:
+                raise ValueError("Soubor musí být v kódování UTF-8.")
+            questions = read_questions(lines)
+        elif isinstance(payload, dict):
+            questions = questions_from_list(payload.get("questions", []))
+        elif payload is not None:
+            raise ValueError("Tělo požadavku musí být JSON objekt s polem 'questions'.")
+        else:
+            questions = []
+    except ValueError as e:
+        if payload is not None:
+            return jsonify({"error": str(e)}), 400
+        flash(f"Sadu otázek nelze načíst: {e}", "error")
+        return redirect(url_for("admin.admin_dashboard"))
+
+    if not questions:
+        if payload is not None:
+            return jsonify({"error": "No questions"}), 400
+        flash("Soubor neobsahuje žádné otázky.", "error")
+        return redirect(url_for("admin.admin_dashboard"))
+
+    job_id = submit_evaluation(questions, rewrite=request.values.get("rewrite", "1") != "0")
+    if payload is not None:
+        return jsonify({"job_id": job_id, "questions": len(questions)}), 202
+    flash(f"Evaluace {len(questions)} otázek byla zařazena do fronty. Zpracuje ji ingest worker, výsledek najdeš níže.",
+          "success")
+    return redirect(url_for("admin.admin_dashboard"))
+
+
+@admin_bp.route("/admin/batch_questions/<int:job_id>")
+def admin_batch_result(job_id):
+    """Stažení výsledku hotové evaluace."""
+    if not session.get("logged_in"):
+        return redirect(url_for("admin.admin_login"))
+
+    result = get_job_result(job_id, mode=EVALUATION_MODE)
+    if result is None:
+        return jsonify({"error": "Not found"}), 404
+    headers = {"Content-Disposition": f"attachment; filename=vysledky-{job_id}.jsonl"}
+    return Response(result, mimetype="application/x-ndjson", headers=headers)
+
+
+@admin_bp.route("/admin/logout")
+def admin_logout():
+    session.pop("logged_in", None)
+    return redirect(url_for("home"))
@@ -0,0 +1,278 @@
+import io
+import sys
+import json
+import time
+import argparse
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from retrieval import get_search_index, drop_search_index, find_top_k_matches, rewrite_query_for_search, \
+    get_response_from_llm, cited_sources, NO_MATCH_RESPONSE
+from reduced_embeddings import reduce_embedding
+from rate_limit import post_openai
+from database import EVALUATION_MODE, enqueue_ingest_job, get_job_payload, save_job_result
+from config import OPENAI_API_KEY, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, OPENAI_EMBEDDING_URL, CONTEXT_CANDIDATES, \
+    BATCH_EMBEDDING_SIZE, BATCH_SCAN_BLOCK, BATCH_CONCURRENCY
+
+# Dávkové zpracování sady otázek pro evaluaci kvality odpovědí (místo přehrávání přes /api/chat po jedné).
+# Otázky se embeddují po dávkách v jednom požadavku, dense skóre pro celou sadu je maticový součin
+# (blok otázek × index) a top-k s fúzí BM25 se pak dělá po řádcích stejně jako v chatu. Generování
+# odpovědí běží souběžně s omezeným počtem vláken. Všechny požadavky jdou s prioritou 'background',
+# takže evaluace nebere živému chatu rezervu v limitech OpenAI.
+#
+# Vstup: textový soubor (otázka na řádek) nebo JSONL ({"id": ..., "query": ..., další pole se
+# přenesou do výstupu, např. očekávaná odpověď). Výstup: JSONL s odpovědí, zdroji a časy fází.
+#
+#   python batch_questions.py otazky.txt -o vysledky.jsonl --concurrency 4
+#
+# Z admin panelu se sada jen zařadí do fronty ingest_jobs (mode = EVALUATION_MODE) a zpracuje ji ingest
+# worker (worker.py) pod stejným zámkem, rušením i hlídáním pádu jako indexaci - webový požadavek tak
+# na stovky volání LLM nečeká. Výsledné JSONL se uloží k úloze, chyba do jejího sloupce error.
+
+STAGES = ("rewrite", "embedding", "retrieval", "generation")
+
+
+class EvaluationCancelled(Exception):
+    """Evaluace byla ukončena zvenku (worker.py) - `status` je 'cancelled' nebo 'lease_lost' jako u indexace."""
+
+    def __init__(self, status="cancelled"):
+        super().__init__(status)
+        self.status = status
+
+
+def read_questions(lines):
+    """
+    Řádky vstupu -> seznam slovníků s klíči 'id' a 'query' (prázdné řádky se přeskočí).
+    Neplatný JSON nebo otázka, která není text, vyvolá ValueError s číslem řádku.
+    """
+    questions = []
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                raise ValueError(f"Řádek {line_number}: neplatný JSON.")
+            query = record.get("query") or record.get("question") or ""
+            if not isinstance(query, str):
+                raise ValueError(f"Řádek {line_number}: otázka musí být text.")
+            record["query"] = query.strip()
+        else:
+            record = {"query": line}
+        if record["query"]:
+            record.setdefault("id", len(questions) + 1)
+            questions.append(record)
+    return questions
+
+
+def embed_queries(queries, batch_size=BATCH_EMBEDDING_SIZE):
+    """
+    Embeddingy dotazů, `batch_size` dotazů na jeden požadavek. Vrací (vektory, ms na dotaz);
+    u dávky, která selže, je místo vektoru None (dotaz se pak hledá jen lexikálně).
+    """
+    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
+    vectors = [None] * len(queries)
+    timings = [0.0] * len(queries)
+    for start in range(0, len(queries), batch_size):
+        batch = queries[start:start + batch_size]
+        # Stejný model i dimenze jako get_query_embedding
+        data = {"input": batch, "model": EMBEDDING_MODEL, "dimensions": EMBEDDING_DIMENSIONS}
+        started = time.perf_counter()
+        try:
+            response = post_openai(OPENAI_EMBEDDING_URL, headers, data, priority="background", timeout=60)
+            if response.status_code == 200:
+                for item in response.json()["data"]:
+                    vectors[start + item["index"]] = np.array(item["embedding"])
+            else:
+                print(f"⚠️ Embeddingy dávky {start}-{start + len(batch)} selhaly (HTTP {response.status_code})")
+        except requests.RequestException as e:
+            print(f"⚠️ Embeddingy dávky {start}-{start + len(batch)} selhaly: {e}")
+        share = (time.perf_counter() - started) * 1000 / len(batch)
+        timings[start:start + len(batch)] = [share] * len(batch)
+    return vectors, timings
+
+
+def batch_retrieve(index, vectors, texts, k=CONTEXT_CANDIDATES, block=BATCH_SCAN_BLOCK):
+    """
+    Kandidáti pro všechny dotazy. Dense skóre se počítá jedním maticovým součinem na blok `block` dotazů
+    místo skenu po jednom; fúze s BM25, boost kódů předmětů a top-k pak po řádcích přes find_top_k_matches,
+    takže výsledky odpovídají /api/chat. Vrací (seznam shod, ms na dotaz).
+    """
+    matches = [None] * len(texts)
+    timings = [0.0] * len(texts)
+    embedded = [i for i, vector in enumerate(vectors)
+                if vector is not None and np.linalg.norm(vector) > 0 and len(index)]
+
+    for start in range(0, len(embedded), block):
+        rows = embedded[start:start + block]
+        started = time.perf_counter()
+        queries = np.vstack([vectors[i] for i in rows]).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        scores = reduce_embedding(queries, index.scan_dims) @ index.matrix.T
+        share = (time.perf_counter() - started) * 1000 / len(rows)
+        for i, row_scores in zip(rows, scores):
+            started = time.perf_counter()
+            matches[i] = find_top_k_matches(vectors[i], index, texts[i], k=k, dense_scores=row_scores)
+            timings[i] = share + (time.perf_counter() - started) * 1000
+
+    # Bez embeddingu aspoň lexikálně (stejně jako chat při výpadku embeddingů)
+    for i in range(len(texts)):
+        if matches[i] is None:
+            started = time.perf_counter()
+            matches[i] = find_top_k_matches(None, index, texts[i], k=k)
+            timings[i] = (time.perf_counter() - started) * 1000
+    return matches, timings
+
+
+def questions_from_list(items):
+    """Otázky z JSON seznamu řetězců (API admin panelu). Jiný typ než seznam textů vyvolá ValueError."""
+    if not isinstance(items, list) or not all(isinstance(item, str) for item in items):
+        raise ValueError("Pole 'questions' musí být seznam textů.")
+    return [{"id": i + 1, "query": item.strip()} for i, item in enumerate(items) if item.strip()]
+
+
+def _run_concurrently(function, items, concurrency, check_cancel=None):
+    """
+    function(item) pro všechny položky v omezeném počtu vláken; vrací (výsledky, ms na položku).
+    `check_cancel` se volá před každou položkou - jeho výjimka zbytek fáze ukončí.
+    """
+    def timed(item):
+        if check_cancel is not None:
+            check_cancel()
+        started = time.perf_counter()
+        result = function(item)
+        return result, (time.perf_counter() - started) * 1000
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        outcomes = list(pool.map(timed, items))
+    return [result for result, _ in outcomes], [ms for _, ms in outcomes]
+
+
+def _answer(question, matches):
+    if not matches:
+        return NO_MATCH_RESPONSE, []
+    llm_result = get_response_from_llm(matches, question["query"], [], question["search_query"],
+                                       priority="background")
+    return llm_result["text"], cited_sources(llm_result)
+
+
+def run_batch(questions, rewrite=True, concurrency=BATCH_CONCURRENCY, k=CONTEXT_CANDIDATES, should_cancel=None):
+    """
+    Zpracuje otázky fázemi (přepis -> embeddingy -> vyhledávání -> generování). Vrací (řádky výstupu,
+    celkové ms jednotlivých fází). Časy dávkových fází jsou v řádcích rozpočítané na dotaz.
+    `should_cancel` se kontroluje mezi fázemi a před každým voláním LLM (viz run_ingest) - při ukončení
+    vyvolá EvaluationCancelled.
+    """
+    def check_cancel():
+        reason = should_cancel() if should_cancel is not None else None
+        if reason:
+            raise EvaluationCancelled(reason if isinstance(reason, str) else "cancelled")
+
+    totals = {}
+    started = time.perf_counter()
+    if rewrite:
+        # Otázky jsou samostatné (bez historie), přepis jen sjednotí formulaci jako v chatu
+        search_queries, rewrite_ms = _run_concurrently(
+            lambda q: rewrite_query_for_search(q["query"], [], priority="background"), questions, concurrency,
+            check_cancel)
+    else:
+        search_queries, rewrite_ms = [q["query"] for q in questions], [0.0] * len(questions)
+    totals["rewrite"] = (time.perf_counter() - started) * 1000
+
+    check_cancel()
+    started = time.perf_counter()
+    vectors, embedding_ms = embed_queries(search_queries)
+    totals["embedding"] = (time.perf_counter() - started) * 1000
+
+    check_cancel()
+    started = time.perf_counter()
+    matches, retrieval_ms = batch_retrieve(get_search_index(), vectors, search_queries, k=k)
+    totals["retrieval"] = (time.perf_counter() - started) * 1000
+
+    for question, search_query in zip(questions, search_queries):
+        question["search_query"] = search_query
+    started = time.perf_counter()
+    answers, generation_ms = _run_concurrently(lambda args: _answer(*args), list(zip(questions, matches)),
+                                               concurrency, check_cancel)
+    totals["generation"] = (time.perf_counter() - started) * 1000
+
+    rows = []
+    for i, question in enumerate(questions):
+        text, sources = answers[i]
+        row = dict(question, response=text, sources=sources,
+                   retrieved=[{"name": m.get("title") or m.get("source", "Zdroj"), "url": m.get("url", "")}
+                              for m in matches[i]],
+                   timings_ms={stage: round(ms[i], 1) for stage, ms in
+                               zip(STAGES, (rewrite_ms, embedding_ms, retrieval_ms, generation_ms))})
+        if vectors[i] is None:
+            row["degraded"] = ["lexical_only"]
+        rows.append(row)
+    return rows, {stage: round(ms, 1) for stage, ms in totals.items()}
+
+
+def write_jsonl(rows, fh):
+    for row in rows:
+        fh.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+def submit_evaluation(questions, rewrite=True):
+    """Zařadí sadu otázek do fronty ingest workeru (ingest_jobs). Vrací ID úlohy."""
+    return enqueue_ingest_job(EVALUATION_MODE, payload=json.dumps({"questions": questions, "rewrite": rewrite},
+                                                                  ensure_ascii=False))
+
+
+def run_evaluation_job(job_id, should_cancel=None):
+    """
+    Zpracuje evaluaci z fronty (volá worker pod zámkem) a uloží výsledné JSONL k úloze.
+    Vrací 'success', 'cancelled' nebo 'lease_lost'; chyba se propaguje a worker ji zapíše k úloze.
+    """
+    job = json.loads(get_job_payload(job_id))
+    print(f"📋 Evaluace #{job_id}: {len(job['questions'])} otázek...")
+    try:
+        rows, totals = run_batch(job["questions"], rewrite=job.get("rewrite", True), should_cancel=should_cancel)
+    except EvaluationCancelled as e:
+        print(f"⏹️ Evaluace #{job_id} ukončena ({e.status}).")
+        return e.status
+    finally:
+        # Worker index mezi úlohami nepotřebuje
+        drop_search_index()
+
+    output = io.StringIO()
+    write_jsonl(rows, output)
+    save_job_result(job_id, output.getvalue())
+    print(f"✅ Evaluace #{job_id}: {len(rows)} otázek, " +
+          ", ".join(f"{stage} {totals[stage] / 1000:.1f} s" for stage in STAGES))
+    return "success"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dávkové zodpovězení sady otázek pro evaluaci")
+    parser.add_argument("questions", help="Soubor s otázkami (otázka na řádek, nebo JSONL s klíčem 'query')")
+    parser.add_argument("-o", "--output", help="Výstupní JSONL (výchozí: standardní výstup)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="Souběžná generování odpovědí")
+    parser.add_argument("--no-rewrite", action="store_true", help="Vyhledávat přímo podle otázky, bez LLM přepisu")
+    args = parser.parse_args(argv)
+
+    with open(args.questions, encoding="utf-8") as fh:
+        questions = read_questions(fh)
+    if not questions:
+        print("❌ Soubor neobsahuje žádné otázky.", file=sys.stderr)
+        return 1
+
+    print(f"📋 {len(questions)} otázek, {args.concurrency} souběžných generování", file=sys.stderr)
+    rows, totals = run_batch(questions, rewrite=not args.no_rewrite, concurrency=args.concurrency)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            write_jsonl(rows, fh)
+    else:
+        write_jsonl(rows, sys.stdout)
+    print("⏱️ " + ", ".join(f"{stage} {totals[stage] / 1000:.1f} s" for stage in STAGES), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
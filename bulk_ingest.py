@@ -0,0 +1,516 @@
+import os
+import json
+import time
+import shutil
+import requests
+import numpy as np
+
+from config import OPENAI_API_KEY, OPENAI_BASE_URL, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, NEAR_DUP_THRESHOLD, \
+    BULK_WORK_DIR, BULK_POLL_SECONDS, BULK_MAX_REQUESTS_PER_FILE, BULK_MAX_FILE_BYTES
+from progress import SyncProgress
+from lexical import NearDuplicateFilter
+from sitemaps import refresh_sitemaps
+from ingest import (
+    IngestCancelled, get_urls_from_db, scrape_uhk_page, process_pdf_from_url, collect_pdf_text, discard_pdf_job,
+    iter_text_file, iter_text_blocks, chunking_request, parse_chunking_reply, read_csv_smart, csv_row_chunking,
+    build_sparse_indexes,
+    shutdown_pdf_pool, CHUNKING_BLOCK_CHARS, CSV_CHUNK_ROWS
+)
+from database import (
+    prepare_next_table_for_update,
+    start_ingest_journal,
+    load_checkpoints,
+    insert_into_next_table,
+    add_alternate_source,
+    discard_next_table_rows,
+    discard_orphaned_web_rows,
+    swap_tables_atomic,
+    finish_ingest_journal,
+    reschedule_crawler_urls,
+    save_pdf_links,
+    mark_urls_crawled
+)
+
+# Hromadná přestavba webu a předmětů (režim 'bulk') přes asynchronní OpenAI Batch API - poloviční cena
+# a vlastní limity, které nebrzdí chat. Místo tisíců synchronních volání běží ve fázích:
+#   collect   - crawl stránek a PDF, požadavky na sémantické řezání se zapíšou do JSONL souborů
+#   chunking  - odeslání dávek řezání a čekání na výsledek
+#   embedding - sestavení chunků (s filtrem téměř duplicitních), dávky embeddingů a čekání
+#   store     - výsledky se proudově ukládají do stínových tabulek, pak prohození jako u 'all'
+# Stav běhu (fáze, ID dávek, stažené výstupy) je v BULK_WORK_DIR/state.json, takže worker může mezi
+# fázemi i během čekání na dávky spadnout nebo být zrušen - 'resume' naváže a nic neodešle dvakrát.
+
+STATE_FILE = "state.json"
+CHUNKING_ENDPOINT = "/v1/chat/completions"
+EMBEDDING_ENDPOINT = "/v1/embeddings"
+TERMINAL_STATUSES = {"completed", "expired", "failed", "cancelled"}
+CSV_PATH = "data/predmety.csv"
+
+
+def _path(name):
+    return os.path.join(BULK_WORK_DIR, name)
+
+
+def load_state():
+    try:
+        with open(_path(STATE_FILE), encoding="utf-8") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+
+def save_state(state):
+    # Přes dočasný soubor, ať po pádu uprostřed zápisu nezůstane rozepsaný stav
+    tmp_path = _path(STATE_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(state, fh, ensure_ascii=False)
+    os.replace(tmp_path, _path(STATE_FILE))
+
+
+# --- Batch API ---
+
+def _headers():
+    return {"Authorization": f"Bearer {OPENAI_API_KEY}"}
+
+
+def upload_batch_file(path):
+    with open(path, "rb") as fh:
+        response = requests.post(f"{OPENAI_BASE_URL}/files", headers=_headers(), data={"purpose": "batch"},
+                                 files={"file": (os.path.basename(path), fh, "application/jsonl")}, timeout=600)
+    response.raise_for_status()
+    return response.json()["id"]
+
+
+def create_batch(input_file_id, endpoint):
+    data = {"input_file_id": input_file_id, "endpoint": endpoint, "completion_window": "24h"}
+    response = requests.post(f"{OPENAI_BASE_URL}/batches", headers=_headers(), json=data, timeout=60)
+    response.raise_for_status()
+    return response.json()["id"]
+
+
+def get_batch(batch_id):
+    response = requests.get(f"{OPENAI_BASE_URL}/batches/{batch_id}", headers=_headers(), timeout=60)
+    response.raise_for_status()
+    return response.json()
+
+
+def download_file(file_id, path):
+    """Stáhne obsah souboru po částech rovnou na disk."""
+    with requests.get(f"{OPENAI_BASE_URL}/files/{file_id}/content", headers=_headers(), stream=True,
+                      timeout=600) as response:
+        response.raise_for_status()
+        with open(path + ".part", "wb") as fh:
+            for part in response.iter_content(1024 * 1024):
+                fh.write(part)
+    os.replace(path + ".part", path)
+
+
+class BatchFileWriter:
+    """Zapisuje požadavky do JSONL souborů pro Batch API; při překročení limitů souboru založí další."""
+
+    def __init__(self, prefix, endpoint):
+        self.prefix = prefix
+        self.endpoint = endpoint
+        self.paths = []
+        self._fh = None
+        self._count = 0
+        self._bytes = 0
+
+    def add(self, custom_id, body):
+        line = json.dumps({"custom_id": custom_id, "method": "POST", "url": self.endpoint, "body": body},
+                          ensure_ascii=False).encode("utf-8") + b"\n"
+        if self._fh is None or self._count >= BULK_MAX_REQUESTS_PER_FILE or \
+                self._bytes + len(line) > BULK_MAX_FILE_BYTES:
+            self.close()
+            self.paths.append(_path(f"{self.prefix}_{len(self.paths) + 1}.jsonl"))
+            self._fh = open(self.paths[-1], "wb")
+            self._count = self._bytes = 0
+        self._fh.write(line)
+        self._count += 1
+        self._bytes += len(line)
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+def iter_batch_results(paths):
+    """(custom_id, tělo odpovědi) z výstupních souborů dávek; u neúspěšného požadavku je tělo None."""
+    for path in paths:
+        with open(path, encoding="utf-8") as fh:
+            for line in fh:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                yield record["custom_id"], response.get("body") if response.get("status_code") == 200 else None
+
+
+def _wait(seconds, check_cancel):
+    deadline = time.monotonic() + seconds
+    while True:
+        check_cancel()
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(min(1.0, remaining))
+
+
+def run_batches(state, stage, endpoint, check_cancel):
+    """
+    Odešle vstupní soubory fáze, které ještě nemají dávku, počká na všechny dávky a stáhne výstupy.
+    Stav se ukládá po každém kroku, takže po restartu se nic neodešle ani nestáhne dvakrát.
+    Vrací cesty k výstupním souborům.
+    """
+    entries = state["batches"][stage]
+    for entry in entries:
+        if entry["batch_id"] is None:
+            check_cancel()
+            entry["batch_id"] = create_batch(upload_batch_file(_path(entry["file"])), endpoint)
+            save_state(state)
+            print(f"📤 Dávka {entry['batch_id']} odeslána ({entry['file']}).")
+
+    while True:
+        pending = [entry for entry in entries if entry["output"] is None]
+        if not pending:
+            return [_path(entry["output"]) for entry in entries]
+
+        counts = []
+        for entry in pending:
+            batch = get_batch(entry["batch_id"])
+            status = batch["status"]
+            request_counts = batch.get("request_counts") or {}
+            counts.append(f"{entry['batch_id']} {status} {request_counts.get('completed', 0)}"
+                          f"/{request_counts.get('total', 0)}")
+            if status not in TERMINAL_STATUSES:
+                continue
+            if status in ("failed", "cancelled"):
+                # Soubor se při navázání odešle znovu (např. po navýšení limitů účtu)
+                entry["batch_id"] = None
+                save_state(state)
+                raise Exception(f"Dávka {stage} ({entry['file']}) skončila stavem {status}: {batch.get('errors')}")
+
+            # 'expired' = část požadavků nestihla 24h okno; co chybí ve výstupu, se bere jako neúspěšné
+            if status == "expired":
+                print(f"⚠️ Dávka {entry['batch_id']} vypršela, použije se jen hotová část.")
+            output = entry["file"].replace("_requests_", "_output_")
+            if batch.get("output_file_id"):
+                download_file(batch["output_file_id"], _path(output))
+            else:
+                open(_path(output), "w").close()
+            entry["output"] = output
+            save_state(state)
+
+        if any(entry["output"] is None for entry in entries):
+            print(f"⏳ Čekám na dávky ({stage}): {', '.join(counts)}")
+            _wait(BULK_POLL_SECONDS, check_cancel)
+
+
+# --- Fáze ---
+
+def collect_sources(state, check_cancel, progress):
+    """
+    Fáze collect: projde všechny stránky a PDF (jako web sync) a zapíše požadavky na sémantické řezání.
+    Metadata zdrojů jdou do sources.jsonl, předměty z CSV rovnou do csv_chunks.jsonl (řezání nepotřebují).
+    """
+    writer = BatchFileWriter("chunking_requests", CHUNKING_ENDPOINT)
+    crawled_urls, refreshed_sources, seen_pdfs = [], [], set()
+    source_count = 0
+
+    with open(_path("sources.jsonl"), "w", encoding="utf-8") as sources:
+        def add_source(text, filename, default_title, embedding_prefix, source_file, source_url, total_chars=None):
+            nonlocal source_count
+            if isinstance(text, str):
+                if len(text.strip()) < 10:
+                    return
+                total_chars = len(text)
+            total_blocks = -(-total_chars // CHUNKING_BLOCK_CHARS) if total_chars else "?"
+
+            # Stejné bloky a prompt jako semantic_chunking, včetně hrubého fallbacku pro případ neúspěchu
+            blocks, fallback = 0, ""
+            for idx, block in enumerate(iter_text_blocks(text, CHUNKING_BLOCK_CHARS)):
+                if len(fallback) < 10000:
+                    fallback += block[:10000 - len(fallback)]
+                writer.add(f"s{source_count}-b{idx}", chunking_request(block, filename, idx, total_blocks))
+                blocks += 1
+            sources.write(json.dumps({"id": source_count, "blocks": blocks, "filename": filename,
+                                      "default_title": default_title, "embedding_prefix": embedding_prefix,
+                                      "source_file": source_file, "source_url": source_url,
+                                      "fallback": fallback}, ensure_ascii=False) + "\n")
+            source_count += 1
+
+        # Přestavuje se celý web, ne jen stránky, které jsou podle plánu na řadě
+        reschedule_crawler_urls()
+        refresh_sitemaps()
+        urls = get_urls_from_db()
+        progress["WEB"].set_total(len(urls))
+        print(f"🌍 Hromadná přestavba: {len(urls)} URL adres.")
+
+        for idx, url in enumerate(urls, 1):
+            check_cancel()
+            try:
+                web_text, pdf_links, page_title = scrape_uhk_page(url)
+                save_pdf_links(url, pdf_links)
+                # Živé záznamy zdroje se v store_results mažou, jen když máme jeho nový text
+                if web_text:
+                    add_source(web_text, f"Web: {url}", "Webová stránka", f"URL: {url}", page_title, url)
+                    refreshed_sources.append(url)
+
+                pdf_jobs = []
+                try:
+                    for pdf_url in pdf_links:
+                        if pdf_url in seen_pdfs:
+                            continue
+                        future = process_pdf_from_url(pdf_url)
+                        if future is not None:
+                            pdf_jobs.append((pdf_url, future))
+
+                    while pdf_jobs:
+                        check_cancel()
+                        pdf_url, future = pdf_jobs.pop(0)
+                        pdf_text = collect_pdf_text(pdf_url, future)
+                        if not pdf_text:
+                            continue
+                        txt_path, total_chars = pdf_text
+                        filename_short = pdf_url.split('/')[-1]
+                        try:
+                            add_source(iter_text_file(txt_path), f"PDF: {filename_short}", "PDF Dokument",
+                                       f"Zdroj PDF: {pdf_url}", filename_short, pdf_url, total_chars=total_chars)
+                        finally:
+                            os.remove(txt_path)
+                        refreshed_sources.append(pdf_url)
+                        # Až teď - PDF, které selže, zkusí znovu další stránka, která na něj odkazuje
+                        seen_pdfs.add(pdf_url)
+                finally:
+                    for _, future in pdf_jobs:
+                        discard_pdf_job(future)
+
+                crawled_urls.append(url)
+            except IngestCancelled:
+                raise
+            except Exception as e:
+                progress["WEB"].error(f"Chyba na {url}: {str(e)}")
+                print(f"   ❌ Chyba zpracování webu {url}: {e}")
+
+            progress["WEB"].update(idx)
+
+    csv_rows = 0
+    with open(_path("csv_chunks.jsonl"), "w", encoding="utf-8") as out:
+        if os.path.exists(CSV_PATH):
+            with open(CSV_PATH, "rb") as f:
+                frames = read_csv_smart(f, chunksize=CSV_CHUNK_ROWS)
+                if frames is not None:
+                    for chunk in csv_row_chunking(frames, "Lokální Databáze Předmětů"):
+                        out.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+                        csv_rows += 1
+                else:
+                    progress["CSV"].error("Nelze načíst obsah CSV.")
+        else:
+            progress["CSV"].error(f"Soubor nenalezen: {CSV_PATH}")
+            print(f"⚠️ CSV soubor nenalezen na cestě: {CSV_PATH}. Přeskočeno.")
+
+    writer.close()
+    print(f"📝 Připraveno {source_count} zdrojů k řezání ({len(writer.paths)} souborů) a {csv_rows} předmětů.")
+    state.update(stage="chunking", crawled_urls=crawled_urls, refreshed_sources=refreshed_sources)
+    state["batches"]["chunking"] = [{"file": os.path.basename(path), "batch_id": None, "output": None}
+                                    for path in writer.paths]
+    save_state(state)
+
+
+def prepare_embeddings(state, chunking_outputs):
+    """
+    Fáze embedding (příprava): z výsledků řezání sestaví chunky v pořadí zdrojů a bloků, téměř duplicitní
+    jen připíše jako další zdroj k prvnímu výskytu (jako store_chunk v ingest.py) a zapíše požadavky
+    na embeddingy. Záznamy k uložení jdou do items.jsonl, řádek n má custom_id 'e{n}'.
+    """
+    replies = {}
+    for custom_id, body in iter_batch_results(chunking_outputs):
+        if body is None:
+            continue
+        try:
+            replies[custom_id] = parse_chunking_reply(body["choices"][0]["message"]["content"])
+        except Exception as e:
+            print(f"   ⚠️ Chyba AI chunkingu u {custom_id}: {str(e)}")
+
+    dedup = NearDuplicateFilter(NEAR_DUP_THRESHOLD)
+    items = []
+    duplicate_count = 0
+    with open(_path("sources.jsonl"), encoding="utf-8") as sources:
+        for line in sources:
+            source = json.loads(line)
+            chunks = [chunk for idx in range(source["blocks"])
+                      for chunk in replies.get(f"s{source['id']}-b{idx}", [])]
+            if not chunks:
+                print(f"   ⚠️ Sémantický chunking nevrátil nic pro {source['filename']}. Používám hrubý fallback.")
+                if len(source["fallback"].strip()) >= 10:
+                    chunks = [{"title": f"Obsah z {source['filename']}", "content": source["fallback"]}]
+
+            for chunk in chunks:
+                title = chunk.get("title", source["default_title"]).strip()
+                content = chunk.get("content", "").strip()
+                if not content:
+                    continue
+                original = dedup.find(content)
+                if original is not None:
+                    if source["source_url"] != original["source_url"] and source["source_url"] not in original["alt_urls"]:
+                        original["alt_urls"].append(source["source_url"])
+                    duplicate_count += 1
+                    continue
+                item = {"partition": "web", "title": title, "content": content, "source_file": source["source_file"],
+                        "source_url": source["source_url"], "alt_urls": []}
+                dedup.add(content, item)
+                items.append((item, f"{source['embedding_prefix']}\n{content}"))
+    web_items = len(items)
+
+    with open(_path("csv_chunks.jsonl"), encoding="utf-8") as fh:
+        for line in fh:
+            chunk = json.loads(line)
+            items.append(({"partition": "csv", "title": chunk["title"], "content": chunk["content"],
+                           "source_file": "STAG Export", "source_url": "", "alt_urls": []}, chunk["content"]))
+
+    writer = BatchFileWriter("embedding_requests", EMBEDDING_ENDPOINT)
+    with open(_path("items.jsonl"), "w", encoding="utf-8") as out:
+        for n, (item, embedding_text) in enumerate(items):
+            out.write(json.dumps(item, ensure_ascii=False) + "\n")
+            # Ukládá se plná dimenze jako u get_embedding
+            writer.add(f"e{n}", {"input": embedding_text, "model": EMBEDDING_MODEL, "dimensions": EMBEDDING_DIMENSIONS})
+    writer.close()
+
+    print(f"🧩 {web_items} webových chunků ({duplicate_count} duplicitních přeskočeno) a {len(items) - web_items} "
+          f"předmětů k embeddingu ({len(writer.paths)} souborů).")
+    state.update(stage="embedding", item_counts={"web": web_items, "csv": len(items) - web_items})
+    state["batches"]["embedding"] = [{"file": os.path.basename(path), "batch_id": None, "output": None}
+                                     for path in writer.paths]
+    save_state(state)
+
+
+def store_results(state, embedding_outputs, check_cancel, progress):
+    """
+    Fáze store: výsledky embeddingů se proudově zapisují do stínových tabulek. Každý záznam jde do DB
+    v jedné transakci se svým checkpointem, po restartu se tedy pokračuje za posledním uloženým.
+    """
+    if not state.get("discarded"):
+        # Webová stínová tabulka je kopie živé - stará verze obnovených zdrojů pryč. Jen jednou,
+        # ať po restartu nesmažeme už uložené nové záznamy.
+        for source_url in state["refreshed_sources"]:
+            check_cancel()
+            discard_next_table_rows(source_url)
+        state["discarded"] = True
+        save_state(state)
+
+    # Záznamy se čtou z items.jsonl podle pozice řádku, v paměti jsou jen offsety
+    offsets = []
+    with open(_path("items.jsonl"), "rb") as fh:
+        position = 0
+        for line in fh:
+            offsets.append(position)
+            position += len(line)
+
+    done = load_checkpoints().get("bulk", set())
+    counts = {"web": 0, "csv": 0}
+    for partition, tracker_name in (("web", "WEB"), ("csv", "CSV")):
+        progress[tracker_name].set_total(state["item_counts"][partition])
+    stored = failed = 0
+
+    with open(_path("items.jsonl"), "rb") as items_fh:
+        for custom_id, body in iter_batch_results(embedding_outputs):
+            check_cancel()
+            items_fh.seek(offsets[int(custom_id[1:])])
+            item = json.loads(items_fh.readline())
+            counts[item["partition"]] += 1
+            tracker = progress[item["partition"].upper()]
+            if custom_id in done:
+                tracker.update(counts[item["partition"]], skipped=True)
+                continue
+            if body is None:
+                failed += 1
+                tracker.error(f"Embedding selhal: {item['title'][:60]}")
+                continue
+
+            embedding = np.array(body["data"][0]["embedding"])
+            record_id = insert_into_next_table(item["title"], item["content"], embedding, item["source_file"],
+                                               item["source_url"], checkpoint=("bulk", custom_id),
+                                               partition=item["partition"])
+            for source_url in item["alt_urls"]:
+                add_alternate_source(record_id, source_url)
+            stored += 1
+            tracker.update(counts[item["partition"]])
+
+    missing = len(offsets) - sum(counts.values())
+    print(f"💾 Uloženo {stored} záznamů, {failed + missing} embeddingů selhalo nebo chybí ve výstupu.")
+
+
+def run_bulk_ingest(should_cancel=None, resuming=False, lease_owner=None):
+    """
+    Hromadná přestavba webu a CSV přes Batch API. S `resuming` naváže na uložený stav (fázi a dávky);
+    bez uloženého stavu začne sběrem znovu nad existujícími stínovými tabulkami. Zámek indexace
+    (`lease_owner`) se ověřuje stejně jako v run_ingest - průběžně a těsně před prohozením tabulek.
+    Vrací 'success', 'error', 'cancelled' nebo 'lease_lost' stejně jako run_ingest.
+    """
+    def check_cancel():
+        reason = should_cancel() if should_cancel is not None else None
+        if reason:
+            raise IngestCancelled(reason if isinstance(reason, str) else "cancelled")
+
+    progress = {"WEB": SyncProgress("WEB"), "CSV": SyncProgress("CSV")}
+    for tracker in progress.values():
+        tracker.start()
+
+    try:
+        state = load_state() if resuming else None
+        if state is None:
+            if not resuming:
+                prepare_next_table_for_update("bulk")
+                start_ingest_journal("bulk")
+            shutil.rmtree(BULK_WORK_DIR, ignore_errors=True)
+            os.makedirs(BULK_WORK_DIR)
+            state = {"stage": "collect", "batches": {}}
+            collect_sources(state, check_cancel, progress)
+        else:
+            print(f"⏯️ Hromadná přestavba navazuje ve fázi '{state['stage']}'.")
+
+        if state["stage"] == "chunking":
+            prepare_embeddings(state, run_batches(state, "chunking", CHUNKING_ENDPOINT, check_cancel))
+        if state["stage"] == "embedding":
+            run_batches(state, "embedding", EMBEDDING_ENDPOINT, check_cancel)
+            state["stage"] = "store"
+            save_state(state)
+
+        store_results(state, [_path(entry["output"]) for entry in state["batches"]["embedding"]],
+                      check_cancel, progress)
+
+        check_cancel()
+        orphaned = discard_orphaned_web_rows()
+        if orphaned:
+            print(f"🧹 Odebráno {orphaned} záznamů zdrojů, které už nejsou v seznamu URL.")
+        print("🔄 Provádím atomické prohození tabulek...")
+        build_sparse_indexes("bulk")
+        check_cancel()
+        if not swap_tables_atomic("bulk", lease_owner=lease_owner):
+            raise IngestCancelled("lease_lost")
+        if state["crawled_urls"]:
+            mark_urls_crawled(state["crawled_urls"])
+        finish_ingest_journal()
+        shutil.rmtree(BULK_WORK_DIR, ignore_errors=True)
+
+        for tracker in progress.values():
+            tracker.finish("success")
+        print("🎉 Hromadná přestavba dokončena. Data jsou LIVE.")
+        return "success"
+
+    except IngestCancelled as e:
+        # Odeslané dávky běží u OpenAI dál, 'resume' si je vyzvedne
+        print(f"⏹️ Hromadná přestavba přerušena ({e.status}), stav zůstává uložený.")
+        for tracker in progress.values():
+            tracker.finish(e.status)
+        return e.status
+
+    except Exception as e:
+        print(f"❌ Krizová chyba při hromadné přestavbě: {e}")
+        for tracker in progress.values():
+            tracker.error(f"Kritická chyba: {str(e)}")
+            tracker.finish("error")
+        return "error"
+    finally:
+        shutdown_pdf_pool()
@@ -1,86 +1,197 @@
 import os
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+import sys
+import time
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from config import GOOGLE_DRIVE_FOLDER_ID, GOOGLE_CREDENTIALS_FILE
 
 # --- Nastavení ---
 PREFIXES_TO_REMOVE = ["Copy of ", "Kopie - ", "Kopie souboru "]  # Co chceme mazat
+FOLDER_MIME = "application/vnd.google-apps.folder"
+LIST_WORKERS = 8  # Kolik složek se listuje souběžně
+UPDATE_BATCH_SIZE = 100  # Přejmenování se posílají v dávkách (limit Drive API je 100 na batch)
 
 
 # --- Připojení ---
-def get_drive_service():
+def get_drive_service(readonly=False):
+    # Knihovny Googlu načítáme až tady - běh nad fake Drive (--fake) je nepotřebuje
+    from google.oauth2 import service_account
+    from googleapiclient.discovery import build
+
     if not os.path.exists(GOOGLE_CREDENTIALS_FILE):
         print(f"❌ Chyba: Soubor {GOOGLE_CREDENTIALS_FILE} nenalezen.")
         return None
     creds = service_account.Credentials.from_service_account_file(
         GOOGLE_CREDENTIALS_FILE,
-        scopes=['https://www.googleapis.com/auth/drive'])  # Pozor: Změna scope na plný přístup (nejen readonly)
+        # Přejmenování potřebuje plný přístup, indexace (drive_source.py) si vystačí s readonly
+        scopes=['https://www.googleapis.com/auth/drive.readonly' if readonly else 'https://www.googleapis.com/auth/drive'])
     return build('drive', 'v3', credentials=creds)
 
 
-def rename_files_recursive(service, folder_id):
-    page_token = None
-    count_renamed = 0
+def cleaned_name(original_name):
+    """Název bez prvního nalezeného prefixu z PREFIXES_TO_REMOVE (stačí odstranit jeden)."""
+    for prefix in PREFIXES_TO_REMOVE:
+        if original_name.startswith(prefix):
+            return original_name[len(prefix):]
+    return original_name
 
+
+def list_folder(service, folder_id, fields="id, name, mimeType"):
+    """Všechny položky jedné složky (přes všechny stránky)."""
+    items = []
+    page_token = None
     while True:
+        response = service.files().list(
+            q=f"'{folder_id}' in parents and trashed = false",
+            fields=f"nextPageToken, files({fields})",
+            pageSize=1000,
+            pageToken=page_token
+        ).execute()
+        items.extend(response.get('files', []))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return items
+
+
+def apply_renames(service, plan):
+    """Pošle přejmenování dávkami (jeden HTTP požadavek na UPDATE_BATCH_SIZE souborů). Vrací počet úspěšných."""
+    renamed = 0
+    by_request = {}
+
+    def on_result(request_id, response, exception):
+        nonlocal renamed
+        file_id, original_name, new_name = by_request[request_id]
+        if exception is not None:
+            print(f"❌ Chyba při přejmenování {original_name}: {exception}")
+        else:
+            renamed += 1
+
+    for start in range(0, len(plan), UPDATE_BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=on_result)
+        for offset, (file_id, original_name, new_name) in enumerate(plan[start:start + UPDATE_BATCH_SIZE]):
+            request_id = str(start + offset)
+            by_request[request_id] = (file_id, original_name, new_name)
+            batch.add(service.files().update(fileId=file_id, body={'name': new_name}), request_id=request_id)
         try:
-            # Načteme soubory i složky
-            response = service.files().list(
-                q=f"'{folder_id}' in parents and trashed = false",
-                fields="nextPageToken, files(id, name, mimeType)",
-                pageToken=page_token
-            ).execute()
+            batch.execute()
         except Exception as e:
-            print(f"⚠️ Chyba při listování složky {folder_id}: {e}")
-            break
-
-        items = response.get('files', [])
-
-        for item in items:
-            original_name = item['name']
-            new_name = original_name
-
-            # 1. Kontrola a přejmenování
-            for prefix in PREFIXES_TO_REMOVE:
-                if original_name.startswith(prefix):
-                    new_name = original_name[len(prefix):]  # Ořízneme prefix
-                    break  # Stačí odstranit jeden prefix
-
-            # Pokud se název změnil, provedeme update na Disku
-            if new_name != original_name:
+            print(f"❌ Chyba při odeslání dávky přejmenování: {e}")
+    return renamed
+
+
+def rename_files_recursive(service, folder_id, dry_run=False, service_factory=None, workers=LIST_WORKERS):
+    """
+    Projde strom složek do šířky a odstraní prefixy z názvů souborů i složek.
+    Složky se listují souběžně ve vláknech; klient googleapiclient není thread-safe, proto si každé
+    vlákno vytvoří vlastní service přes `service_factory` (výchozí get_drive_service). Přejmenování se
+    posílají v dávkách z hlavního vlákna. S `dry_run=True` se jen vypíše plán.
+    Vrací počet přejmenovaných (v dry-run naplánovaných) položek.
+    """
+    service_factory = service_factory or get_drive_service
+    local = threading.local()
+
+    def list_in_thread(fid):
+        if not hasattr(local, "service"):
+            local.service = service_factory()
+        return list_folder(local.service, fid)
+
+    started = time.monotonic()
+    queue = deque([folder_id])
+    running = {}
+    pending_plan = []
+    count_renamed = 0
+    folders_listed = 0
+    items_seen = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while queue or running:
+            # Fronta složek (FIFO) = průchod do šířky; běží nejvýše `workers` listování najednou
+            while queue and len(running) < workers:
+                fid = queue.popleft()
+                running[pool.submit(list_in_thread, fid)] = fid
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                fid = running.pop(future)
                 try:
-                    print(f"✏️ Přejmenovávám: '{original_name}' -> '{new_name}'")
-                    service.files().update(
-                        fileId=item['id'],
-                        body={'name': new_name}
-                    ).execute()
-                    count_renamed += 1
+                    items = future.result()
                 except Exception as e:
-                    print(f"❌ Chyba při přejmenování {original_name}: {e}")
-
-            # 2. Pokud je to složka, zanoříme se (Rekurze)
-            if item['mimeType'] == 'application/vnd.google-apps.folder':
-                # print(f"📂 Vstupuji do: {item['name']}")
-                count_renamed += rename_files_recursive(service, item['id'])
-
-        page_token = response.get('nextPageToken')
-        if not page_token:
-            break
+                    print(f"⚠️ Chyba při listování složky {fid}: {e}")
+                    continue
+                folders_listed += 1
+                items_seen += len(items)
+
+                for item in items:
+                    new_name = cleaned_name(item['name'])
+                    if new_name != item['name']:
+                        print(f"✏️ {'[dry-run] ' if dry_run else ''}Přejmenovávám: '{item['name']}' -> '{new_name}'")
+                        pending_plan.append((item['id'], item['name'], new_name))
+
+                    if item['mimeType'] == FOLDER_MIME:
+                        queue.append(item['id'])
+
+            # Posíláme jen plné dávky, zbytek počká na další složky
+            full = len(pending_plan) - len(pending_plan) % UPDATE_BATCH_SIZE
+            if full:
+                if dry_run:
+                    count_renamed += full
+                else:
+                    count_renamed += apply_renames(service, pending_plan[:full])
+                pending_plan = pending_plan[full:]
+
+    if dry_run:
+        count_renamed += len(pending_plan)
+    else:
+        count_renamed += apply_renames(service, pending_plan)
 
+    elapsed = time.monotonic() - started
+    print(f"📂 Prošlo {folders_listed} složek a {items_seen} položek za {elapsed:.1f} s "
+          f"({items_seen / elapsed if elapsed else 0:.0f} položek/s).")
     return count_renamed
 
 
-if __name__ == "__main__":
-    print("🚀 Startuji čištění názvů na Google Disku...")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Odstranění prefixů 'Copy of' / 'Kopie' z názvů na Google Disku")
+    parser.add_argument("--dry-run", action="store_true", help="Jen vypíše plán přejmenování, nic nezapisuje")
+    parser.add_argument("--yes", action="store_true", help="Bez potvrzení")
+    parser.add_argument("--workers", type=int, default=LIST_WORKERS, help="Počet souběžně listovaných složek")
+    parser.add_argument("--fake", type=int, metavar="SOUBORU",
+                        help="Místo Google Disku použije lokální fake Drive se syntetickým stromem o tolika souborech")
+    parser.add_argument("--fake-latency-ms", type=float, default=50, help="Latence jednoho volání fake Drive")
+    args = parser.parse_args(argv)
 
-    # Varování pro jistotu
-    print("⚠️ POZOR: Tento skript reálně přejmenuje soubory na tvém Google Disku.")
-    confirm = input("Chceš pokračovat? (ano/ne): ")
+    print("🚀 Startuji čištění názvů na Google Disku...")
 
-    if confirm.lower() in ['ano', 'yes', 'y']:
+    if args.fake:
+        from fake_drive import FakeDriveService, build_synthetic_tree
+        fake = FakeDriveService(latency_ms=args.fake_latency_ms)
+        folder_id = build_synthetic_tree(fake, args.fake)
+        service, service_factory = fake, (lambda: fake)
+    else:
+        if not args.dry_run and not args.yes:
+            # Varování pro jistotu
+            print("⚠️ POZOR: Tento skript reálně přejmenuje soubory na tvém Google Disku.")
+            confirm = input("Chceš pokračovat? (ano/ne): ")
+            if confirm.lower() not in ['ano', 'yes', 'y']:
+                print("Operace zrušena.")
+                return 0
         service = get_drive_service()
-        if service:
-            total = rename_files_recursive(service, GOOGLE_DRIVE_FOLDER_ID)
-            print(f"\n🎉 Hotovo! Přejmenováno celkem {total} položek.")
+        if not service:
+            return 1
+        folder_id, service_factory = GOOGLE_DRIVE_FOLDER_ID, get_drive_service
+
+    total = rename_files_recursive(service, folder_id, dry_run=args.dry_run, service_factory=service_factory,
+                                   workers=args.workers)
+    if args.dry_run:
+        print(f"\n📝 Dry-run: k přejmenování je {total} položek, nic nebylo změněno.")
     else:
-        print("Operace zrušena.")
\ No newline at end of file
+        print(f"\n🎉 Hotovo! Přejmenováno celkem {total} položek.")
+    if args.fake:
+        print(f"📊 Volání fake Drive: {fake.calls}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
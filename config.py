@@ -7,13 +7,103 @@ load_dotenv()
 # OpenAI
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 EMBEDDING_MODEL = "text-embedding-3-small" # Novější a levnější model
-OPENAI_EMBEDDING_URL = "https://api.openai.com/v1/embeddings"
-LLM_API_URL = "https://api.openai.com/v1/chat/completions"
+EMBEDDING_DIMENSIONS = 1536  # Plná dimenze ukládaných vektorů (ingest i dotazy); změna vyžaduje přeindexování
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")  # Zátěžové testy ho přesměrují na fake server
+OPENAI_EMBEDDING_URL = f"{OPENAI_BASE_URL}/embeddings"
+LLM_API_URL = f"{OPENAI_BASE_URL}/chat/completions"
+
+# Role webového procesu: 'full' (chat + admin) nebo 'chat' (jen chat, bez admin panelu)
+APP_ROLE = os.getenv("SOFIM_ROLE", "full")
+
+# Hybridní vyhledávání (embeddingy + BM25)
+HYBRID_FUSION = os.getenv("HYBRID_FUSION", "linear")  # 'linear' nebo 'rrf'
+HYBRID_ALPHA = float(os.getenv("HYBRID_ALPHA", 0.2))  # Váha normalizovaného BM25 při lineární fúzi
+HYBRID_RRF_K = 60
+HYBRID_SHORTLIST_MIN_DOCS = 20000  # Od této velikosti korpusu se dense skóre počítá jen pro užší výběr z BM25
+HYBRID_SHORTLIST_SIZE = 2000
+# Paralelní dense sken (sharded_search.py): počet procesů na proces aplikace, 0 = vypnuto.
+# Pozor u gunicornu - každý worker má vlastní pool, celkem tedy workers × SEARCH_SHARDS procesů.
+# Shardovaný index vždy skenuje celý korpus (užší výběr z BM25 - HYBRID_SHORTLIST_* - se u něj nepoužívá).
+SEARCH_SHARDS = int(os.getenv("SEARCH_SHARDS", 0))
+SEARCH_SHARDS_MIN_DOCS = 50000  # Menší index se skenuje v jednom procesu, režie IPC by převážila
+# Zkrácené embeddingy (reduced_embeddings.py): rezidentní sken v nižší dimenzi, plné vektory (float16) jen na
+# přeskórování. Paměť indexu klesne na 1/2 + dims/1536 (při 256 dims asi dvě třetiny), latence skenu víc.
+EMBEDDING_SCAN_DIMS = int(os.getenv("EMBEDDING_SCAN_DIMS", 0))  # např. 256 nebo 512, 0 = sken v plné dimenzi
+EMBEDDING_RESCORE_CANDIDATES = 200  # Kolik nejlepších ze zkráceného skenu se přeskóruje plnými vektory
+
+CHUNK_CACHE_SIZE = 512  # Kolik naposledy použitých záznamů (text + zdroj) drží index v paměti
+
+# Skládání kontextu pro LLM (context_builder.py)
+CONTEXT_CANDIDATES = 16  # Kolik kandidátů z vyhledávání jde do výběru (MMR)
+CONTEXT_MAX_SOURCES = 8
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))  # Tokeny na zdroje v promptu
+CONTEXT_CHUNK_MAX_TOKENS = 600  # Delší chunk se zkrátí na nejrelevantnější pasáž
+CONTEXT_MMR_LAMBDA = 0.7  # 1.0 = jen relevance, nižší = víc rozmanitosti mezi zdroji
+HISTORY_TOKEN_BUDGET = 800
+
+# Ochrana /api/chat (deadlines.py): časový rozpočet požadavku a omezení souběhu na proces
+CHAT_DEADLINE_SECONDS = float(os.getenv("CHAT_DEADLINE_SECONDS", 30))  # Celý požadavek včetně čekání ve frontě
+CHAT_MAX_IN_FLIGHT = int(os.getenv("CHAT_MAX_IN_FLIGHT", 8))  # Rozpracované požadavky najednou
+CHAT_MAX_QUEUED = int(os.getenv("CHAT_MAX_QUEUED", 16))  # Kolik dalších smí čekat; ostatní hned dostanou 'busy'
+CHAT_QUEUE_WAIT_SECONDS = 2  # Nejdelší čekání ve frontě
+CHAT_REWRITE_TIMEOUT = 5
+CHAT_EMBEDDING_TIMEOUT = 5
+CHAT_REWRITE_MIN_SECONDS = 15  # Přepis dotazu jen tehdy, když z rozpočtu zbývá aspoň tolik...
+CHAT_REWRITE_MAX_LOAD = 0.75  # ...a server není vytížený nad tento podíl CHAT_MAX_IN_FLIGHT
+CHAT_GENERATION_MIN_SECONDS = 5  # Méně času na generování = odpověď jen se zdroji
+
+# Dávkové dotazy pro evaluaci odpovědí (batch_questions.py)
+BATCH_EMBEDDING_SIZE = 100  # Dotazů v jednom požadavku na embeddingy
+BATCH_SCAN_BLOCK = 64  # Dotazů skórovaných jedním maticovým součinem (paměť: blok × počet chunků × 4 B)
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 4))  # Souběžná generování odpovědí
+
+# Konverzace na serveru (conversations.py)
+CONVERSATION_SUMMARY_MAX_TOKENS = 300  # Délka průběžného shrnutí konverzace
+CONVERSATION_TTL_DAYS = 7  # Neaktivní konverzace se po této době mažou
+CONVERSATION_FOLD_WORKERS = 2  # Vlákna pro shrnování na pozadí (sdílená všemi konverzacemi)
+CONVERSATION_FOLD_MAX_PENDING = 100  # Nad tento počet čekajících shrnutí se další odloží na příští tah
+
+# Ingest - web (sitemapy a plánování crawlu, sitemaps.py)
+CRAWL_DEFAULT_INTERVAL_HOURS = int(os.getenv("CRAWL_DEFAULT_INTERVAL_HOURS", 168))  # Bez changefreq se stránka projde jednou týdně
+ADMIN_URLS_PER_PAGE = 50
+# Stav indexace přes SSE (/admin/api/status/stream). Každé otevřené spojení drží jedno vlákno serveru -
+# pod gunicornem proto gthread nebo gevent workery, ne sync. Spojení se po čase zavře a prohlížeč se připojí znovu.
+ADMIN_STREAM_MAX_SECONDS = 300  # Nejdelší doba jednoho spojení
+ADMIN_STREAM_IDLE_RETRY_SECONDS = 30  # Bez běžící indexace se pošle stav, spojení se zavře a obnoví až po této době
+ADMIN_STREAM_ACTIVITY_CHECK_SECONDS = 15  # Jak často stream zjišťuje, jestli indexace běží nebo čeká ve frontě
+
+# Ingest - hromadná přestavba přes OpenAI Batch API (bulk_ingest.py, režim 'bulk')
+BULK_WORK_DIR = os.getenv("BULK_WORK_DIR", os.path.join("data", "bulk"))  # Dávkové soubory a stav běhu
+BULK_POLL_SECONDS = int(os.getenv("BULK_POLL_SECONDS", 60))  # Jak často se ptáme na stav dávek
+BULK_MAX_REQUESTS_PER_FILE = 50000  # Limit Batch API na jeden vstupní soubor
+BULK_MAX_FILE_BYTES = 150 * 1024 * 1024  # Limit Batch API je 200 MB, necháváme rezervu
+
+# Ingest - PDF
+PDF_MAX_BYTES = int(os.getenv("PDF_MAX_BYTES", 50 * 1024 * 1024))  # Větší PDF se vůbec nestahují
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", 2))  # Počet procesů pro parsování PDF (pypdf drží GIL)
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", 0.8))  # Odhad Jaccardovy podobnosti, od které je chunk duplicitní
+
+# Ingest worker (worker.py)
+INGEST_LEASE_SECONDS = 60  # Platnost zámku jediného běžce; worker ho průběžně prodlužuje
+INGEST_POLL_SECONDS = 5  # Jak často se worker dívá do fronty úloh
+PROGRESS_FLUSH_SECONDS = 2  # Průběh indexace se do DB zapisuje nejvýše takto často
+
+# Limity OpenAI účtu (požadavky / tokeny za minutu) - sdílí je chat i indexace, viz rate_limit.py.
+# Skutečné limity se dorovnávají z hlaviček x-ratelimit-* v odpovědích.
+OPENAI_RATE_LIMITS = {
+    "gpt-4o": (500, 30000),
+    "gpt-4o-mini": (500, 200000),
+    EMBEDDING_MODEL: (3000, 1000000),
+}
+OPENAI_CHAT_RESERVE = 0.2  # Podíl kapacity, který indexace nechává volný pro chat
+OPENAI_CHAT_ACTIVE_RESERVE = 0.5  # ... a když chat právě běží v jiném procesu
+OPENAI_CHAT_MAX_WAIT = 10  # Déle chat na volné místo nečeká, požadavek se pošle i tak
+OPENAI_USAGE_SYNC_SECONDS = 2  # Jak často si procesy vyměňují spotřebu přes DB
 
 # Database
-DB_HOST = "localhost"
-DB_NAME = "sofim"
-DB_USER = "root"
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_NAME = os.getenv("DB_NAME", "sofim")  # loadtest.py používá vlastní databázi se syntetickými daty
+DB_USER = os.getenv("DB_USER", "root")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 
 # Database BACKUP
@@ -0,0 +1,156 @@
+import re
+import math
+import numpy as np
+
+from config import CONTEXT_TOKEN_BUDGET, CONTEXT_CHUNK_MAX_TOKENS, CONTEXT_MAX_SOURCES, CONTEXT_MMR_LAMBDA, \
+    HISTORY_TOKEN_BUDGET
+from lexical import tokenize
+
+# Skládání kontextu pro gpt-4o: z kandidátů vyhledávání vybere rozmanitou sadu zdrojů (MMR),
+# z každého nechá jen nejrelevantnější pasáž a celé to vejde do tokenového rozpočtu.
+# Tokeny se jen odhadují lokálně (bez tiktokenu, který si při prvním použití stahuje slovník) -
+# odhad je záměrně spíš nadsazený, aby skutečný prompt rozpočet nepřekročil.
+
+_PIECE_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_SENTENCE_RE = re.compile(r"[^.!?\n]+[.!?]*\s*|\n+")
+
+# Režie jedné zprávy v chat API (role, oddělovače)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def count_tokens(text):
+    """
+    Odhad počtu tokenů pro modely OpenAI. Slovo se počítá po ~4 bajtech UTF-8,
+    takže česká slova s diakritikou vycházejí dráž, stejně jako u skutečného BPE.
+    """
+    if not text:
+        return 0
+    return sum(max(1, math.ceil(len(piece.encode("utf-8")) / 4)) for piece in _PIECE_RE.findall(text))
+
+
+def count_message_tokens(messages):
+    return sum(count_tokens(msg["content"]) + MESSAGE_OVERHEAD_TOKENS for msg in messages)
+
+
+def best_passage(text, query_tokens, max_tokens):
+    """
+    Zkrátí text na souvislou pasáž do `max_tokens`, která obsahuje nejvíc slov dotazu.
+    Začne nejrelevantnější větou a přibírá sousední věty, dokud se vejdou. Krátký text vrátí celý.
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    sentences = [s for s in _SENTENCE_RE.findall(text) if s.strip()]
+    query_tokens = set(query_tokens)
+    scores = [len(query_tokens.intersection(tokenize(s))) for s in sentences]
+    costs = [count_tokens(s) for s in sentences]
+
+    start = end = max(range(len(sentences)), key=lambda i: scores[i])
+    used = costs[start]
+    if used > max_tokens:
+        # Jediná obří věta (typicky tabulka z PDF) - ořízneme po slovech
+        kept = []
+        used = 0
+        for word in sentences[start].split():
+            used += count_tokens(word)
+            if used > max_tokens:
+                break
+            kept.append(word)
+        return " ".join(kept) + " …"
+
+    while True:
+        # Přednost má relevantnější soused, při shodě ten následující (věta obvykle navazuje)
+        options = []
+        if end + 1 < len(sentences) and used + costs[end + 1] <= max_tokens:
+            options.append((scores[end + 1], 1, end + 1))
+        if start > 0 and used + costs[start - 1] <= max_tokens:
+            options.append((scores[start - 1], 0, start - 1))
+        if not options:
+            break
+        _, _, pick = max(options)
+        used += costs[pick]
+        start, end = min(start, pick), max(end, pick)
+
+    passage = "".join(sentences[start:end + 1]).strip()
+    return ("… " if start > 0 else "") + passage + (" …" if end < len(sentences) - 1 else "")
+
+
+def mmr_order(candidates, lambda_=CONTEXT_MMR_LAMBDA):
+    """
+    Pořadí kandidátů podle Maximal Marginal Relevance. Relevance vychází z pořadí hybridního vyhledávání
+    (to už zahrnuje BM25 i boost kódů předmětů), podobnost mezi kandidáty z jejich embeddingů.
+    """
+    if not candidates:
+        return []
+    matrix = np.vstack([np.asarray(item["vector"], dtype=np.float32) for item in candidates])
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix = matrix / norms
+    similarity = matrix @ matrix.T
+
+    relevance = 1.0 - np.arange(len(candidates)) / len(candidates)
+    max_similarity = np.zeros(len(candidates), dtype=np.float32)
+    remaining = list(range(len(candidates)))
+    order = []
+    while remaining:
+        mmr = lambda_ * relevance[remaining] - (1 - lambda_) * max_similarity[remaining]
+        best = remaining.pop(int(np.argmax(mmr)))
+        order.append(best)
+        max_similarity = np.maximum(max_similarity, similarity[best])
+    return order
+
+
+def trim_history(history, budget=HISTORY_TOKEN_BUDGET, max_messages=6):
+    """Nejnovější zprávy historie, které se vejdou do rozpočtu (pořadí zůstává chronologické)."""
+    kept = []
+    used = 0
+    for msg in reversed(history[-max_messages:]):
+        cost = count_tokens(msg["content"]) + MESSAGE_OVERHEAD_TOKENS
+        if used + cost > budget:
+            break
+        kept.append(msg)
+        used += cost
+    return list(reversed(kept))
+
+
+def format_source(idx, item):
+    source_info = item.get('source', 'Neznámý soubor')
+    title_info = item.get('title', 'Bez názvu')
+    url_info = item.get('url', '')
+
+    block = f"\n--- [ZDROJ_ID: {idx}] {title_info} (Soubor: {source_info}) ---\n"
+    if url_info:
+        block += f"Odkaz na zdroj: {url_info}\n"
+    return block + item['text'] + "\n"
+
+
+def build_context(candidates, query_text, budget=CONTEXT_TOKEN_BUDGET, chunk_max_tokens=CONTEXT_CHUNK_MAX_TOKENS,
+                  max_sources=CONTEXT_MAX_SOURCES):
+    """
+    Vybere zdroje pro prompt. Vrací (items, context_text, context_tokens); položky jsou kopie
+    záznamů indexu se zkráceným textem, takže rezidentní index zůstává nedotčený.
+    """
+    query_tokens = tokenize(query_text)
+    items = []
+    context_text = ""
+    used = 0
+    for position in mmr_order(candidates):
+        if len(items) >= max_sources or budget - used < 50:
+            break
+        candidate = candidates[position]
+        header_cost = count_tokens(format_source(len(items), dict(candidate, text="")))
+        passage_budget = min(chunk_max_tokens, budget - used - header_cost)
+        if passage_budget <= 0:
+            continue
+        passage = best_passage(candidate["text"] or "", query_tokens, passage_budget)
+        if not passage.strip():
+            continue
+        item = dict(candidate, text=passage)
+        block = format_source(len(items), item)
+        cost = count_tokens(block)
+        if used + cost > budget:
+            continue
+        items.append(item)
+        context_text += block
+        used += cost
+    return items, context_text, used
@@ -0,0 +1,111 @@
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import OPENAI_API_KEY, LLM_API_URL, CONVERSATION_SUMMARY_MAX_TOKENS, CONVERSATION_FOLD_WORKERS, \
+    CONVERSATION_FOLD_MAX_PENDING
+from database import create_conversation, get_conversation, append_conversation_turn, save_conversation_summary
+from rate_limit import post_openai
+
+# Konverzace drží server, prohlížeč posílá jen conversation_id. Do promptů (přepis dotazu i odpověď)
+# jde místo celé historie kompaktní průběžné shrnutí + poslední tah. Po každé odpovědi se ve vlákně
+# na pozadí předchozí tahy přiloží ke shrnutí (gpt-4o-mini), takže při dalším dotazu je obvykle hotovo;
+# když ještě ne, pošlou se neshrnuté tahy celé - odpověď tím nic neztratí, jen je prompt delší.
+# Shrnování běží v malém sdíleném poolu vláken; konverzace má nejvýš jedno čekající shrnutí (to si
+# tahy načte až při spuštění, takže pobere i ty novější) a při přetížení se shrnutí odloží na další tah.
+
+SUMMARY_MESSAGE_MAX_CHARS = 1500  # Dlouhé odpovědi se do shrnování posílají zkrácené
+
+_fold_pool = ThreadPoolExecutor(max_workers=CONVERSATION_FOLD_WORKERS, thread_name_prefix="fold-summary")
+_fold_pending = set()  # Konverzace s naplánovaným, zatím nedokončeným shrnutím
+_fold_lock = threading.Lock()
+
+
+def start_conversation():
+    conversation_id = uuid.uuid4().hex
+    create_conversation(conversation_id)
+    return conversation_id
+
+
+def history_messages(state):
+    """Shrnutí (jako systémová zpráva) + neshrnuté tahy ve formátu historie chatu."""
+    messages = []
+    if state["summary"]:
+        messages.append({"role": "system", "content": f"Shrnutí dosavadní konverzace: {state['summary']}"})
+    for _, user_message, assistant_message in state["turns"]:
+        messages.append({"role": "user", "content": user_message})
+        messages.append({"role": "assistant", "content": assistant_message})
+    return messages
+
+
+def load_history(conversation_id):
+    """Kompaktní historie konverzace, nebo None, pokud ji server nezná (neplatné ID, vypršela)."""
+    state = get_conversation(conversation_id)
+    return history_messages(state) if state is not None else None
+
+
+def summarize_turns(summary, turns):
+    """Přiloží tahy ke stávajícímu shrnutí. Vrací nové shrnutí, nebo None při chybě API."""
+    lines = []
+    for _, user_message, assistant_message in turns:
+        lines.append(f"Student: {user_message[:SUMMARY_MESSAGE_MAX_CHARS]}")
+        lines.append(f"Sofim: {assistant_message[:SUMMARY_MESSAGE_MAX_CHARS]}")
+
+    system_prompt = f"""
+    Udržuješ průběžné shrnutí konverzace studenta s asistentem Sofim (Studijní oddělení FIM UHK).
+    Dostaneš dosavadní shrnutí a nové výměny. Vrať AKTUALIZOVANÉ shrnutí, nic jiného.
+
+    Pravidla:
+    - Nejvýše {CONVERSATION_SUMMARY_MAX_TOKENS // 2} slov, stručné věty v češtině.
+    - Zachovej, na co se student ptá a co už mu bylo odpovězeno.
+    - ZACHOVEJ jména osob, kódy předmětů (např. OA1, ZPRO), termíny, čísla a odkazy, na které může navázat.
+    """
+
+    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
+    data = {
+        "model": "gpt-4o-mini",
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"Dosavadní shrnutí:\n{summary or '(zatím žádné)'}\n\nNové výměny:\n" + "\n".join(lines)}
+        ],
+        "temperature": 0,
+        "max_tokens": CONVERSATION_SUMMARY_MAX_TOKENS
+    }
+    # Shrnování nikdo nečeká - nebere chatu rezervu v limitech
+    response = post_openai(LLM_API_URL, headers, data, priority="background", timeout=60)
+    if response.status_code == 200:
+        return response.json()["choices"][0]["message"]["content"].strip()
+    print(f"⚠️ Shrnutí konverzace selhalo (HTTP {response.status_code})")
+    return None
+
+
+def fold_summary(conversation_id):
+    """Přiloží ke shrnutí všechny neshrnuté tahy kromě posledního (ten jde do promptu celý)."""
+    try:
+        state = get_conversation(conversation_id)
+        if state is None or len(state["turns"]) <= 1:
+            return
+        to_fold = state["turns"][:-1]
+        summary = summarize_turns(state["summary"], to_fold)
+        if summary is not None:
+            # Pokud mezitím shrnul souběžný požadavek, necháme jeho verzi
+            save_conversation_summary(conversation_id, summary, to_fold[-1][0], state["summarized_upto"])
+    except Exception as e:
+        print(f"⚠️ Shrnutí konverzace {conversation_id} selhalo: {e}")
+
+
+def _fold_pending_summary(conversation_id):
+    try:
+        fold_summary(conversation_id)
+    finally:
+        with _fold_lock:
+            _fold_pending.discard(conversation_id)
+
+
+def record_turn(conversation_id, user_message, assistant_message):
+    append_conversation_turn(conversation_id, user_message, assistant_message)
+    with _fold_lock:
+        if conversation_id in _fold_pending or len(_fold_pending) >= CONVERSATION_FOLD_MAX_PENDING:
+            return
+        _fold_pending.add(conversation_id)
+    _fold_pool.submit(_fold_pending_summary, conversation_id)
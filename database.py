@@ -1,7 +1,11 @@
 import pymysql
 import numpy as np
 import json
-from config import DB_HOST, DB_NAME, DB_USER, DB_PASSWORD
+import zlib
+import struct
+import hashlib
+from config import DB_HOST, DB_NAME, DB_USER, DB_PASSWORD, CONVERSATION_TTL_DAYS, CRAWL_DEFAULT_INTERVAL_HOURS, \
+    EMBEDDING_DIMENSIONS, INGEST_LEASE_SECONDS
 
 
 def get_db_connection():
@@ -16,8 +20,17 @@ def get_db_connection():
 
 # --- INICIALIZACE STRUKTURY DATABÁZE (PRO ADMIN PANEL) ---
 
+def _ensure_column(cursor, table_name, column, ddl):
+    cursor.execute(f"SHOW COLUMNS FROM {table_name} LIKE %s", (column,))
+    if not cursor.fetchone():
+        cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column} {ddl}")
+
+
 def init_db_schema():
-    """Vytvoří nezbytné tabulky pro chod admin panelu a sledování indexace, pokud neexistují."""
+    """
+    Vytvoří nezbytné tabulky pro chod admin panelu a sledování indexace, pokud neexistují.
+    Volá se jednou při startu procesu (web, worker), ne při každém čtení stavu.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
 
@@ -29,6 +42,29 @@ def init_db_schema():
             added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
+    # Plánování crawlu: lastmod a changefreq ze sitemapy, kdy se stránka naposledy prošla a kdy znovu
+    _ensure_column(cursor, "crawler_urls", "lastmod", "DATETIME NULL")
+    _ensure_column(cursor, "crawler_urls", "changefreq_hours", "INT NULL")
+    _ensure_column(cursor, "crawler_urls", "last_crawled_at", "DATETIME NULL")
+    _ensure_column(cursor, "crawler_urls", "next_crawl_at", "DATETIME NULL")
+    _ensure_column(cursor, "crawler_urls", "sitemap_url", "VARCHAR(500) NULL")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS crawler_sitemaps (
+            url VARCHAR(500) PRIMARY KEY,
+            url_prefix VARCHAR(500) NOT NULL DEFAULT '',
+            url_count INT NOT NULL DEFAULT 0,
+            last_imported_at DATETIME
+        )
+    """)
+    # PDF odkázaná ze stránek - podle nich se poznají PDF, na která už žádná stránka neodkazuje
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS crawler_pdf_links (
+            page_id INT NOT NULL,
+            pdf_url VARCHAR(700) NOT NULL,
+            PRIMARY KEY (page_id, pdf_url),
+            INDEX idx_pdf (pdf_url(255))
+        )
+    """)
 
     # 2. Tabulka pro sledování času a průběhu aktualizací
     cursor.execute("""
@@ -38,47 +74,395 @@ def init_db_schema():
             status VARCHAR(50),
             total_items INT DEFAULT 0,
             processed_items INT DEFAULT 0,
+            items_per_minute FLOAT,
+            eta_seconds INT,
             last_error TEXT
         )
     """)
+    # Starší instalace tabulku mají bez sloupců pro rychlost a odhad času
+    _ensure_column(cursor, "sync_status", "items_per_minute", "FLOAT")
+    _ensure_column(cursor, "sync_status", "eta_seconds", "INT")
+
+    # 3. Žurnál rozpracované indexace - umožňuje navázat po pádu (režim 'resume')
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_runs (
+            id INT PRIMARY KEY,
+            mode VARCHAR(10),
+            started_at DATETIME
+        )
+    """)
+    # Hash CSV, ke kterému patří checkpointy řádků (pořadí řádku má smysl jen ve stejném souboru)
+    _ensure_column(cursor, "ingest_runs", "csv_hash", "CHAR(40) NULL")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_checkpoints (
+            item_hash CHAR(40) PRIMARY KEY,
+            item_type VARCHAR(10),
+            item_key TEXT,
+            committed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # 4. Fronta úloh pro samostatný ingest worker (worker.py), plánované běhy a zámek jediného běžce
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_jobs (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            mode VARCHAR(10) NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'queued',
+            run_after DATETIME NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at DATETIME,
+            finished_at DATETIME,
+            owner VARCHAR(100),
+            cancel_requested TINYINT NOT NULL DEFAULT 0,
+            error TEXT,
+            INDEX idx_jobs_queue (status, run_after)
+        )
+    """)
+    # Vstup a výsledek úloh, které nejsou indexací (evaluace sad otázek, mode = EVALUATION_MODE)
+    _ensure_column(cursor, "ingest_jobs", "payload", "MEDIUMTEXT NULL")
+    _ensure_column(cursor, "ingest_jobs", "result_z", "MEDIUMBLOB NULL")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_schedules (
+            mode VARCHAR(10) PRIMARY KEY,
+            interval_minutes INT NOT NULL,
+            next_run_at DATETIME NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_lease (
+            id INT PRIMARY KEY,
+            owner VARCHAR(100),
+            expires_at DATETIME
+        )
+    """)
+
+    # 5. Token feedu změn Google Disku - odkud má příští běh indexace 'drive' pokračovat
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS drive_sync_state (
+            id INT PRIMARY KEY,
+            page_token VARCHAR(255),
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+    """)
+
+    # 6. Spotřeba OpenAI po minutách - sdílené limity mezi webem a workerem (rate_limit.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS openai_usage (
+            model VARCHAR(50),
+            minute_at DATETIME,
+            owner VARCHAR(100),
+            priority VARCHAR(10),
+            requests INT NOT NULL DEFAULT 0,
+            tokens INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (model, minute_at, owner, priority)
+        )
+    """)
+
+    # 7. Konverzace chatu - průběžné shrnutí + ještě neshrnuté tahy (conversations.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS conversations (
+            id VARCHAR(36) PRIMARY KEY,
+            summary TEXT,
+            summarized_upto INT NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_updated (updated_at)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_turns (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            conversation_id VARCHAR(36) NOT NULL,
+            user_message TEXT,
+            assistant_message MEDIUMTEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_conversation (conversation_id, id),
+            INDEX idx_created (created_at)
+        )
+    """)
 
     # Založíme výchozí stavy, ignoruje se, pokud už záznamy existují
-    cursor.execute("INSERT IGNORE INTO sync_status (sync_type, status) VALUES ('WEB', 'idle'), ('CSV', 'idle')")
+    cursor.execute(
+        "INSERT IGNORE INTO sync_status (sync_type, status) VALUES ('WEB', 'idle'), ('CSV', 'idle'), ('DRIVE', 'idle')"
+    )
+    cursor.execute("INSERT IGNORE INTO ingest_lease (id) VALUES (1)")
     conn.commit()
     conn.close()
 
 
+# --- SDÍLENÉ LIMITY OPENAI ---
+
+def sync_openai_usage(owner, usage):
+    """
+    Připíše spotřebu procesu `owner` do aktuální minuty (usage = [(model, priorita, požadavky, tokeny)])
+    a vrátí spotřebu ostatních procesů za poslední dvě minuty jako (model, minuta, priorita, požadavky, tokeny).
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    if usage:
+        cursor.executemany(
+            "INSERT INTO openai_usage (model, minute_at, owner, priority, requests, tokens) "
+            "VALUES (%s, DATE_FORMAT(NOW(), '%%Y-%%m-%%d %%H:%%i:00'), %s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE requests = requests + VALUES(requests), tokens = tokens + VALUES(tokens)",
+            [(model, owner, priority, requests, tokens) for model, priority, requests, tokens in usage]
+        )
+        cursor.execute("DELETE FROM openai_usage WHERE minute_at < NOW() - INTERVAL 10 MINUTE")
+    cursor.execute(
+        "SELECT model, minute_at, priority, SUM(requests), SUM(tokens) FROM openai_usage "
+        "WHERE owner != %s AND minute_at >= NOW() - INTERVAL 2 MINUTE GROUP BY model, minute_at, priority",
+        (owner,)
+    )
+    rows = [(model, minute, priority, int(r), int(t)) for model, minute, priority, r, t in cursor.fetchall()]
+    conn.close()
+    return rows
+
+
+# --- URL PRO CRAWLER (sitemapy, plánování) ---
+
+def list_crawler_urls(search="", page=1, per_page=50):
+    """Stránka seznamu URL pro admin panel (hledá se podřetězcem v URL). Vrací (řádky, celkový počet)."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    where, params = "", []
+    if search:
+        where, params = "WHERE url LIKE %s", [f"%{search}%"]
+    cursor.execute(f"SELECT COUNT(*) FROM crawler_urls {where}", params)
+    total = cursor.fetchone()[0]
+    cursor.execute(
+        f"SELECT id, url, lastmod, last_crawled_at, next_crawl_at FROM crawler_urls {where} "
+        f"ORDER BY id LIMIT %s OFFSET %s",
+        params + [per_page, (max(page, 1) - 1) * per_page]
+    )
+    rows = cursor.fetchall()
+    conn.close()
+    return rows, total
+
+
+def import_sitemap_entries(sitemap_url, entries, url_prefix=""):
+    """
+    Hromadně vloží URL ze sitemapy (entries = [(url, lastmod, changefreq_hours)]). U existujících URL
+    jen aktualizuje lastmod a changefreq. Vrací počet zpracovaných URL.
+    """
+    rows = [(url, lastmod, hours, sitemap_url) for url, lastmod, hours in entries if len(url) <= 500]
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    for start in range(0, len(rows), 1000):
+        cursor.executemany(
+            "INSERT INTO crawler_urls (url, lastmod, changefreq_hours, sitemap_url) VALUES (%s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE lastmod = VALUES(lastmod), "
+            "changefreq_hours = COALESCE(VALUES(changefreq_hours), changefreq_hours), sitemap_url = VALUES(sitemap_url)",
+            rows[start:start + 1000]
+        )
+    cursor.execute(
+        "REPLACE INTO crawler_sitemaps (url, url_prefix, url_count, last_imported_at) VALUES (%s, %s, %s, NOW())",
+        (sitemap_url, url_prefix, len(rows))
+    )
+    conn.close()
+    return len(rows)
+
+
+def get_sitemaps():
+    """Registrované sitemapy jako (url, url_prefix) - web sync z nich před během obnoví lastmod."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT url, url_prefix FROM crawler_sitemaps")
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+def get_due_crawler_urls():
+    """
+    URL, které je čas projít: ještě nikdy neprošlé, s prošlým next_crawl_at, nebo změněné
+    (lastmod ze sitemapy novější než poslední crawl).
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT url FROM crawler_urls WHERE next_crawl_at IS NULL OR next_crawl_at <= NOW() "
+        "OR (lastmod IS NOT NULL AND (last_crawled_at IS NULL OR lastmod > last_crawled_at)) ORDER BY id"
+    )
+    urls = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return urls
+
+
+def mark_urls_crawled(urls, default_interval_hours=CRAWL_DEFAULT_INTERVAL_HOURS):
+    """Po prohození tabulek zapíše čas crawlu a naplánuje další podle changefreq (jinak výchozí interval)."""
+    urls = list(urls)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    for start in range(0, len(urls), 500):
+        batch = urls[start:start + 500]
+        cursor.execute(
+            f"UPDATE crawler_urls SET last_crawled_at = NOW(), "
+            f"next_crawl_at = NOW() + INTERVAL COALESCE(changefreq_hours, %s) HOUR "
+            f"WHERE url IN ({', '.join(['%s'] * len(batch))})",
+            [default_interval_hours] + batch
+        )
+    conn.close()
+
+
+def reschedule_crawler_urls(url_id=None):
+    """Naplánuje URL (nebo všechny) k projití při příštím web syncu."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    if url_id is None:
+        cursor.execute("UPDATE crawler_urls SET next_crawl_at = NULL")
+    else:
+        cursor.execute("UPDATE crawler_urls SET next_crawl_at = NULL WHERE id = %s", (url_id,))
+    conn.close()
+
+
+def save_pdf_links(page_url, pdf_urls):
+    """Zapamatuje si, na která PDF stránka při posledním crawlu odkazovala."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM crawler_urls WHERE url = %s", (page_url,))
+    row = cursor.fetchone()
+    if row:
+        cursor.execute("DELETE FROM crawler_pdf_links WHERE page_id = %s", (row[0],))
+        links = [(row[0], pdf_url) for pdf_url in set(pdf_urls) if len(pdf_url) <= 700]
+        if links:
+            cursor.executemany("INSERT IGNORE INTO crawler_pdf_links (page_id, pdf_url) VALUES (%s, %s)", links)
+    conn.close()
+
+
+def pages_linking_sources(source_urls):
+    """Stránky z crawler_urls, které jsou mezi `source_urls` nebo odkazují na některé z těchto PDF."""
+    source_urls = list(source_urls)
+    if not source_urls:
+        return []
+    placeholders = ", ".join(["%s"] * len(source_urls))
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT url FROM crawler_urls WHERE url IN ({placeholders}) "
+        f"UNION SELECT c.url FROM crawler_pdf_links l JOIN crawler_urls c ON c.id = l.page_id "
+        f"WHERE l.pdf_url IN ({placeholders})",
+        source_urls + source_urls
+    )
+    pages = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return pages
+
+
+def discard_orphaned_web_rows():
+    """
+    Smaže ze stínové webové tabulky záznamy zdrojů, které už nikam nepatří - stránky odebrané
+    z crawler_urls a PDF, na která žádná stránka neodkazuje. Vrací počet smazaných záznamů.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "DELETE FROM embeddings_web_next WHERE source_url NOT IN (SELECT url FROM crawler_urls) "
+        "AND source_url NOT IN (SELECT pdf_url FROM crawler_pdf_links)"
+    )
+    deleted = cursor.rowcount
+    conn.close()
+    return deleted
+
+
+# --- KONVERZACE CHATU ---
+
+def create_conversation(conversation_id, ttl_days=CONVERSATION_TTL_DAYS):
+    """Založí novou konverzaci a při té příležitosti smaže konverzace neaktivní déle než `ttl_days`."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM conversations WHERE updated_at < NOW() - INTERVAL %s DAY", (ttl_days,))
+    # Tahy starší než TTL jsou buď už ve shrnutí, nebo patří smazané konverzaci
+    cursor.execute("DELETE FROM conversation_turns WHERE created_at < NOW() - INTERVAL %s DAY", (ttl_days,))
+    cursor.execute("INSERT INTO conversations (id, summary) VALUES (%s, '')", (conversation_id,))
+    conn.close()
+
+
+def get_conversation(conversation_id):
+    """
+    Stav konverzace: {'summary', 'summarized_upto', 'turns': [(id, dotaz, odpověď)]} - jen tahy,
+    které ještě nejsou ve shrnutí. None, pokud konverzace neexistuje (nebo vypršela).
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT summary, summarized_upto FROM conversations WHERE id = %s", (conversation_id,))
+    row = cursor.fetchone()
+    if not row:
+        conn.close()
+        return None
+    cursor.execute(
+        "SELECT id, user_message, assistant_message FROM conversation_turns "
+        "WHERE conversation_id = %s AND id > %s ORDER BY id",
+        (conversation_id, row[1])
+    )
+    turns = list(cursor.fetchall())
+    conn.close()
+    return {"summary": row[0] or "", "summarized_upto": row[1], "turns": turns}
+
+
+def append_conversation_turn(conversation_id, user_message, assistant_message):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO conversation_turns (conversation_id, user_message, assistant_message) VALUES (%s, %s, %s)",
+        (conversation_id, user_message, assistant_message)
+    )
+    cursor.execute("UPDATE conversations SET updated_at = NOW() WHERE id = %s", (conversation_id,))
+    conn.close()
+
+
+def save_conversation_summary(conversation_id, summary, summarized_upto, expected_upto):
+    """
+    Uloží nové shrnutí jen tehdy, když mezitím neuložil jiné (summarized_upto se nezměnilo).
+    Vrací True při úspěchu.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE conversations SET summary = %s, summarized_upto = %s WHERE id = %s AND summarized_upto = %s",
+        (summary, summarized_upto, conversation_id, expected_upto)
+    )
+    updated = cursor.rowcount == 1
+    conn.close()
+    return updated
+
+
 # --- FUNKCE PRO SLEDOVÁNÍ PRŮBĚHU INDEXACE ---
 
 def get_sync_status():
     """Vrátí aktuální stavy aktualizací pro admin panel."""
-    init_db_schema()
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT sync_type, last_updated, status, total_items, processed_items, last_error FROM sync_status")
+    cursor.execute(
+        "SELECT sync_type, last_updated, status, total_items, processed_items, last_error, "
+        "items_per_minute, eta_seconds FROM sync_status"
+    )
     rows = cursor.fetchall()
+    # 'running' bez platného zámku = worker spadl uprostřed běhu, stav by jinak zůstal viset
+    cursor.execute("SELECT 1 FROM ingest_lease WHERE id = 1 AND owner IS NOT NULL AND expires_at >= NOW()")
+    lease_alive = cursor.fetchone() is not None
     conn.close()
 
     return {
         row[0]: {
             "last_updated": row[1],
-            "status": row[2],
+            "status": "interrupted" if row[2] == "running" and not lease_alive else row[2],
             "total_items": row[3],
             "processed_items": row[4],
-            "last_error": row[5]
+            "last_error": row[5],
+            "items_per_minute": row[6],
+            "eta_seconds": row[7]
         } for row in rows
     }
 
 
 def set_sync_status(sync_type, status, total=0):
     """Při startu nastaví status, vynuluje progress a chyby. Při úspěchu uloží čas."""
-    init_db_schema()
     conn = get_db_connection()
     cursor = conn.cursor()
 
     if status == 'running':
         cursor.execute(
-            "UPDATE sync_status SET status = 'running', total_items = %s, processed_items = 0, last_error = NULL WHERE sync_type = %s",
+            "UPDATE sync_status SET status = 'running', total_items = %s, processed_items = 0, last_error = NULL, "
+            "items_per_minute = NULL, eta_seconds = NULL WHERE sync_type = %s",
             (total, sync_type)
         )
     elif status == 'success':
@@ -96,11 +480,15 @@ def set_sync_status(sync_type, status, total=0):
     conn.close()
 
 
-def update_sync_progress(sync_type, processed_count):
-    """Aktualizuje počet zpracovaných položek pro progress bar."""
+def flush_sync_progress(sync_type, total, processed, items_per_minute, eta_seconds, new_errors=""):
+    """Jedním UPDATE zapíše průběh nasbíraný v paměti (viz progress.SyncProgress)."""
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("UPDATE sync_status SET processed_items = %s WHERE sync_type = %s", (processed_count, sync_type))
+    cursor.execute(
+        "UPDATE sync_status SET total_items = %s, processed_items = %s, items_per_minute = %s, eta_seconds = %s, "
+        "last_error = IF(%s = '', last_error, CONCAT(IFNULL(last_error, ''), %s)) WHERE sync_type = %s",
+        (total, processed, items_per_minute, eta_seconds, new_errors, new_errors, sync_type)
+    )
     conn.commit()
     conn.close()
 
@@ -117,27 +505,674 @@ def log_sync_error(sync_type, error_msg):
     conn.close()
 
 
+# --- FRONTA ÚLOH A ZÁMEK (LEASE) PRO INGEST WORKER ---
+
+# Evaluace sady otázek z admin panelu (batch_questions.py). Jde stejnou frontou jako indexace - worker ji
+# převezme pod zámkem, dá se zrušit a po pádu workeru skončí jako 'interrupted'.
+EVALUATION_MODE = "evaluate"
+
+
+def acquire_ingest_lease(owner, ttl_seconds):
+    """Získá (nebo prodlouží) zámek jediného běžce. Propadlý zámek po spadlém workeru lze převzít."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE ingest_lease SET owner = %s, expires_at = NOW() + INTERVAL %s SECOND "
+        "WHERE id = 1 AND (owner IS NULL OR owner = %s OR expires_at < NOW())",
+        (owner, ttl_seconds, owner)
+    )
+    acquired = cursor.rowcount == 1
+    conn.close()
+    return acquired
+
+
+def release_ingest_lease(owner):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE ingest_lease SET owner = NULL, expires_at = NULL WHERE id = 1 AND owner = %s", (owner,))
+    conn.close()
+
+
+def is_ingest_running():
+    """Indexace běží, pokud nějaký worker drží nepropadlý zámek."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM ingest_lease WHERE id = 1 AND owner IS NOT NULL AND expires_at >= NOW()")
+    running = cursor.fetchone() is not None
+    conn.close()
+    return running
+
+
+def enqueue_ingest_job(mode, run_after=None, payload=None):
+    """Zařadí indexaci (nebo evaluaci s `payload`) do fronty. Vrací ID úlohy."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    if run_after:
+        cursor.execute("INSERT INTO ingest_jobs (mode, run_after, payload) VALUES (%s, %s, %s)",
+                       (mode, run_after, payload))
+    else:
+        cursor.execute("INSERT INTO ingest_jobs (mode, run_after, payload) VALUES (%s, NOW(), %s)", (mode, payload))
+    job_id = cursor.lastrowid
+    conn.close()
+    return job_id
+
+
+def claim_next_job(owner):
+    """Převezme nejstarší splatnou úlohu z fronty. Vrací (id, mode) nebo None."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        conn.begin()
+        cursor.execute(
+            "SELECT id, mode FROM ingest_jobs WHERE status = 'queued' AND run_after <= NOW() "
+            "ORDER BY run_after, id LIMIT 1 FOR UPDATE"
+        )
+        row = cursor.fetchone()
+        if row:
+            cursor.execute(
+                "UPDATE ingest_jobs SET status = 'running', started_at = NOW(), owner = %s WHERE id = %s",
+                (owner, row[0])
+            )
+        conn.commit()
+        return row
+    finally:
+        conn.close()
+
+
+def get_job_payload(job_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT payload FROM ingest_jobs WHERE id = %s", (job_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+
+def save_job_result(job_id, text):
+    """Uloží (komprimovaný) výsledek úlohy, např. JSONL evaluace."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE ingest_jobs SET result_z = %s WHERE id = %s", (compress_chunk(text), job_id))
+    conn.close()
+
+
+def get_job_result(job_id, mode=None):
+    """Výsledek hotové úlohy (volitelně jen daného režimu), nebo None."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT mode, result_z FROM ingest_jobs WHERE id = %s AND status = 'done' AND result_z IS NOT NULL",
+        (job_id,)
+    )
+    row = cursor.fetchone()
+    conn.close()
+    if not row or (mode is not None and row[0] != mode):
+        return None
+    return chunk_text(None, row[1])
+
+
+def list_recent_jobs(mode, limit=10):
+    """Posledních `limit` úloh daného režimu (nejnovější první) pro admin panel."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT id, status, created_at, finished_at, error, result_z IS NOT NULL FROM ingest_jobs "
+        "WHERE mode = %s ORDER BY id DESC LIMIT %s",
+        (mode, limit)
+    )
+    rows = cursor.fetchall()
+    conn.close()
+    return [
+        {"id": r[0], "status": r[1], "created_at": r[2], "finished_at": r[3], "error": r[4], "has_result": bool(r[5])}
+        for r in rows
+    ]
+
+
+def finish_job(job_id, status, error=None):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE ingest_jobs SET status = %s, finished_at = NOW(), error = %s WHERE id = %s",
+        (status, error, job_id)
+    )
+    conn.close()
+
+
+def requeue_orphaned_jobs(owner):
+    """
+    Úlohy ve stavu 'running', které nepatří držiteli zámku, po sobě nechal spadlý worker.
+    Označíme je jako přerušené a vrátíme jejich počet (worker pak případně zařadí navázání).
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE ingest_jobs SET status = 'interrupted', finished_at = NOW() "
+        "WHERE status = 'running' AND (owner IS NULL OR owner != %s)",
+        (owner,)
+    )
+    orphaned = cursor.rowcount
+    conn.close()
+    return orphaned
+
+
+def request_job_cancel(job_id):
+    """Čekající úlohu rovnou zruší, běžící požádá o zrušení (worker ho převezme při nejbližším heartbeatu)."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE ingest_jobs SET status = 'cancelled', finished_at = NOW() WHERE id = %s AND status = 'queued'",
+        (job_id,)
+    )
+    cursor.execute("UPDATE ingest_jobs SET cancel_requested = 1 WHERE id = %s AND status = 'running'", (job_id,))
+    conn.close()
+
+
+def is_cancel_requested(job_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT cancel_requested FROM ingest_jobs WHERE id = %s", (job_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return bool(row and row[0])
+
+
+def get_pending_jobs():
+    """Vrátí čekající a běžící úlohy pro admin panel."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT id, mode, status, run_after, cancel_requested FROM ingest_jobs "
+        "WHERE status IN ('queued', 'running') ORDER BY run_after, id"
+    )
+    rows = cursor.fetchall()
+    conn.close()
+    return [
+        {"id": r[0], "mode": r[1], "status": r[2], "run_after": r[3], "cancel_requested": bool(r[4])} for r in rows
+    ]
+
+
+def set_ingest_schedule(mode, interval_minutes):
+    """Naplánuje pravidelný běh daného režimu (první běh za jeden interval)."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "REPLACE INTO ingest_schedules (mode, interval_minutes, next_run_at) "
+        "VALUES (%s, %s, NOW() + INTERVAL %s MINUTE)",
+        (mode, interval_minutes, interval_minutes)
+    )
+    conn.close()
+
+
+def remove_ingest_schedule(mode):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM ingest_schedules WHERE mode = %s", (mode,))
+    conn.close()
+
+
+def enqueue_due_schedules():
+    """Splatné plánované běhy přesune do fronty a posune jejich další termín. Vrací seznam zařazených režimů."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        conn.begin()
+        cursor.execute("SELECT mode, interval_minutes FROM ingest_schedules WHERE next_run_at <= NOW() FOR UPDATE")
+        due = cursor.fetchall()
+        for mode, interval_minutes in due:
+            cursor.execute("INSERT INTO ingest_jobs (mode, run_after) VALUES (%s, NOW())", (mode,))
+            cursor.execute(
+                "UPDATE ingest_schedules SET next_run_at = NOW() + INTERVAL %s MINUTE WHERE mode = %s",
+                (interval_minutes, mode)
+            )
+        conn.commit()
+        return [mode for mode, _ in due]
+    finally:
+        conn.close()
+
+
+# --- ŽURNÁL INDEXACE (CHECKPOINTY PRO NAVÁZÁNÍ PO PÁDU) ---
+
+def _checkpoint_hash(item_type, item_key):
+    return hashlib.sha1(f"{item_type}:{item_key}".encode("utf-8")).hexdigest()
+
+
+def start_ingest_journal(mode):
+    """Založí nový žurnál pro běh v daném režimu (staré checkpointy zahodí)."""
+    init_db_schema()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM ingest_checkpoints")
+    cursor.execute("REPLACE INTO ingest_runs (id, mode, started_at) VALUES (1, %s, NOW())", (mode,))
+    conn.close()
+
+
+def get_resumable_run():
+    """Vrátí režim nedokončeného běhu, na který lze navázat, jinak None."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SHOW TABLES LIKE 'ingest_runs'")
+        if not cursor.fetchone():
+            return None
+        cursor.execute("SELECT mode FROM ingest_runs WHERE id = 1")
+        row = cursor.fetchone()
+        if not row:
+            return None
+
+        # Navázat lze jen tehdy, pokud stínové tabulky všech oddílů běhu ještě existují
+        for partition in partitions_for_mode(row[0]):
+            cursor.execute("SHOW TABLES LIKE %s", (f"embeddings_{partition}_next",))
+            if not cursor.fetchone():
+                return None
+        return row[0]
+    finally:
+        conn.close()
+
+
+def sync_csv_journal(csv_hash):
+    """
+    Checkpointy CSV jsou pořadí řádků a platí jen pro soubor, ke kterému byly zapsané. Pokud se CSV
+    od hashe uloženého v žurnálu změnilo (např. nový upload mezi pádem a navázáním), vyprázdní stínovou
+    tabulku CSV a zahodí její checkpointy. Uloží nový hash. Vrací True, pokud se fáze CSV začíná znovu.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT csv_hash FROM ingest_runs WHERE id = 1")
+        row = cursor.fetchone()
+        if row and row[0] == csv_hash:
+            return False
+
+        conn.begin()
+        cursor.execute("DELETE FROM ingest_checkpoints WHERE item_type = 'csv'")
+        restarted = cursor.rowcount > 0
+        cursor.execute("DELETE FROM embeddings_csv_next")
+        cursor.execute("UPDATE ingest_runs SET csv_hash = %s WHERE id = 1", (csv_hash,))
+        conn.commit()
+        return restarted
+    finally:
+        conn.close()
+
+
+def load_checkpoints():
+    """Vrátí slovník {item_type: set(item_key)} všech položek, které už jsou celé ve stínové tabulce."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT item_type, item_key FROM ingest_checkpoints")
+    rows = cursor.fetchall()
+    conn.close()
+
+    done = {}
+    for item_type, item_key in rows:
+        done.setdefault(item_type, set()).add(item_key)
+    return done
+
+
+def mark_checkpoint(item_type, item_key, cursor=None):
+    """Zapíše položku (URL, PDF, řádek CSV) jako kompletně uloženou ve stínové tabulce."""
+    sql = "INSERT IGNORE INTO ingest_checkpoints (item_hash, item_type, item_key) VALUES (%s, %s, %s)"
+    params = (_checkpoint_hash(item_type, item_key), item_type, item_key)
+    if cursor is not None:
+        cursor.execute(sql, params)
+        return
+
+    conn = get_db_connection()
+    conn.cursor().execute(sql, params)
+    conn.close()
+
+
+def discard_next_table_rows(source_url, partition="web"):
+    """
+    Smaže ze stínové tabulky oddílu záznamy zdroje - nedokončené zbytky před opětovným zpracováním po pádu,
+    u přírůstkových oddílů i starou verzi změněného nebo smazaného souboru.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"DELETE FROM embeddings_{partition}_next WHERE source_url = %s", (source_url,))
+    conn.close()
+
+
+def discard_unlisted_next_table_rows(source_urls, partition="drive"):
+    """
+    Smaže ze stínové tabulky oddílu záznamy zdrojů, které nejsou v `source_urls` (úplný výpis zdroje dat) -
+    např. soubory z Disku smazané mezi nedokončeným prvním během a dalším úplným výpisem.
+    Vrací počet smazaných záznamů.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT DISTINCT source_url FROM embeddings_{partition}_next")
+    stale = [row[0] for row in cursor.fetchall() if row[0] not in source_urls]
+    deleted = 0
+    for start in range(0, len(stale), 500):
+        batch = stale[start:start + 500]
+        placeholders = ", ".join(["%s"] * len(batch))
+        cursor.execute(f"DELETE FROM embeddings_{partition}_next WHERE source_url IN ({placeholders})", batch)
+        deleted += cursor.rowcount
+    conn.close()
+    return deleted
+
+
+def next_table_alternate_sources(source_url, partition="web"):
+    """Další zdroje (alt_urls) připsané k záznamům zdroje ve stínové tabulce."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT alt_urls FROM embeddings_{partition}_next WHERE source_url = %s AND alt_urls IS NOT NULL",
+        (source_url,)
+    )
+    sources = {url for row in cursor.fetchall() for url in row[0].split("\n") if url}
+    conn.close()
+    return sources
+
+
+def get_drive_page_token():
+    """Token feedu změn z posledního úspěšného běhu 'drive', nebo None (ještě neproběhl)."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT page_token FROM drive_sync_state WHERE id = 1")
+    row = cursor.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+
+def save_drive_page_token(page_token):
+    """Uloží se až po prohození tabulek - při pádu se změny od starého tokenu zpracují znovu."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("REPLACE INTO drive_sync_state (id, page_token) VALUES (1, %s)", (page_token,))
+    conn.close()
+
+
+def finish_ingest_journal():
+    """Po úspěšném prohození tabulek už není na co navazovat."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM ingest_checkpoints")
+    cursor.execute("DELETE FROM ingest_runs")
+    conn.close()
+
+
+# --- ODDÍLY PODLE ZDROJE (PARTITIONS) ---
+# Každý zdroj má vlastní živou tabulku embeddings_<oddíl> a při indexaci stínovou embeddings_<oddíl>_next.
+# Pohled 'embeddings' je spojuje dohromady. Částečná aktualizace tak přestaví a prohodí jen svůj oddíl,
+# aniž by kopírovala zbytek korpusu. ID se mezi oddíly nepřekrývají díky počátečnímu AUTO_INCREMENT.
+
+PARTITIONS = {
+    "web": 1,
+    "csv": 500000001,
+    "drive": 1000000001,
+}
+
+MODE_PARTITIONS = {
+    "all": ["web", "csv"],
+    "web": ["web"],
+    "csv": ["csv"],
+    "drive": ["drive"],
+    "bulk": ["web", "csv"],  # Jako 'all', ale přes OpenAI Batch API (bulk_ingest.py)
+}
+
+# Oddíly, které se aktualizují přírůstkově: stínová tabulka začíná jako kopie živé
+# a ingest v ní jen smaže a znovu vloží změněné zdroje (web podle plánu crawlu, Google Disk podle feedu změn)
+INCREMENTAL_PARTITIONS = ["web", "drive"]
+
+STAG_SOURCE_FILE = "STAG Export"
+
+
+def partitions_for_mode(mode):
+    return MODE_PARTITIONS.get(mode, [])
+
+
+def _create_partition_table(cursor, table_name, partition):
+    cursor.execute(f"""
+        CREATE TABLE {table_name} (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            title VARCHAR(255),
+            chunk TEXT,
+            chunk_z MEDIUMBLOB,
+            embedding JSON,
+            source_file VARCHAR(255),
+            source_url VARCHAR(500),
+            alt_urls TEXT
+        ) AUTO_INCREMENT = {PARTITIONS[partition]}
+    """)
+
+
+def _table_type(cursor, table_name):
+    cursor.execute(
+        "SELECT TABLE_TYPE FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (table_name,)
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def ensure_partitions():
+    """
+    Založí živé tabulky oddílů, tabulku generací a pohled 'embeddings'.
+    Starou jednolitou tabulku 'embeddings' jednorázově rozdělí do oddílů.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS embedding_generations (
+            partition_name VARCHAR(20) PRIMARY KEY,
+            generation INT DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Lexikální index (BM25 postings) pro každý oddíl, počítá se při indexaci
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sparse_indexes (
+            partition_name VARCHAR(20) PRIMARY KEY,
+            generation INT NOT NULL,
+            data LONGBLOB
+        )
+    """)
+
+    for partition in PARTITIONS:
+        if not _table_type(cursor, f"embeddings_{partition}"):
+            _create_partition_table(cursor, f"embeddings_{partition}", partition)
+        _ensure_column(cursor, f"embeddings_{partition}", "alt_urls", "TEXT")
+        _ensure_column(cursor, f"embeddings_{partition}", "chunk_z", "MEDIUMBLOB")
+        cursor.execute("INSERT IGNORE INTO embedding_generations (partition_name) VALUES (%s)", (partition,))
+
+    legacy = _table_type(cursor, "embeddings") == "BASE TABLE"
+    if legacy:
+        print("🔀 Převádím starou tabulku 'embeddings' na oddíly podle zdroje...")
+        cursor.execute("SHOW COLUMNS FROM embeddings LIKE 'source_url'")
+        url_col = "source_url" if cursor.fetchone() else "''"
+        cursor.execute(
+            f"INSERT INTO embeddings_web (title, chunk, embedding, source_file, source_url) "
+            f"SELECT title, chunk, embedding, source_file, {url_col} FROM embeddings WHERE source_file != %s",
+            (STAG_SOURCE_FILE,)
+        )
+        cursor.execute(
+            f"INSERT INTO embeddings_csv (title, chunk, embedding, source_file, source_url) "
+            f"SELECT title, chunk, embedding, source_file, {url_col} FROM embeddings WHERE source_file = %s",
+            (STAG_SOURCE_FILE,)
+        )
+        cursor.execute("DROP TABLE embeddings")
+
+    # Pohled se přegeneruje vždy - po přidání nového oddílu musí zahrnout i jeho tabulku
+    union = " UNION ALL ".join(
+        f"SELECT id, title, chunk, chunk_z, embedding, source_file, source_url FROM embeddings_{p}" for p in PARTITIONS
+    )
+    cursor.execute(f"CREATE OR REPLACE VIEW embeddings AS {union}")
+
+    conn.close()
+
+
+def get_embedding_generations():
+    """Vrátí {oddíl: generace}. Generace se zvýší při každém prohození oddílu - chatbot podle ní pozná, co znovu načíst."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT partition_name, generation FROM embedding_generations")
+        return {row[0]: row[1] for row in cursor.fetchall()}
+    except pymysql.err.ProgrammingError:
+        # Tabulka ještě neexistuje (žádná indexace zatím neproběhla)
+        return {}
+    finally:
+        conn.close()
+
+
+def load_partition_texts(partition, shadow=False):
+    """Vrátí (id, title, chunk) všech záznamů oddílu - živé, nebo se `shadow=True` stínové tabulky."""
+    table_name = f"embeddings_{partition}_next" if shadow else f"embeddings_{partition}"
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT id, title, chunk, chunk_z FROM {table_name}")
+    rows = [(record_id, title, chunk_text(chunk, chunk_z))
+            for record_id, title, chunk, chunk_z in cursor.fetchall()]
+    conn.close()
+    return rows
+
+
+def load_next_table_sources(partition="web"):
+    """Vrátí (id, chunk, source_url) už uložených záznamů ze stínové tabulky oddílu (pro navázání přerušeného běhu)."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT id, chunk, chunk_z, source_url FROM embeddings_{partition}_next")
+    rows = [(record_id, chunk_text(chunk, chunk_z), source_url)
+            for record_id, chunk, chunk_z, source_url in cursor.fetchall()]
+    conn.close()
+    return rows
+
+
+def save_sparse_index(partition, data, generation):
+    """Uloží zkomprimované BM25 postings oddílu pro danou generaci."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "REPLACE INTO sparse_indexes (partition_name, generation, data) VALUES (%s, %s, %s)",
+        (partition, generation, data)
+    )
+    conn.close()
+
+
+def load_sparse_index(partition):
+    """Vrátí (generace, data) uloženého BM25 indexu oddílu, nebo None."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT generation, data FROM sparse_indexes WHERE partition_name = %s", (partition,))
+        return cursor.fetchone()
+    except pymysql.err.ProgrammingError:
+        return None
+    finally:
+        conn.close()
+
+
 # --- STANDARDNÍ ČTENÍ (PRO CHATBOTA) ---
+# Rezidentní index chatbota drží jen ID, vektory a slova z názvů (load_partition_vectors); text a zdroje
+# vítězných záznamů si dotahuje podle primárního klíče (fetch_chunks). Text chunku se ukládá
+# zkomprimovaný ve sloupci chunk_z - starší záznamy mají ještě čitelný sloupec chunk.
+
+def compress_chunk(text):
+    """Text chunku ve formátu MySQL COMPRESS() (4 B délka + zlib), v SQL ho tedy přečte UNCOMPRESS(chunk_z)."""
+    raw = (text or "").encode("utf-8")
+    return struct.pack("<I", len(raw)) + zlib.compress(raw) if raw else b""
+
+
+def chunk_text(chunk, chunk_z):
+    """Text záznamu ze sloupců chunk / chunk_z (podle toho, kterým způsobem byl uložený)."""
+    if chunk_z is None:
+        return chunk
+    return zlib.decompress(chunk_z[4:]).decode("utf-8") if chunk_z else ""
+
+
+# Otisk záznamu (název + text) spočítaný v MySQL. Rezidentní index si ho drží ke každému ID a podle něj
+# pozná, že fetch_chunks vrátil pod stejným ID jiný záznam - CSV oddíl po přestavbě čísluje znovu od začátku.
+RECORD_CHECKSUM_SQL = "CRC32(CONCAT_WS('|', title, chunk, chunk_z))"
+
+
+def _partition_for_id(record_id):
+    # Rozsahy ID oddílů se nepřekrývají (počáteční AUTO_INCREMENT v PARTITIONS)
+    return max((start, partition) for partition, start in PARTITIONS.items() if start <= record_id)[1]
+
+
+def load_partition_vectors(partition):
+    """
+    Pro rezidentní index: (ID jako int64 pole, názvy, float32 matice vektorů, otisky záznamů jako uint32 pole)
+    živé tabulky oddílu. Text ani zdroje se nenačítají, paměť chatbota tak nezávisí na objemu indexovaného textu.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT id, title, embedding, {RECORD_CHECKSUM_SQL} FROM embeddings_{partition}")
+    ids, titles, vectors, checksums = [], [], [], []
+    for record_id, title, embedding_str, checksum in cursor.fetchall():
+        try:
+            vectors.append(np.array(json.loads(embedding_str), dtype=np.float32))
+        except (json.JSONDecodeError, TypeError):
+            continue
+        ids.append(record_id)
+        titles.append(title)
+        checksums.append(checksum)
+    conn.close()
+
+    matrix = np.vstack(vectors) if vectors else np.zeros((0, EMBEDDING_DIMENSIONS), dtype=np.float32)
+    return np.array(ids, dtype=np.int64), titles, matrix, np.array(checksums, dtype=np.uint32)
+
+
+def fetch_chunks(ids):
+    """
+    Text a zdroj záznamů podle primárního klíče (z živých tabulek oddílů). Vrací {id: záznam}; záznam nese
+    i další zdroje téhož textu ('alt_urls') a 'checksum' (RECORD_CHECKSUM_SQL) pro kontrolu proti rezidentnímu indexu.
+    """
+    by_partition = {}
+    for record_id in ids:
+        by_partition.setdefault(_partition_for_id(record_id), []).append(record_id)
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    records = {}
+    for partition, partition_ids in by_partition.items():
+        placeholders = ", ".join(["%s"] * len(partition_ids))
+        cursor.execute(
+            f"SELECT id, title, chunk, chunk_z, source_file, source_url, alt_urls, {RECORD_CHECKSUM_SQL} "
+            f"FROM embeddings_{partition} WHERE id IN ({placeholders})", partition_ids
+        )
+        for record_id, title, chunk, chunk_z, source_file, source_url, alt_urls, checksum in cursor.fetchall():
+            records[record_id] = {
+                "id": record_id,
+                "title": title,
+                "text": chunk_text(chunk, chunk_z),
+                "source": source_file,
+                "url": source_url or "",
+                "alt_urls": [url for url in (alt_urls or "").split("\n") if url],
+                "checksum": checksum
+            }
+    conn.close()
+    return records
 
-def load_embeddings_from_db():
-    """Chatbot vždy čte z tabulky 'embeddings' bez ohledu na to, co se děje na pozadí."""
+
+def load_embeddings_from_db(partition=None):
+    """
+    Všechny záznamy včetně textu (pohled 'embeddings', případně jen jeden oddíl) - pro nástroje
+    a databázi z doby před oddíly. Chatbot používá load_partition_vectors + fetch_chunks.
+    """
+    table_name = f"embeddings_{partition}" if partition else "embeddings"
     conn = get_db_connection()
     cursor = conn.cursor()
 
     # Zkontrolujeme, jestli tabulka existuje (pro první spuštění)
-    cursor.execute("SHOW TABLES LIKE 'embeddings'")
+    cursor.execute("SHOW TABLES LIKE %s", (table_name,))
     if not cursor.fetchone():
         conn.close()
         return []
 
     # Zkontrolujeme, zda jsi už ručně přidal sloupec source_url
-    cursor.execute("SHOW COLUMNS FROM embeddings LIKE 'source_url'")
+    cursor.execute(f"SHOW COLUMNS FROM {table_name} LIKE 'source_url'")
     has_source_url = cursor.fetchone() is not None
+    cursor.execute(f"SHOW COLUMNS FROM {table_name} LIKE 'chunk_z'")
+    chunk_columns = "chunk, chunk_z" if cursor.fetchone() else "chunk, NULL"
 
     if has_source_url:
-        cursor.execute("SELECT id, title, chunk, embedding, source_file, source_url FROM embeddings")
+        cursor.execute(f"SELECT id, title, {chunk_columns}, embedding, source_file, source_url FROM {table_name}")
     else:
-        cursor.execute("SELECT id, title, chunk, embedding, source_file FROM embeddings")
+        cursor.execute(f"SELECT id, title, {chunk_columns}, embedding, source_file FROM {table_name}")
 
     rows = cursor.fetchall()
     conn.close()
@@ -145,9 +1180,9 @@ def load_embeddings_from_db():
     embeddings = []
     for row in rows:
         if has_source_url:
-            record_id, title, chunk, embedding_str, source_file, source_url = row
+            record_id, title, chunk, chunk_z, embedding_str, source_file, source_url = row
         else:
-            record_id, title, chunk, embedding_str, source_file = row
+            record_id, title, chunk, chunk_z, embedding_str, source_file = row
             source_url = ""
 
         try:
@@ -158,7 +1193,7 @@ def load_embeddings_from_db():
         embeddings.append({
             "id": record_id,
             "title": title,
-            "text": chunk,
+            "text": chunk_text(chunk, chunk_z),
             "vector": embedding_array,
             "source": source_file,
             "url": source_url
@@ -167,78 +1202,104 @@ def load_embeddings_from_db():
     return embeddings
 
 
-# --- LOGIKA PRO ZERO-DOWNTIME INGEST (VČETNĚ ČÁSTEČNÉHO UPDATE) ---
+# --- LOGIKA PRO ZERO-DOWNTIME INGEST (PO ODDÍLECH) ---
 
 def prepare_next_table_for_update(mode="all"):
-    """Vytvoří stínovou tabulku - buď prázdnou, nebo jako kopii živé pro částečný update."""
+    """
+    Vytvoří stínové tabulky jen pro oddíly, které se budou přestavovat. Běžné oddíly začínají prázdné,
+    přírůstkové (INCREMENTAL_PARTITIONS) jako kopie živé tabulky včetně ID.
+    """
+    ensure_partitions()
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    # Zkontrolujeme, jestli už existuje hlavní "ostrá" tabulka
-    cursor.execute("SHOW TABLES LIKE 'embeddings'")
-    live_exists = cursor.fetchone()
-
-    # Smažeme případné pozůstatky z minulého nepovedeného běhu
-    cursor.execute("DROP TABLE IF EXISTS embeddings_next")
-
-    if not live_exists or mode == "all":
-        # Čistý stůl (Kompletní reload nebo úplně první spuštění databáze)
-        # Zde už rovnou počítáme s novým sloupcem source_url
-        cursor.execute("""
-            CREATE TABLE embeddings_next (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                title VARCHAR(255),
-                chunk TEXT,
-                embedding JSON,
-                source_file VARCHAR(255),
-                source_url VARCHAR(500)
+    for partition in partitions_for_mode(mode):
+        # Smažeme případné pozůstatky z minulého nepovedeného běhu
+        cursor.execute(f"DROP TABLE IF EXISTS embeddings_{partition}_next")
+        _create_partition_table(cursor, f"embeddings_{partition}_next", partition)
+        if partition in INCREMENTAL_PARTITIONS:
+            columns = "id, title, chunk, chunk_z, embedding, source_file, source_url, alt_urls"
+            cursor.execute(
+                f"INSERT INTO embeddings_{partition}_next ({columns}) SELECT {columns} FROM embeddings_{partition}"
             )
-        """)
-    else:
-        # Částečný update: Vytvoříme stínovou tabulku jako přesnou kopii té stávající
-        # Pokud jsi přidal sloupec do 'embeddings', tak LIKE ho přenese i do 'embeddings_next'
-        cursor.execute("CREATE TABLE embeddings_next LIKE embeddings")
-        cursor.execute("INSERT INTO embeddings_next SELECT * FROM embeddings")
-
-        # Nyní vymažeme z kopie ta data, která se chystáme nahradit čerstvými
-        if mode == "web":
-            # Aktualizujeme jen weby, takže smažeme vše, co NENÍ STAG Export
-            cursor.execute("DELETE FROM embeddings_next WHERE source_file != 'STAG Export'")
-        elif mode == "csv":
-            # Aktualizujeme jen STAG CSV, takže smažeme záznamy ze STAGu (ponecháme weby)
-            cursor.execute("DELETE FROM embeddings_next WHERE source_file = 'STAG Export'")
 
     conn.close()
 
 
-def insert_into_next_table(title, chunk, embedding, source_file, source_url=""):
-    """Vkládá data do STÍNOVÉ tabulky."""
+def insert_into_next_table(title, chunk, embedding, source_file, source_url="", checkpoint=None, partition="web"):
+    """
+    Vkládá data do STÍNOVÉ tabulky daného oddílu a vrací ID nového záznamu.
+    S `checkpoint=(item_type, item_key)` se záznam i checkpoint zapíší v jedné transakci.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
     embedding_json = json.dumps(embedding.tolist())
+    if checkpoint:
+        conn.begin()
     cursor.execute(
-        "INSERT INTO embeddings_next (title, chunk, embedding, source_file, source_url) VALUES (%s, %s, %s, %s, %s)",
-        (title, chunk, embedding_json, source_file, source_url)
+        f"INSERT INTO embeddings_{partition}_next (title, chunk_z, embedding, source_file, source_url) "
+        f"VALUES (%s, %s, %s, %s, %s)",
+        (title, compress_chunk(chunk), embedding_json, source_file, source_url)
     )
+    record_id = cursor.lastrowid
+    if checkpoint:
+        mark_checkpoint(*checkpoint, cursor=cursor)
+        conn.commit()
     conn.close()
+    return record_id
 
 
-def swap_tables_atomic():
-    """Provede bleskové prohození tabulek."""
+def add_alternate_source(record_id, source_url, partition="web"):
+    """Připíše k záznamu ve stínové tabulce další zdroj, na kterém se tentýž (téměř shodný) text vyskytl."""
     conn = get_db_connection()
     cursor = conn.cursor()
+    cursor.execute(
+        f"UPDATE embeddings_{partition}_next SET alt_urls = CONCAT_WS('\\n', alt_urls, %s) WHERE id = %s",
+        (source_url, record_id)
+    )
+    conn.close()
 
-    # Zkontrolujeme, jestli existuje ostrá tabulka 'embeddings'
-    cursor.execute("SHOW TABLES LIKE 'embeddings'")
-    exists = cursor.fetchone()
 
-    if exists:
-        # Pokud existuje, provedeme rotaci: Live -> Backup, Next -> Live
-        cursor.execute("DROP TABLE IF EXISTS embeddings_backup")
-        cursor.execute("RENAME TABLE embeddings TO embeddings_backup, embeddings_next TO embeddings")
-        cursor.execute("DROP TABLE embeddings_backup")
-    else:
-        # Pokud je to úplně první běh, jen přejmenujeme Next -> Live
-        cursor.execute("RENAME TABLE embeddings_next TO embeddings")
+def swap_tables_atomic(mode="all", lease_owner=None):
+    """
+    Provede bleskové prohození přestavěných oddílů (jedním RENAME) a zvýší jejich generaci.
+    S `lease_owner` nejdřív ověří, že zámek indexace pořád drží tento worker a nepropadl - jinak nic
+    neprohodí a vrací False (stínové tabulky mezitím může plnit worker, který zámek převzal). Vrací True.
+    """
+    partitions = partitions_for_mode(mode)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    if lease_owner is not None:
+        conn.begin()
+        cursor.execute(
+            "SELECT owner = %s AND expires_at >= NOW() FROM ingest_lease WHERE id = 1 FOR UPDATE", (lease_owner,)
+        )
+        row = cursor.fetchone()
+        if not row or not row[0]:
+            conn.rollback()
+            conn.close()
+            return False
+        # Prodloužení pod zámkem řádku - během prohození zámek nikdo nepřevezme
+        cursor.execute(
+            "UPDATE ingest_lease SET expires_at = NOW() + INTERVAL %s SECOND WHERE id = 1", (INGEST_LEASE_SECONDS,)
+        )
+        conn.commit()
+
+    for partition in partitions:
+        cursor.execute(f"DROP TABLE IF EXISTS embeddings_{partition}_backup")
 
-    conn.close()
\ No newline at end of file
+    # Live -> Backup, Next -> Live pro všechny oddíly najednou
+    renames = ", ".join(
+        f"embeddings_{p} TO embeddings_{p}_backup, embeddings_{p}_next TO embeddings_{p}" for p in partitions
+    )
+    cursor.execute(f"RENAME TABLE {renames}")
+
+    for partition in partitions:
+        cursor.execute(f"DROP TABLE embeddings_{partition}_backup")
+        cursor.execute(
+            "UPDATE embedding_generations SET generation = generation + 1 WHERE partition_name = %s", (partition,)
+        )
+
+    conn.close()
+    return True
@@ -0,0 +1,65 @@
+import time
+import threading
+
+# Časový rozpočet a omezení souběhu pro /api/chat. Každý požadavek dostane Deadline a jednotlivé
+# fáze (přepis dotazu, embedding, generování) si z něj berou timeouty, takže při zpomalení OpenAI
+# požadavek skončí včas (případně v degradovaném režimu), místo aby visel. AdmissionGate drží
+# omezený počet rozpracovaných požadavků a krátkou frontu; co se nevejde, dostane hned odpověď 'busy'.
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def timeout(self, cap=None, reserve=0.0):
+        """
+        Timeout pro další fázi: nejvýše `cap` sekund a tak, aby pro další fáze zbylo `reserve` sekund.
+        Když nezbývá nic, vyhodí DeadlineExceeded.
+        """
+        available = self.remaining() - reserve
+        if available <= 0:
+            raise DeadlineExceeded()
+        return min(cap, available) if cap else available
+
+
+class AdmissionGate:
+    """Nejvýše `limit` požadavků najednou; dalších nejvýše `max_queued` čeká až `max_wait` sekund."""
+
+    def __init__(self, limit, max_queued, max_wait):
+        self.limit = limit
+        self.max_queued = max_queued
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def enter(self):
+        """True = požadavek smí pokračovat (a musí zavolat leave), False = odmítnout."""
+        with self._cond:
+            if self.in_flight >= self.limit:
+                if self.waiting >= self.max_queued:
+                    return False
+                self.waiting += 1
+                try:
+                    if not self._cond.wait_for(lambda: self.in_flight < self.limit, timeout=self.max_wait):
+                        return False
+                finally:
+                    self.waiting -= 1
+            self.in_flight += 1
+            return True
+
+    def leave(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def load(self):
+        """Vytížení 0..1 (rozpracované požadavky / limit) - podle něj se šetří na volitelných fázích."""
+        return self.in_flight / self.limit if self.limit else 1.0
@@ -0,0 +1,236 @@
+import io
+import os
+import sys
+import argparse
+import tempfile
+from collections import deque
+
+from config import GOOGLE_DRIVE_FOLDER_ID, PDF_MAX_BYTES
+from cleanup_drive import get_drive_service, list_folder, FOLDER_MIME
+
+# Zdroj dokumentů z Google Disku pro režim indexace 'drive'.
+# První běh projde celou sledovanou složku (GOOGLE_DRIVE_FOLDER_ID). Další běhy čtou jen feed změn
+# (changes.list) od posledního uloženého tokenu - nové, upravené, smazané a přesunuté soubory.
+# Vše jde proti rozhraní googleapiclient, takže místo Disku lze podstrčit fake_drive.FakeDriveService.
+#
+#   python drive_source.py --check   # offline kontrola čtení souborů pro ingest nad fake Drive
+
+GOOGLE_DOC_MIME = "application/vnd.google-apps.document"
+PDF_MIME = "application/pdf"
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+SUPPORTED_MIME_TYPES = {GOOGLE_DOC_MIME, PDF_MIME, DOCX_MIME}
+
+FILE_FIELDS = "id, name, mimeType, parents, trashed, modifiedTime, size"
+
+
+def drive_source_url(file_id):
+    """Stálý odkaz na soubor - zároveň klíč, podle kterého se mažou staré chunky souboru."""
+    return f"https://drive.google.com/file/d/{file_id}/view"
+
+
+def get_start_page_token(service):
+    return service.changes().getStartPageToken().execute()["startPageToken"]
+
+
+def list_all_files(service, root_id=GOOGLE_DRIVE_FOLDER_ID):
+    """Úplný výpis podporovaných souborů ve sledované složce a podsložkách (jen při prvním běhu)."""
+    files = {}
+    queue = deque([root_id])
+    while queue:
+        for item in list_folder(service, queue.popleft(), fields=FILE_FIELDS):
+            if item["mimeType"] == FOLDER_MIME:
+                queue.append(item["id"])
+            elif item["mimeType"] in SUPPORTED_MIME_TYPES:
+                files[item["id"]] = item
+    return files
+
+
+class FolderMembership:
+    """Zjišťuje, jestli soubor leží (i nepřímo) ve sledované složce. Předky složek si pamatuje."""
+
+    def __init__(self, service, root_id=GOOGLE_DRIVE_FOLDER_ID):
+        self.service = service
+        self.root_id = root_id
+        self._inside = {root_id: True}
+
+    def _folder_inside(self, folder_id):
+        chain = []
+        while folder_id not in self._inside:
+            chain.append(folder_id)
+            try:
+                folder = self.service.files().get(fileId=folder_id, fields="id, parents, trashed").execute()
+            except Exception:
+                folder = {}
+            parents = folder.get("parents") or []
+            if folder.get("trashed") or not parents:
+                self._inside[folder_id] = False
+                break
+            folder_id = parents[0]
+        result = self._inside[folder_id]
+        for folder in chain:
+            self._inside[folder] = result
+        return result
+
+    def contains(self, file):
+        return any(self._folder_inside(parent) for parent in file.get("parents") or [])
+
+
+def collect_changes(service, page_token, root_id=GOOGLE_DRIVE_FOLDER_ID):
+    """
+    Projde feed změn od `page_token`. Vrací (changed, removed, new_token):
+    changed = {id: metadata} souborů ke (znovu)zpracování, removed = ID souborů, jejichž chunky se mají smazat
+    (smazané, v koši, přesunuté mimo sledovanou složku nebo nepodporovaného typu).
+    Pozdější změna téhož souboru přepíše dřívější.
+    """
+    membership = FolderMembership(service, root_id)
+    changed, removed = {}, set()
+    while True:
+        response = service.changes().list(
+            pageToken=page_token,
+            pageSize=1000,
+            includeRemoved=True,
+            spaces="drive",
+            fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({FILE_FIELDS}))"
+        ).execute()
+
+        for change in response.get("changes", []):
+            file_id = change["fileId"]
+            file = change.get("file")
+            if file and file.get("mimeType") == FOLDER_MIME:
+                # Složky samy neindexujeme; přesun celé složky Drive u jejích souborů jako změnu nehlásí
+                continue
+            if change.get("removed") or not file or file.get("trashed") \
+                    or file.get("mimeType") not in SUPPORTED_MIME_TYPES or not membership.contains(file):
+                changed.pop(file_id, None)
+                removed.add(file_id)
+            else:
+                removed.discard(file_id)
+                changed[file_id] = file
+
+        if "newStartPageToken" in response:
+            return changed, removed, response["newStartPageToken"]
+        page_token = response["nextPageToken"]
+
+
+def _docx_text(data):
+    import docx
+    document = docx.Document(io.BytesIO(data))
+    parts = [paragraph.text for paragraph in document.paragraphs if paragraph.text.strip()]
+    for table in document.tables:
+        for row in table.rows:
+            cells = [cell.text.strip() for cell in row.cells if cell.text.strip()]
+            if cells:
+                parts.append(" | ".join(cells))
+    return "\n".join(parts)
+
+
+def fetch_drive_file(service, file):
+    """
+    Stáhne obsah souboru. Vrací ('text', text) pro Google Docs a DOCX, ('pdf', cesta_k_dočasnému_pdf)
+    pro PDF (parsuje se v process poolu ingestu), nebo None, když soubor nejde/nemá smysl stáhnout.
+    """
+    mime_type = file["mimeType"]
+    if mime_type != GOOGLE_DOC_MIME and int(file.get("size") or 0) > PDF_MAX_BYTES:
+        print(f"   ⚠️ Soubor {file['name']} je příliš velký ({file['size']} B), přeskočeno.")
+        return None
+
+    if mime_type == GOOGLE_DOC_MIME:
+        data = service.files().export_media(fileId=file["id"], mimeType="text/plain").execute()
+        return "text", data.decode("utf-8-sig", errors="replace")
+
+    data = service.files().get_media(fileId=file["id"]).execute()
+    if mime_type == DOCX_MIME:
+        return "text", _docx_text(data)
+
+    fd, pdf_path = tempfile.mkstemp(suffix=".pdf")
+    with os.fdopen(fd, "wb") as fh:
+        fh.write(data)
+    return "pdf", pdf_path
+
+
+def check_fake_reads():
+    """
+    Offline kontrola nad fake Drive, jak indexace 'drive' čte soubory (ingest.read_drive_file): čitelný
+    dokument dá text, sken bez textové vrstvy prázdný obsah a nedostupný soubor i poškozené PDF chybu -
+    takový soubor se nesmí označit za zpracovaný ani přijít o chunky z minulé verze. Vrací 0, když vše sedí.
+    """
+    from pypdf import PdfWriter
+    from fake_drive import FakeDriveService
+    from ingest import read_drive_file, shutdown_pdf_pool
+
+    blank_pdf = io.BytesIO()
+    writer = PdfWriter()
+    writer.add_blank_page(width=595, height=842)
+    writer.write(blank_pdf)
+
+    service = FakeDriveService()
+    root = service.add_folder("Sledovaná složka", service.root_id)
+    unavailable = service.add_file("Nedostupný dokument", root, GOOGLE_DOC_MIME, "Článek 2. Zkoušky...")
+    service.fail_file(unavailable)
+    expected = {
+        service.add_file("Studijní řád", root, GOOGLE_DOC_MIME, "Článek 1. Studium se řídí..."): "text",
+        service.add_file("Sken.pdf", root, PDF_MIME, blank_pdf.getvalue()): "prázdný",
+        service.add_file("Poškozené.pdf", root, PDF_MIME, b"%PDF-1.4"): "chyba",
+        unavailable: "chyba",
+    }
+
+    mismatches = 0
+    try:
+        for file_id, file in list_all_files(service, root).items():
+            try:
+                _, total_chars, txt_path = read_drive_file(service, file)
+                if txt_path:
+                    os.remove(txt_path)
+                outcome = "text" if total_chars else "prázdný"
+            except Exception:
+                outcome = "chyba"
+            ok = outcome == expected[file_id]
+            mismatches += not ok
+            print(f"{'✅' if ok else '❌'} {file['name']}: {outcome} (očekáváno: {expected[file_id]})")
+    finally:
+        shutdown_pdf_pool()
+    return 1 if mismatches else 0
+
+
+def main(argv=None):
+    """Výpis toho, co by indexace 'drive' zpracovala - nad skutečným Diskem, nebo nad fake Drive (--fake)."""
+    parser = argparse.ArgumentParser(description="Náhled změn na Google Disku pro indexaci")
+    parser.add_argument("--token", help="Token feedu změn; bez něj se vypíše celá složka")
+    parser.add_argument("--fake", action="store_true", help="Ukázka nad lokálním fake Drive")
+    parser.add_argument("--check", action="store_true",
+                        help="Offline kontrola čtení souborů pro indexaci nad fake Drive (nenulový kód při chybě)")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        return check_fake_reads()
+
+    if args.fake:
+        from fake_drive import FakeDriveService
+        service = FakeDriveService()
+        root = service.add_folder("Sledovaná složka", service.root_id)
+        doc = service.add_file("Studijní řád", root, GOOGLE_DOC_MIME, "Článek 1. Studium se řídí...")
+        service.add_file("Harmonogram.pdf", root, PDF_MIME, b"%PDF-1.4")
+        token = get_start_page_token(service)
+        service.modify_file(doc, content="Článek 1. Upravené znění...")
+        service.add_file("Mimo složku.pdf", service.root_id, PDF_MIME, b"%PDF-1.4")
+        changed, removed, new_token = collect_changes(service, token, root)
+    else:
+        service = get_drive_service(readonly=True)
+        if not service:
+            return 1
+        if args.token:
+            changed, removed, new_token = collect_changes(service, args.token)
+        else:
+            new_token = get_start_page_token(service)
+            changed, removed = list_all_files(service), set()
+
+    for file in changed.values():
+        print(f"📝 {file['name']} ({file['mimeType']}, změněno {file.get('modifiedTime')})")
+    for file_id in removed:
+        print(f"🗑️ {file_id}")
+    print(f"🔖 Nový token: {new_token}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
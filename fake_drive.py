@@ -0,0 +1,297 @@
+import re
+import time
+import random
+import threading
+from collections import deque
+
+# Lokální náhrada Google Drive API v3 (podmnožina, kterou používají cleanup_drive.py a drive_source.py).
+# Napodobuje rozhraní googleapiclient: service.files().list(...).execute(), update(), get_media(),
+# export_media(), batch požadavky a feed změn service.changes().
+# Každé volání (i celý batch) stojí umělou latenci, takže jde offline měřit, kolik pomáhá souběh a dávkování.
+#
+#   service = FakeDriveService(latency_ms=50)
+#   root = build_synthetic_tree(service, total_files=20000)
+
+FOLDER_MIME = "application/vnd.google-apps.folder"
+GOOGLE_DOC_MIME = "application/vnd.google-apps.document"
+BATCH_LIMIT = 100  # Drive API víc požadavků v jednom batchi nepřijme
+
+_PARENT_QUERY = re.compile(r"'([^']+)' in parents")
+
+
+class HttpError(Exception):
+    """Obdoba googleapiclient.errors.HttpError - nese HTTP status."""
+
+    def __init__(self, status, message):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+
+
+class _Request:
+    def __init__(self, service, handler, *args):
+        self._service = service
+        self._handler = handler
+        self._args = args
+
+    def execute(self):
+        self._service._network_delay()
+        return self._run()
+
+    def _run(self):
+        with self._service._lock:
+            return self._handler(*self._args)
+
+
+class _Batch:
+    def __init__(self, service, callback):
+        self._service = service
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        if len(self._requests) >= BATCH_LIMIT:
+            raise ValueError(f"Batch může mít nejvýše {BATCH_LIMIT} požadavků.")
+        request_id = request_id or str(len(self._requests) + 1)
+        self._requests.append((request_id, request, callback or self._callback))
+
+    def execute(self):
+        # Celý batch je jeden HTTP požadavek
+        self._service._network_delay()
+        self._service._count("batch")
+        for request_id, request, callback in self._requests:
+            try:
+                response, error = request._run(), None
+            except HttpError as e:
+                response, error = None, e
+            if callback:
+                callback(request_id, response, error)
+
+
+class _Files:
+    def __init__(self, service):
+        self._service = service
+
+    def list(self, q="", fields=None, pageToken=None, pageSize=100, **kwargs):
+        return _Request(self._service, self._service._list, q, pageToken, min(int(pageSize or 100), 1000))
+
+    def update(self, fileId, body=None, **kwargs):
+        return _Request(self._service, self._service._update, fileId, body or {})
+
+    def get(self, fileId, fields=None, **kwargs):
+        return _Request(self._service, self._service._get, fileId)
+
+    def get_media(self, fileId, **kwargs):
+        return _Request(self._service, self._service._get_media, fileId)
+
+    def export_media(self, fileId, mimeType, **kwargs):
+        return _Request(self._service, self._service._export_media, fileId, mimeType)
+
+
+class _Changes:
+    def __init__(self, service):
+        self._service = service
+
+    def getStartPageToken(self, **kwargs):
+        return _Request(self._service, self._service._start_page_token)
+
+    def list(self, pageToken, pageSize=100, fields=None, includeRemoved=True, **kwargs):
+        return _Request(self._service, self._service._list_changes, pageToken, min(int(pageSize or 100), 1000),
+                        includeRemoved)
+
+
+class FakeDriveService:
+    def __init__(self, latency_ms=0):
+        self.latency_ms = latency_ms
+        self.calls = {}
+        self._lock = threading.Lock()
+        self._files = {}
+        self._children = {}
+        self._next_id = 0
+        self._changes = []  # (fileId, removed) v pořadí, jak se soubory měnily
+        self._failing = {}  # fileId -> HTTP status, se kterým selže stažení obsahu
+        self.root_id = self.add_folder("Sofim (fake)", parent=None)
+
+    # --- Rozhraní googleapiclient ---
+
+    def files(self):
+        return _Files(self)
+
+    def changes(self):
+        return _Changes(self)
+
+    def new_batch_http_request(self, callback=None):
+        return _Batch(self, callback)
+
+    # --- Naplnění dat ---
+
+    def _new_id(self):
+        self._next_id += 1
+        return f"fake{self._next_id:08d}"
+
+    def _touch(self, file_id, removed=False):
+        if not removed:
+            self._files[file_id]["modifiedTime"] = f"2024-01-01T00:00:{len(self._changes):06d}Z"
+        self._changes.append((file_id, removed))
+
+    def add_file(self, name, parent, mime_type="application/pdf", content=b""):
+        with self._lock:
+            file_id = self._new_id()
+            self._files[file_id] = {
+                "id": file_id, "name": name, "mimeType": mime_type, "parents": [parent] if parent else [],
+                "trashed": False, "content": content,
+            }
+            self._children.setdefault(parent, []).append(file_id)
+            self._touch(file_id)
+            return file_id
+
+    def add_folder(self, name, parent):
+        return self.add_file(name, parent, FOLDER_MIME)
+
+    def modify_file(self, file_id, content=None, name=None):
+        with self._lock:
+            if content is not None:
+                self._files[file_id]["content"] = content
+            if name is not None:
+                self._files[file_id]["name"] = name
+            self._touch(file_id)
+
+    def move_file(self, file_id, new_parent):
+        with self._lock:
+            record = self._files[file_id]
+            for parent in record["parents"]:
+                self._children[parent].remove(file_id)
+            record["parents"] = [new_parent]
+            self._children.setdefault(new_parent, []).append(file_id)
+            self._touch(file_id)
+
+    def trash_file(self, file_id):
+        with self._lock:
+            self._files[file_id]["trashed"] = True
+            self._touch(file_id)
+
+    def delete_file(self, file_id):
+        """Trvalé smazání - ve feedu změn se objeví jako removed=True."""
+        with self._lock:
+            record = self._files.pop(file_id)
+            for parent in record["parents"]:
+                self._children[parent].remove(file_id)
+            self._touch(file_id, removed=True)
+
+    def fail_file(self, file_id, status=500):
+        """Stažení i export obsahu souboru budou selhávat (pro zkoušku chybových cest ingestu)."""
+        with self._lock:
+            self._failing[file_id] = status
+
+    def name_of(self, file_id):
+        return self._files[file_id]["name"]
+
+    # --- Implementace volání ---
+
+    def _network_delay(self):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+
+    def _count(self, method):
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+    def _public(self, record):
+        public = {k: v for k, v in record.items() if k != "content"}
+        if not record["mimeType"].startswith("application/vnd.google-apps."):
+            public["size"] = str(len(record["content"]))
+        return public
+
+    def _list(self, q, page_token, page_size):
+        self._count("files.list")
+        match = _PARENT_QUERY.search(q or "")
+        ids = self._children.get(match.group(1), []) if match else list(self._files)
+        if "trashed = false" in (q or ""):
+            ids = [i for i in ids if not self._files[i]["trashed"]]
+        start = int(page_token or 0)
+        page = ids[start:start + page_size]
+        response = {"files": [self._public(self._files[i]) for i in page]}
+        if start + page_size < len(ids):
+            response["nextPageToken"] = str(start + page_size)
+        return response
+
+    def _update(self, file_id, body):
+        self._count("files.update")
+        if file_id not in self._files:
+            raise HttpError(404, f"File not found: {file_id}")
+        self._files[file_id].update({k: v for k, v in body.items() if k in ("name", "trashed")})
+        self._touch(file_id)
+        return self._public(self._files[file_id])
+
+    def _get(self, file_id):
+        self._count("files.get")
+        if file_id not in self._files:
+            raise HttpError(404, f"File not found: {file_id}")
+        return self._public(self._files[file_id])
+
+    def _get_media(self, file_id):
+        self._count("files.get_media")
+        record = self._files.get(file_id)
+        if record is None:
+            raise HttpError(404, f"File not found: {file_id}")
+        if file_id in self._failing:
+            raise HttpError(self._failing[file_id], f"Backend error: {file_id}")
+        if record["mimeType"].startswith("application/vnd.google-apps."):
+            raise HttpError(403, "fileNotDownloadable: use export_media for Google Docs")
+        return record["content"]
+
+    def _export_media(self, file_id, mime_type):
+        self._count("files.export_media")
+        record = self._files.get(file_id)
+        if record is None:
+            raise HttpError(404, f"File not found: {file_id}")
+        if file_id in self._failing:
+            raise HttpError(self._failing[file_id], f"Backend error: {file_id}")
+        if record["mimeType"] != GOOGLE_DOC_MIME or mime_type != "text/plain":
+            raise HttpError(403, f"Export {record['mimeType']} -> {mime_type} is not supported")
+        content = record["content"]
+        return content if isinstance(content, bytes) else content.encode("utf-8")
+
+    def _start_page_token(self):
+        self._count("changes.getStartPageToken")
+        return {"startPageToken": str(len(self._changes))}
+
+    def _list_changes(self, page_token, page_size, include_removed):
+        self._count("changes.list")
+        start = int(page_token)
+        changes = []
+        for file_id, removed in self._changes[start:start + page_size]:
+            if removed or file_id not in self._files:
+                if include_removed:
+                    changes.append({"fileId": file_id, "removed": True})
+            else:
+                # Jako skutečné API: změna nese aktuální stav souboru, ne stav v okamžiku změny
+                changes.append({"fileId": file_id, "removed": False, "file": self._public(self._files[file_id])})
+        response = {"changes": changes}
+        if start + page_size < len(self._changes):
+            response["nextPageToken"] = str(start + page_size)
+        else:
+            response["newStartPageToken"] = str(len(self._changes))
+        return response
+
+
+def build_synthetic_tree(service, total_files, files_per_folder=40, subfolders=4, copy_ratio=0.1, seed=7):
+    """
+    Vygeneruje strom složek (do šířky, `subfolders` podsložek na složku) s celkem `total_files` soubory.
+    Zhruba `copy_ratio` názvů dostane prefix 'Copy of ' / 'Kopie - ', které cleanup_drive.py odstraňuje.
+    Vrací ID kořenové složky.
+    """
+    rng = random.Random(seed)
+    prefixes = ["Copy of ", "Kopie - ", "Kopie souboru "]
+    root = service.add_folder("Studijní materiály", service.root_id)
+    queue = deque([root])
+    created = 0
+    while created < total_files:
+        folder = queue.popleft()
+        for _ in range(min(files_per_folder, total_files - created)):
+            name = f"dokument_{created:06d}.pdf"
+            if rng.random() < copy_ratio:
+                name = rng.choice(prefixes) + name
+            service.add_file(name, folder)
+            created += 1
+        for i in range(subfolders):
+            queue.append(service.add_folder(f"slozka_{created}_{i}", folder))
+    return root
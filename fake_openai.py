@@ -0,0 +1,257 @@
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+import functools
+import email.parser
+import email.policy
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Lokální náhrada OpenAI API pro zátěžové testy (loadtest.py) a vývoj bez klíče.
+# Umí /v1/embeddings (deterministické vektory podle textu) a /v1/chat/completions
+# (přepis dotazu vrací dotaz, odpověď chatbota je JSON ve formátu, který čeká application.py).
+# Umělá latence simuluje dobu odpovědi skutečného API.
+# Pro hromadnou přestavbu (bulk_ingest.py) umí i Batch API: /v1/files (nahrání a stažení obsahu)
+# a /v1/batches (dávka se zpracuje ve vlákně na pozadí po `--batch-delay` sekundách).
+#
+#   python fake_openai.py --port 8765 --latency-ms 300 --jitter-ms 100
+#   OPENAI_BASE_URL=http://127.0.0.1:8765/v1 python application.py
+
+EMBEDDING_DIMS = 1536
+
+
+@functools.lru_cache(maxsize=50000)
+def _word_vector(word, dims):
+    seed = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "big")
+    return np.random.default_rng(seed).standard_normal(dims).astype(np.float32)
+
+
+def fake_embedding(text, dims=EMBEDDING_DIMS):
+    """
+    Deterministický jednotkový vektor: součet vektorů jednotlivých slov, takže texty se společnými
+    slovy si jsou podobné a vyhledávání nad syntetickými daty dává smysluplné shody.
+    """
+    vector = np.zeros(dims, dtype=np.float32)
+    for word in re.findall(r"\w+", (text or "").lower()):
+        vector += _word_vector(word, dims)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _chat_reply(data):
+    messages = data.get("messages", [])
+    last = messages[-1]["content"] if messages else ""
+
+    if data.get("response_format", {}).get("type") == "json_object":
+        if "Kontext z databáze" in last:
+            sources = sorted(set(int(i) for i in re.findall(r"\[ZDROJ_ID: (\d+)\]", last)))[:2]
+            return json.dumps({
+                "odpoved": "Podle dostupných zdrojů: " + last.rsplit("Aktuální dotaz studenta:", 1)[-1].strip(),
+                "pouzite_zdroje": sources,
+            }, ensure_ascii=False)
+        # Sémantický chunking při indexaci - text vrátíme jako jeden chunk
+        text = last.rsplit("Text k analýze:", 1)[-1].strip()
+        return json.dumps({"chunks": [{"title": text[:60], "content": text}]}, ensure_ascii=False)
+
+    if "Nové výměny:" in last:
+        # Průběžné shrnutí konverzace - stačí krátký konec posledních výměn
+        return last.rsplit("Nové výměny:", 1)[-1].strip()[-400:]
+    if "Dotaz k přepsání:" in last:
+        return last.rsplit("Dotaz k přepsání:", 1)[-1].strip()
+    return last[-2000:]
+
+
+def _embedding_payload(data, native_dims):
+    inputs = data.get("input", "")
+    inputs = inputs if isinstance(inputs, list) else [inputs]
+    # Parametr `dimensions` jako u text-embedding-3: prvních N složek (nejvýš nativní dimenze serveru)
+    dims = min(int(data.get("dimensions") or native_dims), native_dims)
+    return {
+        "object": "list",
+        "model": data.get("model"),
+        "data": [
+            {"object": "embedding", "index": i, "embedding": fake_embedding(text, dims).tolist()}
+            for i, text in enumerate(inputs)
+        ],
+        "usage": {"prompt_tokens": sum(len(t.split()) for t in inputs), "total_tokens": 0},
+    }
+
+
+def _chat_payload(data):
+    return {
+        "object": "chat.completion",
+        "model": data.get("model"),
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": _chat_reply(data)}}],
+    }
+
+
+def _parse_multipart(content_type, body):
+    """Pole multipart/form-data -> {název: (název souboru, obsah)}."""
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body)
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        fields[name] = (part.get_filename(), part.get_payload(decode=True))
+    return fields
+
+
+def _run_batch(server, batch):
+    """Zpracuje vstupní soubor dávky stejně jako synchronní endpointy a založí výstupní soubor."""
+    time.sleep(server.batch_delay)
+    lines = server.files[batch["input_file_id"]]["content"].decode("utf-8").splitlines()
+    output = []
+    completed = failed = 0
+    for i, line in enumerate(lines):
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        if request.get("url") == "/v1/embeddings":
+            body = _embedding_payload(request["body"], server.dims)
+        elif request.get("url") == "/v1/chat/completions":
+            body = _chat_payload(request["body"])
+        else:
+            failed += 1
+            continue
+        completed += 1
+        output.append(json.dumps({"id": f"batch_req_{i}", "custom_id": request["custom_id"],
+                                  "response": {"status_code": 200, "request_id": f"req_{i}", "body": body},
+                                  "error": None}, ensure_ascii=False))
+    with server.stats_lock:
+        file_id = f"file-{len(server.files) + 1}"
+        server.files[file_id] = {"filename": f"{batch['id']}_output.jsonl", "purpose": "batch_output",
+                                 "content": ("\n".join(output) + "\n").encode("utf-8")}
+        batch.update(status="completed", output_file_id=file_id, completed_at=int(time.time()),
+                     request_counts={"total": completed + failed, "completed": completed, "failed": failed})
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeOpenAI/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        # Vysoké limity, aby plánovač v rate_limit.py zátěžový test nebrzdil
+        self.send_header("x-ratelimit-limit-requests", "1000000")
+        self.send_header("x-ratelimit-limit-tokens", "1000000000")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        match = re.search(r"/batches/([\w-]+)$", self.path)
+        if match and match.group(1) in server.batches:
+            return self._send_json(200, server.batches[match.group(1)])
+
+        match = re.search(r"/files/([\w-]+)/content$", self.path)
+        if match and match.group(1) in server.files:
+            body = server.files[match.group(1)]["content"]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        return self._send_json(404, {"error": {"message": f"Unknown endpoint {self.path}"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+        server = self.server
+
+        if self.path.endswith("/files"):
+            fields = _parse_multipart(self.headers.get("Content-Type", ""), raw)
+            filename, content = fields.get("file", (None, None))
+            if content is None:
+                return self._send_json(400, {"error": {"message": "Missing file"}})
+            with server.stats_lock:
+                file_id = f"file-{len(server.files) + 1}"
+                server.files[file_id] = {"filename": filename, "purpose": fields.get("purpose", (None, b""))[1].decode(),
+                                         "content": content}
+            return self._send_json(200, {"id": file_id, "object": "file", "bytes": len(content),
+                                         "filename": filename, "purpose": server.files[file_id]["purpose"]})
+
+        try:
+            data = json.loads(raw or b"{}")
+        except json.JSONDecodeError:
+            return self._send_json(400, {"error": {"message": "Invalid JSON"}})
+
+        if self.path.endswith("/batches"):
+            if data.get("input_file_id") not in server.files:
+                return self._send_json(400, {"error": {"message": "Unknown input_file_id"}})
+            total = sum(1 for line in server.files[data["input_file_id"]]["content"].splitlines() if line.strip())
+            with server.stats_lock:
+                batch_id = f"batch_{len(server.batches) + 1}"
+                batch = server.batches[batch_id] = {
+                    "id": batch_id, "object": "batch", "endpoint": data.get("endpoint"),
+                    "input_file_id": data["input_file_id"], "completion_window": data.get("completion_window"),
+                    "status": "in_progress", "output_file_id": None, "error_file_id": None,
+                    "created_at": int(time.time()), "request_counts": {"total": total, "completed": 0, "failed": 0},
+                }
+            threading.Thread(target=_run_batch, args=(server, batch), daemon=True).start()
+            return self._send_json(200, batch)
+
+        with server.stats_lock:
+            server.requests_served += 1
+        if server.latency_ms or server.jitter_ms:
+            time.sleep(max(0.0, server.latency_ms + random.uniform(-server.jitter_ms, server.jitter_ms)) / 1000.0)
+
+        if self.path.endswith("/embeddings"):
+            return self._send_json(200, _embedding_payload(data, server.dims))
+
+        if self.path.endswith("/chat/completions"):
+            return self._send_json(200, _chat_payload(data))
+
+        return self._send_json(404, {"error": {"message": f"Unknown endpoint {self.path}"}})
+
+
+def start_fake_openai(port=0, latency_ms=0, jitter_ms=0, dims=EMBEDDING_DIMS, batch_delay=0):
+    """Spustí server ve vlákně na pozadí. Vrací server; base URL je f"http://127.0.0.1:{server.server_port}/v1"."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.latency_ms = latency_ms
+    server.jitter_ms = jitter_ms
+    server.dims = dims
+    server.requests_served = 0
+    server.batch_delay = batch_delay
+    server.files = {}
+    server.batches = {}
+    server.stats_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lokální náhrada OpenAI API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--dims", type=int, default=EMBEDDING_DIMS)
+    parser.add_argument("--batch-delay", type=float, default=0, help="Za kolik sekund se dokončí dávka Batch API")
+    args = parser.parse_args(argv)
+
+    server = start_fake_openai(args.port, args.latency_ms, args.jitter_ms, args.dims, args.batch_delay)
+    print(f"🤖 Fake OpenAI běží na http://127.0.0.1:{server.server_port}/v1 (latence {args.latency_ms} ms)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,40 +1,68 @@
 import os
+import csv
 import json
+import codecs
+import hashlib
 import requests
 import numpy as np
 import pandas as pd
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin
-import io
+import tempfile
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pypdf import PdfReader
 import docx  # Ponecháváme pro případný budoucí lokální DOCX import
 
-from config import OPENAI_API_KEY, EMBEDDING_MODEL, OPENAI_EMBEDDING_URL
+from config import (
+    OPENAI_API_KEY, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, OPENAI_EMBEDDING_URL, LLM_API_URL, PDF_MAX_BYTES, PDF_WORKERS,
+    NEAR_DUP_THRESHOLD
+)
+from progress import SyncProgress
+from rate_limit import post_openai
+from lexical import build_postings, pack_postings, NearDuplicateFilter
+from cleanup_drive import get_drive_service
+from sitemaps import refresh_sitemaps
+from drive_source import get_start_page_token, list_all_files, collect_changes, fetch_drive_file, drive_source_url
 from database import (
     prepare_next_table_for_update,
     insert_into_next_table,
+    add_alternate_source,
+    load_next_table_sources,
     swap_tables_atomic,
-    get_db_connection,
-    set_sync_status,
-    update_sync_progress,
-    log_sync_error
+    start_ingest_journal,
+    get_resumable_run,
+    load_checkpoints,
+    mark_checkpoint,
+    sync_csv_journal,
+    discard_next_table_rows,
+    finish_ingest_journal,
+    partitions_for_mode,
+    get_embedding_generations,
+    load_partition_texts,
+    save_sparse_index,
+    get_drive_page_token,
+    discard_unlisted_next_table_rows,
+    save_drive_page_token,
+    get_due_crawler_urls,
+    mark_urls_crawled,
+    save_pdf_links,
+    pages_linking_sources,
+    next_table_alternate_sources,
+    discard_orphaned_web_rows
 )
 
 
 # --- 1. Pomocné funkce pro CRAWLER ---
 
 def get_urls_from_db():
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    """URL z crawler_urls, které je podle plánu čas projít (viz database.get_due_crawler_urls)."""
     try:
-        cursor.execute("SELECT url FROM crawler_urls")
-        urls = [row[0] for row in cursor.fetchall()]
+        return get_due_crawler_urls()
     except Exception as e:
         print(f"⚠️ Tabulka crawler_urls asi neexistuje nebo je prázdná: {e}")
-        urls = []
-    finally:
-        conn.close()
-    return urls
+        return []
 
 
 def scrape_uhk_page(url):
@@ -43,9 +71,9 @@ def scrape_uhk_page(url):
         headers = {"User-Agent": "SofimBot/1.0 (UHK Internal)"}
         response = requests.get(url, headers=headers, timeout=15)
 
+        # Chybu nevracíme jako prázdnou stránku - volající by starou verzi smazal a URL označil za prošlou
         if response.status_code != 200:
-            print(f"   ❌ Chyba HTTP {response.status_code}")
-            return None, [], ""
+            raise Exception(f"Chyba HTTP {response.status_code}")
 
         soup = BeautifulSoup(response.content, 'html.parser')
 
@@ -88,8 +116,8 @@ def scrape_uhk_page(url):
         }
 
         # Timeout 180s pro bezpečné extrahování obřího HTML
-        llm_response = requests.post("https://api.openai.com/v1/chat/completions", headers=llm_headers, json=data,
-                                     timeout=180)
+        llm_response = post_openai(LLM_API_URL, llm_headers, data, priority="ingest",
+                                   timeout=180)
 
         if llm_response.status_code == 200:
             clean_text = llm_response.json()["choices"][0]["message"]["content"].strip()
@@ -108,10 +136,106 @@ def scrape_uhk_page(url):
         raise Exception(f"Chyba zpracování {url}: {str(e)}")
 
 
-def process_pdf_from_url(pdf_url, depth=0):
+_pdf_pool = None
+
+
+def get_pdf_pool():
+    """
+    Sdílený pool procesů pro parsování PDF. pypdf je čistě CPU práce a drží GIL,
+    takže ji posíláme mimo vlákno ingestu a síťové fáze mezitím běží dál.
+    """
+    global _pdf_pool
+    if _pdf_pool is None:
+        # 'spawn' - ingest běží ve vlákně webového procesu, fork z vícevláknového procesu není bezpečný
+        _pdf_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pdf_pool
+
+
+def shutdown_pdf_pool():
+    global _pdf_pool
+    if _pdf_pool is not None:
+        _pdf_pool.shutdown(wait=True, cancel_futures=True)
+        _pdf_pool = None
+
+
+def download_to_tempfile(response, max_bytes=PDF_MAX_BYTES, suffix=".pdf"):
+    """
+    Streamuje tělo odpovědi do dočasného souboru. Pokud soubor přesáhne limit, smaže ho a vrátí None.
+    V paměti je vždy jen jeden blok, nikoliv celé PDF.
+    """
+    declared = response.headers.get('Content-Length')
+    if declared and declared.isdigit() and int(declared) > max_bytes:
+        print(f"   ⚠️ Soubor je příliš velký ({int(declared) // 1024} kB > {max_bytes // 1024} kB). Přeskakuji.")
+        return None
+
+    fd, path = tempfile.mkstemp(prefix="sofim_", suffix=suffix)
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for block in response.iter_content(chunk_size=64 * 1024):
+                if not block:
+                    continue
+                size += len(block)
+                if size > max_bytes:
+                    raise ValueError(f"Soubor přesáhl limit {max_bytes // 1024} kB")
+                out.write(block)
+    except Exception as e:
+        print(f"   ⚠️ Stahování přerušeno: {e}")
+        os.remove(path)
+        return None
+
+    return path
+
+
+def iter_pdf_pages(pdf_path):
+    """Generátor textu PDF po jednotlivých stránkách (stránky bez textové vrstvy přeskočí)."""
+    reader = PdfReader(pdf_path)
+    for page in reader.pages:
+        extracted = page.extract_text()
+        if extracted:
+            yield extracted + "\n"
+
+
+def extract_pdf_to_text_file(pdf_path):
     """
-    Stáhne PDF. Pokud narazí na HTML detail dokumentu, zkusí v něm najít skutečné PDF.
-    MAX hloubka zanoření (depth) = 1, aby se nezacyklil.
+    Běží v procesu z get_pdf_pool(). Text se po stránkách zapisuje do souboru vedle PDF,
+    aby se přes hranici procesu nevracel celý dokument najednou.
+    Vrací (cesta_k_textu, počet_znaků, počet_neprázdných_znaků). PDF po sobě vždy smaže.
+    """
+    txt_path = pdf_path + ".txt"
+    total_chars = 0
+    meaningful_chars = 0
+    try:
+        with open(txt_path, "w", encoding="utf-8") as out:
+            for page_text in iter_pdf_pages(pdf_path):
+                out.write(page_text)
+                total_chars += len(page_text)
+                meaningful_chars += len(page_text.strip())
+    except Exception:
+        if os.path.exists(txt_path):
+            os.remove(txt_path)
+        raise
+    finally:
+        os.remove(pdf_path)
+
+    return txt_path, total_chars, meaningful_chars
+
+
+def iter_text_file(txt_path, block_size=64 * 1024):
+    """Čte extrahovaný text po blocích, aby se celý dokument nemusel držet v paměti."""
+    with open(txt_path, "r", encoding="utf-8") as fh:
+        while True:
+            block = fh.read(block_size)
+            if not block:
+                break
+            yield block
+
+
+def fetch_pdf_from_url(pdf_url, depth=0):
+    """
+    Stáhne PDF do dočasného souboru (s limitem PDF_MAX_BYTES). Pokud narazí na HTML detail dokumentu,
+    zkusí v něm najít skutečné PDF. MAX hloubka zanoření (depth) = 1, aby se nezacyklil.
+    Vrací cestu k dočasnému PDF nebo None.
     """
     if depth > 1:
         return None
@@ -119,123 +243,244 @@ def process_pdf_from_url(pdf_url, depth=0):
     print(f"   📄 Zkoumám odkaz: {pdf_url}")
     try:
         headers = {"User-Agent": "SofimBot/1.0 (UHK Internal)"}
-        response = requests.get(pdf_url, headers=headers, timeout=30)
-
-        if response.status_code != 200:
-            print(f"   ❌ Nelze stáhnout (HTTP {response.status_code})")
-            return None
+        with requests.get(pdf_url, headers=headers, timeout=30, stream=True) as response:
 
-        content_type = response.headers.get('Content-Type', '').lower()
-
-        # SCÉNÁŘ A: Máme přímo čisté PDF
-        if 'application/pdf' in content_type:
-            print("   🔍 Analyzuji PDF vrstvy...")
-            fh = io.BytesIO(response.content)
-            reader = PdfReader(fh)
-            text = ""
-            for page in reader.pages:
-                extracted = page.extract_text()
-                if extracted:
-                    text += extracted + "\n"
-
-            if len(text.strip()) < 10:
-                print(f"   ⚠️ PDF {pdf_url} je pravděpodobně sken bez textové vrstvy.")
+            if response.status_code != 200:
+                print(f"   ❌ Nelze stáhnout (HTTP {response.status_code})")
                 return None
 
-            print(f"   ✅ PDF úspěšně načteno ({len(text)} znaků).")
-            return text
-
-        # SCÉNÁŘ B: Odkaz vede na podstránku detailu dokumentu
-        elif 'text/html' in content_type:
-            if depth == 0:
-                print(f"   🔀 Odkaz vede na podstránku, hledám skutečné PDF uvnitř...")
-                soup = BeautifulSoup(response.content, 'html.parser')
-
-                # Hledáme skutečný odkaz na soubor
-                for a_tag in soup.find_all('a', href=True):
-                    href = a_tag['href']
-                    if '/file/' in href or '/download/' in href or 'stahnout' in href.lower() or href.lower().endswith(
-                            '.pdf'):
-                        real_pdf_url = urljoin(pdf_url, href)
-                        # Pokud jsme našli nový odkaz, zavoláme stejnou funkci znovu (ale nastavíme hloubku)
-                        if real_pdf_url != pdf_url:
-                            return process_pdf_from_url(real_pdf_url, depth=depth + 1)
-
-                print("   ⚠️ Na podstránce se nepodařilo najít žádné další PDF.")
-                return None
+            content_type = response.headers.get('Content-Type', '').lower()
+
+            # SCÉNÁŘ A: Máme přímo čisté PDF
+            if 'application/pdf' in content_type:
+                return download_to_tempfile(response)
+
+            # SCÉNÁŘ B: Odkaz vede na podstránku detailu dokumentu
+            elif 'text/html' in content_type:
+                if depth == 0:
+                    print(f"   🔀 Odkaz vede na podstránku, hledám skutečné PDF uvnitř...")
+                    soup = BeautifulSoup(response.content, 'html.parser')
+
+                    # Hledáme skutečný odkaz na soubor
+                    for a_tag in soup.find_all('a', href=True):
+                        href = a_tag['href']
+                        if '/file/' in href or '/download/' in href or 'stahnout' in href.lower() or href.lower().endswith(
+                                '.pdf'):
+                            real_pdf_url = urljoin(pdf_url, href)
+                            # Pokud jsme našli nový odkaz, zavoláme stejnou funkci znovu (ale nastavíme hloubku)
+                            if real_pdf_url != pdf_url:
+                                return fetch_pdf_from_url(real_pdf_url, depth=depth + 1)
+
+                    print("   ⚠️ Na podstránce se nepodařilo najít žádné další PDF.")
+                    return None
+                else:
+                    return None
+
+            # SCÉNÁŘ C: Je to ZIP, DOCX, obrázek atd.
             else:
+                print(f"   ⚠️ Ignoruji: Soubor není PDF (Typ: {content_type}).")
                 return None
 
-        # SCÉNÁŘ C: Je to ZIP, DOCX, obrázek atd.
-        else:
-            print(f"   ⚠️ Ignoruji: Soubor není PDF (Typ: {content_type}).")
-            return None
+    except Exception as e:
+        print(f"   ❌ Chyba čtení souboru {pdf_url}: {str(e)}")
+        return None
+
 
+def process_pdf_from_url(pdf_url):
+    """
+    Stáhne PDF a předá jeho parsování do process poolu. Vrací Future (viz collect_pdf_text) nebo None.
+    Volající může mezitím stahovat další soubory - parsování běží paralelně na dalších jádrech.
+    """
+    pdf_path = fetch_pdf_from_url(pdf_url)
+    if not pdf_path:
+        return None
+    future = get_pdf_pool().submit(extract_pdf_to_text_file, pdf_path)
+    future.pdf_path = pdf_path  # pro úklid nezačaté úlohy (discard_pdf_job)
+    return future
+
+
+def discard_pdf_job(future):
+    """
+    Uklidí úlohu z process_pdf_from_url, jejíž výsledek se nezpracuje: nezačaté parsování zruší a smaže
+    stažené PDF, u doběhlého smaže extrahovaný text.
+    """
+    if future.cancel():
+        if os.path.exists(future.pdf_path):
+            os.remove(future.pdf_path)
+        return
+    try:
+        txt_path = future.result()[0]
+    except Exception:
+        return  # extract_pdf_to_text_file po chybě uklidí sám
+    if os.path.exists(txt_path):
+        os.remove(txt_path)
+
+
+def collect_pdf_text(pdf_url, future, raise_errors=False):
+    """
+    Počká na výsledek parsování. Vrací (cesta_k_textu, počet_znaků) nebo None. S `raise_errors` se chyba
+    čtení PDF propaguje a None znamená jen PDF bez textové vrstvy.
+    """
+    try:
+        print(f"   🔍 Analyzuji PDF vrstvy: {pdf_url}")
+        txt_path, total_chars, meaningful_chars = future.result()
     except Exception as e:
         print(f"   ❌ Chyba čtení souboru {pdf_url}: {str(e)}")
+        if raise_errors:
+            raise
         return None
 
+    if meaningful_chars < 10:
+        print(f"   ⚠️ PDF {pdf_url} je pravděpodobně sken bez textové vrstvy.")
+        os.remove(txt_path)
+        return None
+
+    print(f"   ✅ PDF úspěšně načteno ({total_chars} znaků).")
+    return txt_path, total_chars
+
+
+def read_drive_file(service, file):
+    """
+    Stáhne a přečte soubor z Google Disku. Vrací (text, počet_znaků, cesta_k_textu): u PDF je text generátor
+    částí z dočasného souboru `cesta_k_textu` (smaže ho volající), jinak řetězec a cesta None. Soubor bez
+    textu (příliš velký, prázdný, sken bez textové vrstvy) vrací ("", 0, None). Chyba stažení, exportu
+    i čtení PDF se propaguje - soubor pak nejde označit za zpracovaný.
+    """
+    fetched = fetch_drive_file(service, file)
+    if not fetched:
+        return "", 0, None
+    kind, payload = fetched
+    if kind != "pdf":
+        return payload, len(payload), None
+
+    pdf_text = collect_pdf_text(file["name"], get_pdf_pool().submit(extract_pdf_to_text_file, payload),
+                                raise_errors=True)
+    if not pdf_text:
+        return "", 0, None
+    txt_path, total_chars = pdf_text
+    return iter_text_file(txt_path), total_chars, txt_path
+
 
 # --- 2. Pomocné funkce pro CSV (Hybridní model) ---
 
-def read_csv_smart(fh):
-    encodings = ['utf-8', 'cp1250', 'latin1']
-    for encoding in encodings:
-        fh.seek(0)
+CSV_HEADER_KEYWORDS = ['zkratka', 'zkr_predm', 'nazev_cz', 'kredity', 'anotace_cz']
+CSV_ENCODINGS = ['utf-8-sig', 'cp1250', 'latin1']
+CSV_SAMPLE_BYTES = 64 * 1024  # Vzorek pro detekci kódování, oddělovače a hlavičky
+CSV_CHUNK_ROWS = 2000  # Velké exporty čteme po částech, embedding může začít hned
+
+
+def sniff_csv_format(fh):
+    """
+    Jediný průchod přes vzorek bajtů: určí kódování, oddělovač a počet řádků před hlavičkou
+    (STAG exporty mají občas nad hlavičkou ještě pár řádků balastu).
+    Vrací (encoding, sep, skiprows) nebo None.
+    """
+    fh.seek(0)
+    raw = fh.read(CSV_SAMPLE_BYTES)
+    if not raw:
+        return None
+
+    sample = None
+    encoding = None
+    for enc in CSV_ENCODINGS:
         try:
-            df = pd.read_csv(fh, sep=None, engine='python', encoding=encoding, on_bad_lines='skip')
-            keywords = ['zkratka', 'zkr_predm', 'nazev_cz', 'kredity', 'anotace_cz']
-            col_str = str(list(df.columns)).lower()
-
-            if not any(k in col_str for k in keywords):
-                fh.seek(0)
-                df_raw = pd.read_csv(fh, sep=None, engine='python', encoding=encoding, header=None, on_bad_lines='skip',
-                                     nrows=15)
-                header_index = -1
-                for i in range(len(df_raw)):
-                    row_str = str(df_raw.iloc[i].values).lower()
-                    if any(k in row_str for k in keywords):
-                        header_index = i
-                        break
-                if header_index != -1:
-                    fh.seek(0)
-                    df = pd.read_csv(fh, sep=None, engine='python', encoding=encoding, header=header_index,
-                                     on_bad_lines='skip')
-
-            df = df.dropna(how='all')
-            df = df.fillna("")
-            df.columns = [str(c).strip() for c in df.columns]
-            return df
-        except Exception:
+            # final=False - vzorek může končit uprostřed vícebajtového znaku
+            sample = codecs.getincrementaldecoder(enc)().decode(raw, final=False)
+            encoding = enc
+            break
+        except UnicodeDecodeError:
             continue
-    return None
+    if sample is None:
+        return None
 
+    # Poslední řádek vzorku bývá useknutý
+    if len(raw) == CSV_SAMPLE_BYTES and "\n" in sample:
+        sample = sample[:sample.rindex("\n")]
+
+    lines = sample.splitlines()
+    header_line = 0
+    for i, line in enumerate(lines[:15]):
+        if any(k in line.lower() for k in CSV_HEADER_KEYWORDS):
+            header_line = i
+            break
+
+    header_sample = "\n".join(lines[header_line:])
+    try:
+        sep = csv.Sniffer().sniff(header_sample, delimiters=",;\t|").delimiter
+    except csv.Error:
+        first = lines[header_line] if lines else ""
+        sep = max([",", ";", "\t", "|"], key=first.count)
+
+    return encoding, sep, header_line
+
+
+def _clean_csv_frame(df):
+    df = df.fillna("")
+    df = df[(df != "").any(axis=1)]
+    df.columns = [str(c).strip() for c in df.columns]
+    return df
 
-# --- 3. Chunking funkce (GENERÁTOR) ---
 
-def semantic_chunking(text, filename):
+def csv_file_hash(fh, block_size=1024 * 1024):
+    """SHA-1 obsahu otevřeného CSV (po blocích); pozici v souboru vrátí na začátek."""
+    digest = hashlib.sha1()
+    for block in iter(lambda: fh.read(block_size), b""):
+        digest.update(block)
+    fh.seek(0)
+    return digest.hexdigest()
+
+
+def read_csv_smart(fh, chunksize=None):
     """
-    Inteligentní řezání textu pomocí GPT-4o-mini.
-    Upraveno na YIELD (Generátor) - každý zpracovaný blok se okamžitě vrací do hlavní smyčky k uložení do DB!
+    Načte CSV rychlým C parserem podle formátu zjištěného v sniff_csv_format.
+    Bez `chunksize` vrací DataFrame, s ním generátor DataFrame po částech. Všechny hodnoty jsou řetězce.
     """
-    if not text or len(text.strip()) < 10:
-        return
+    fmt = sniff_csv_format(fh)
+    if fmt is None:
+        return None
+    encoding, sep, skiprows = fmt
 
-    print(f"🧠 Sémantické řezání obsahu: {filename}...")
-    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
+    fh.seek(0)
+    try:
+        result = pd.read_csv(fh, sep=sep, engine='c', encoding=encoding, encoding_errors='replace',
+                             skiprows=skiprows, dtype=str, keep_default_na=False, on_bad_lines='skip',
+                             chunksize=chunksize)
+    except Exception as e:
+        print(f"   ⚠️ CSV nelze načíst ({encoding}, oddělovač {sep!r}): {e}")
+        return None
 
-    chunk_size = 12000
-    text_blocks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+    if chunksize is None:
+        return _clean_csv_frame(result)
+    return (_clean_csv_frame(df) for df in result)
 
-    yielded_any = False
 
-    for idx, block in enumerate(text_blocks):
-        if len(text_blocks) > 1:
-            print(f"   ⏳ Zpracovávám část {idx + 1}/{len(text_blocks)} dokumentu {filename}...")
+# --- 3. Chunking funkce (GENERÁTOR) ---
+
+CHUNKING_BLOCK_CHARS = 12000  # Kolik textu jde do jednoho požadavku na sémantické řezání
 
-        prompt = f"""
+
+def iter_text_blocks(text, chunk_size):
+    """Skládá text (řetězec nebo postupně přitékající části, např. stránky PDF) do bloků pevné délky."""
+    if isinstance(text, str):
+        for i in range(0, len(text), chunk_size):
+            yield text[i:i + chunk_size]
+        return
+
+    buffer = ""
+    for part in text:
+        buffer += part
+        while len(buffer) >= chunk_size:
+            yield buffer[:chunk_size]
+            buffer = buffer[chunk_size:]
+    if buffer:
+        yield buffer
+
+
+def chunking_request(block, filename, idx, total_blocks):
+    """Tělo požadavku na sémantické řezání jednoho bloku (sdílí ho i hromadný režim v bulk_ingest.py)."""
+    prompt = f"""
         Jsi expertní analytik. Rozděl text na logické celky (chunky).
-        Zdroj: {filename} (Část {idx + 1} z {len(text_blocks)})
+        Zdroj: {filename} (Část {idx + 1} z {total_blocks})
         Pravidla:
         1. Výstup MUSÍ být validní JSON.
         2. Formát: {{"chunks": [ {{"title": "...", "content": "..."}} ]}}
@@ -243,29 +488,62 @@ def semantic_chunking(text, filename):
         {block}
         """
 
-        data = {
-            "model": "gpt-4o-mini",
-            "messages": [{"role": "user", "content": prompt}],
-            "response_format": {"type": "json_object"},
-            "temperature": 0.0
-        }
+    return {
+        "model": "gpt-4o-mini",
+        "messages": [{"role": "user", "content": prompt}],
+        "response_format": {"type": "json_object"},
+        "temperature": 0.0
+    }
+
+
+def parse_chunking_reply(content):
+    """Seznam chunků ({"title", "content"}) z JSON odpovědi modelu."""
+    json_content = json.loads(content)
+    if "chunks" in json_content:
+        return json_content["chunks"]
+    elif "items" in json_content:
+        return json_content["items"]
+    return []
+
+
+def semantic_chunking(text, filename, total_chars=None):
+    """
+    Inteligentní řezání textu pomocí GPT-4o-mini.
+    Upraveno na YIELD (Generátor) - každý zpracovaný blok se okamžitě vrací do hlavní smyčky k uložení do DB!
+    `text` může být i generátor částí (např. stránky PDF) - pak je vhodné předat `total_chars` kvůli výpisu průběhu.
+    """
+    if isinstance(text, str):
+        if not text or len(text.strip()) < 10:
+            return
+        total_chars = len(text)
+
+    print(f"🧠 Sémantické řezání obsahu: {filename}...")
+    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
+
+    chunk_size = CHUNKING_BLOCK_CHARS
+    total_blocks = -(-total_chars // chunk_size) if total_chars else "?"
+
+    yielded_any = False
+    fallback_text = ""
+
+    for idx, block in enumerate(iter_text_blocks(text, chunk_size)):
+        if len(fallback_text) < 10000:
+            fallback_text += block[:10000 - len(fallback_text)]
+
+        if total_blocks != 1:
+            print(f"   ⏳ Zpracovávám část {idx + 1}/{total_blocks} dokumentu {filename}...")
+
+        data = chunking_request(block, filename, idx, total_blocks)
 
         try:
-            response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=data,
-                                     timeout=180)
+            response = post_openai(LLM_API_URL, headers, data, priority="ingest",
+                                   timeout=180)
 
             if response.status_code == 200:
                 result = response.json()
                 content = result["choices"][0]["message"]["content"]
-                json_content = json.loads(content)
-
-                chunks_to_yield = []
-                if "chunks" in json_content:
-                    chunks_to_yield = json_content["chunks"]
-                elif "items" in json_content:
-                    chunks_to_yield = json_content["items"]
 
-                for c in chunks_to_yield:
+                for c in parse_chunking_reply(content):
                     yielded_any = True
                     yield c
             else:
@@ -276,44 +554,74 @@ def semantic_chunking(text, filename):
 
     if not yielded_any:
         print("   ⚠️ Sémantický chunking nevrátil nic. Používám hrubý fallback.")
-        yield {"title": f"Obsah z {filename}", "content": text[:10000]}
+        if len(fallback_text.strip()) < 10:
+            return
+        yield {"title": f"Obsah z {filename}", "content": fallback_text}
 
 
-def csv_row_chunking(df, filename):
-    print(f"📊 Zpracovávám tabulku předmětů: {filename} ({len(df)} řádků)...")
-    chunks = []
+CSV_PRIORITY_FIELDS = {
+    'NAZEV_AN': 'Anglický název', 'GARANTI': 'Garanti', 'VYUCUJICI': 'Vyučující',
+    'KREDITY': 'Kredity', 'ROK_VARIANTY': 'Rok varianty', 'ANOTACE_CZ': 'Anotace',
+    'CIL_CZ': 'Cíle předmětu', 'OSNOVA_CZ': 'Osnova', 'LITERATURA': 'Literatura',
+    'POZADAVKY_CZ': 'Požadavky', 'METODY_VYUKY_CZ': 'Metody', 'URL': 'Odkaz'
+}
 
-    for index, row in df.iterrows():
-        row_dict = row.to_dict()
-        nazev = row_dict.get('NAZEV_CZ', row_dict.get('NAZEV_AN', 'Neznámý předmět'))
-        kod = row_dict.get('ZKR_PREDM', '')
 
-        if not kod:
-            for k, v in row_dict.items():
-                if 'zkr' in str(k).lower() and not kod: kod = str(v)
+def csv_frame_chunks(df):
+    """Sestaví chunky pro jeden DataFrame po sloupcích (bez iterrows a slovníků pro každý řádek)."""
+    if df.empty:
+        return []
 
-        if nazev == 'Neznámý předmět' and not kod:
-            continue
+    if 'NAZEV_CZ' in df.columns:
+        nazev = df['NAZEV_CZ'].astype(str)
+    elif 'NAZEV_AN' in df.columns:
+        nazev = df['NAZEV_AN'].astype(str)
+    else:
+        nazev = pd.Series('Neznámý předmět', index=df.index)
 
-        title = f"Předmět: {nazev} ({kod})".strip()
-        content_lines = [f"--- Detail předmětu: {title} ---"]
+    # Kód předmětu: ZKR_PREDM, jinak první neprázdný sloupec obsahující 'zkr'
+    kod = df['ZKR_PREDM'].astype(str) if 'ZKR_PREDM' in df.columns else pd.Series('', index=df.index)
+    for col in df.columns:
+        if 'zkr' in str(col).lower():
+            kod = kod.where(kod != '', df[col].astype(str))
 
-        priority_fields = {
-            'NAZEV_AN': 'Anglický název', 'GARANTI': 'Garanti', 'VYUCUJICI': 'Vyučující',
-            'KREDITY': 'Kredity', 'ROK_VARIANTY': 'Rok varianty', 'ANOTACE_CZ': 'Anotace',
-            'CIL_CZ': 'Cíle předmětu', 'OSNOVA_CZ': 'Osnova', 'LITERATURA': 'Literatura',
-            'POZADAVKY_CZ': 'Požadavky', 'METODY_VYUKY_CZ': 'Metody', 'URL': 'Odkaz'
-        }
+    keep = ~((nazev == 'Neznámý předmět') & (kod == ''))
+    if not keep.any():
+        return []
+    df, nazev, kod = df[keep], nazev[keep], kod[keep]
+
+    title = ("Předmět: " + nazev + " (" + kod + ")").str.strip()
+    content = "--- Detail předmětu: " + title + " ---"
+
+    for key, label in CSV_PRIORITY_FIELDS.items():
+        if key in df.columns:
+            val = df[key].astype(str).str.strip()
+            mask = (val != '') & (val.str.lower() != 'nan')
+            content = content + ("\n" + label + ": " + val).where(mask, '')
+
+    return [{"title": t, "content": c} for t, c in zip(title.tolist(), content.tolist())]
 
-        for key, label in priority_fields.items():
-            if key in row_dict:
-                val = str(row_dict[key]).strip()
-                if val and val.lower() != 'nan':
-                    content_lines.append(f"{label}: {val}")
 
-        chunks.append({"title": title, "content": "\n".join(content_lines)})
+def csv_row_chunking(frames, filename):
+    """
+    Generátor chunků z tabulky předmětů. Přijímá DataFrame i generátor DataFrame z read_csv_smart(chunksize=...),
+    takže embedding prvních předmětů začne dřív, než se načte celý soubor.
+    """
+    if isinstance(frames, pd.DataFrame):
+        frames = [frames]
+
+    print(f"📊 Zpracovávám tabulku předmětů: {filename}...")
+    for df in frames:
+        yield from csv_frame_chunks(df)
 
-    return chunks
+
+def track_csv_total(frames, progress):
+    """Celkový počet řádků neznáme dopředu - průběžně ho navyšujeme po každé načtené části."""
+    total_rows = 0
+    for df in frames:
+        total_rows += len(df)
+        progress.set_total(total_rows)
+        yield df
 
 
 # --- 4. Embedding ---
@@ -323,10 +631,11 @@ def get_embedding(text):
         return None
 
     headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
-    data = {"input": text, "model": EMBEDDING_MODEL}
+    # Ukládá se vždy plná dimenze - zkrácený vektor pro sken si aplikace odvodí sama (reduced_embeddings.py)
+    data = {"input": text, "model": EMBEDDING_MODEL, "dimensions": EMBEDDING_DIMENSIONS}
 
     try:
-        response = requests.post(OPENAI_EMBEDDING_URL, headers=headers, json=data, timeout=60)
+        response = post_openai(OPENAI_EMBEDDING_URL, headers, data, priority="ingest", timeout=60)
         if response.status_code == 200:
             return np.array(response.json()["data"][0]["embedding"])
         else:
@@ -337,75 +646,241 @@ def get_embedding(text):
         return None
 
 
-# --- 5. HLAVNÍ LOGIKA INDEXACE ---
+# --- 5. LEXIKÁLNÍ INDEX (BM25) ---
+
+def build_sparse_indexes(mode):
+    """
+    Spočítá BM25 postings pro přestavěné oddíly ze stínových tabulek a uloží je s generací,
+    kterou oddíl dostane po prohození. Chatbot je pak jen načte, nemusí nic tokenizovat.
+    """
+    generations = get_embedding_generations()
+    for partition in partitions_for_mode(mode):
+        rows = load_partition_texts(partition, shadow=True)
+        data = build_postings(rows)
+        save_sparse_index(partition, pack_postings(data), generations.get(partition, 0) + 1)
+        print(f"🔤 Lexikální index oddílu '{partition}': {len(rows)} záznamů, {len(data['postings'])} termů.")
+
 
-def run_ingest(mode="all"):
+# --- 6. HLAVNÍ LOGIKA INDEXACE ---
+
+class IngestCancelled(Exception):
+    """
+    Indexace byla ukončena zvenku (viz worker.py). `status` je výsledek běhu: 'cancelled' (zrušeno
+    z admin panelu), nebo 'lease_lost' (worker ztratil zámek indexace).
+    """
+
+    def __init__(self, status="cancelled"):
+        super().__init__(status)
+        self.status = status
+
+
+def run_ingest(mode="all", should_cancel=None, drive_service=None, lease_owner=None):
+    """
+    Režimy: 'all', 'web', 'csv', 'drive', 'bulk' a 'resume'. Resume naváže na nedokončený běh - použije existující
+    stínové tabulky oddílů a přeskočí vše, co už je podle žurnálu (ingest_checkpoints) kompletně uložené.
+    Režim 'drive' zpracuje jen soubory změněné na Google Disku od minulého běhu (`drive_service` umožňuje
+    podstrčit např. fake_drive.FakeDriveService).
+    Režim 'bulk' přestaví totéž co 'all', ale řezání i embeddingy pošle přes OpenAI Batch API (bulk_ingest.py).
+    `should_cancel` je volitelná funkce, kterou se průběžně kontroluje požadavek na ukončení - vrací důvod
+    ('cancelled', 'lease_lost'), nebo nic. Kontroluje se před každým uloženým chunkem a těsně před prohozením
+    tabulek; s `lease_owner` (ID workeru) prohození navíc v DB ověří, že zámek indexace pořád drží.
+    Vrací 'success', 'error', 'cancelled', 'lease_lost', nebo None (není na co navázat).
+    """
     print(f"🚀 Startuji indexaci na pozadí (Režim: {mode})...")
 
-    if mode in ["all", "web"]: set_sync_status("WEB", "running")
-    if mode in ["all", "csv"]: set_sync_status("CSV", "running")
+    def check_cancel():
+        reason = should_cancel() if should_cancel is not None else None
+        if reason:
+            raise IngestCancelled(reason if isinstance(reason, str) else "cancelled")
+
+    resuming = mode == "resume"
+    if resuming:
+        mode = get_resumable_run()
+        if mode is None:
+            print("⚠️ Není žádný nedokončený běh, na který by šlo navázat.")
+            return None
+        print(f"⏯️ Navazuji na nedokončený běh (Režim: {mode}).")
+
+    if mode == "bulk":
+        # Hromadná přestavba má vlastní průběh ve fázích (viz bulk_ingest.py)
+        from bulk_ingest import run_bulk_ingest
+        return run_bulk_ingest(should_cancel, resuming=resuming, lease_owner=lease_owner)
+
+    # Průběh se sbírá v paměti a do sync_status se zapisuje po intervalech
+    progress = {}
+    if mode in ["all", "web"]: progress["WEB"] = SyncProgress("WEB")
+    if mode in ["all", "csv"]: progress["CSV"] = SyncProgress("CSV")
+    if mode == "drive": progress["DRIVE"] = SyncProgress("DRIVE")
+    for tracker in progress.values():
+        tracker.start()
 
     try:
-        prepare_next_table_for_update(mode)
+        if resuming:
+            done = load_checkpoints()
+        else:
+            prepare_next_table_for_update(mode)
+            start_ingest_journal(mode)
+            done = {}
+        done_urls = done.get("url", set())
+        done_pdfs = done.get("pdf", set())
+        done_rows = done.get("csv", set())
+        done_drive = done.get("drive", set())
         success_count = 0
+        duplicate_count = 0
+        seen_pdfs = set(done_pdfs)
+
+        # Téměř shodné chunky (překrývající se stránky, opakované patičky, kopie dokumentů) se neembedují
+        # znovu - jen se k už uloženému záznamu připíše další zdrojová URL. Týká se webového oddílu, CSV ne.
+        # Webový oddíl je přírůstkový - filtr zná i záznamy stránek, které se tentokrát neprocházejí.
+        dedup = NearDuplicateFilter(NEAR_DUP_THRESHOLD)
+        dedup_payloads = {}  # zdroj -> payloady jeho záznamů ve filtru (při smazání zdroje se zneplatní)
+
+        def remember_chunk(chunk_text, record_id, source_url):
+            payload = {"id": record_id, "urls": {source_url}}
+            dedup.add(chunk_text, payload)
+            dedup_payloads.setdefault(source_url, []).append(payload)
+
+        if "web" in partitions_for_mode(mode):
+            for record_id, chunk_text, source_url in load_next_table_sources("web"):
+                remember_chunk(chunk_text, record_id, source_url)
+
+        def discard_web_source(source_url):
+            """
+            Smaže starou verzi zdroje ze stínové tabulky. Vrací stránky, jejichž (duplicitní) text
+            byl uložený jen jako alt_urls u mazaných záznamů - ty je potřeba projít znovu.
+            """
+            alternates = next_table_alternate_sources(source_url)
+            discard_next_table_rows(source_url)
+            for payload in dedup_payloads.pop(source_url, []):
+                payload["dead"] = True
+            return pages_linking_sources(alternates - {source_url}) if alternates else []
+
+        def store_chunk(chunk, default_title, embedding_prefix, source_file, source_url, partition="web"):
+            nonlocal success_count, duplicate_count
+            title = chunk.get("title", default_title).strip()
+            content = chunk.get("content", "").strip()
+            if not content:
+                return
+            # Po ztrátě zámku už do stínových tabulek zapisuje jiný worker
+            check_cancel()
+
+            original = dedup.find(content) if partition == "web" else None
+            if original is not None and not original.get("dead"):
+                if source_url not in original["urls"]:
+                    add_alternate_source(original["id"], source_url)
+                    original["urls"].add(source_url)
+                duplicate_count += 1
+                print(f"   ♻️ Duplicitní chunk přeskočen: {title[:40]}...")
+                return
+
+            emb = get_embedding(f"{embedding_prefix}\n{content}")
+            if emb is not None:
+                record_id = insert_into_next_table(title, content, emb, source_file, source_url, partition=partition)
+                if partition == "web":
+                    remember_chunk(content, record_id, source_url)
+                print(f"   💾 Průběžně uloženo do DB: {title[:40]}...")
+                success_count += 1
 
         # --- FÁZE A: CRAWLER (Web UHK) ---
+        # Prochází se jen stránky, které jsou podle plánu na řadě nebo se podle sitemapy změnily.
+        # Ostatní zůstávají ve stínové tabulce z živé verze.
+        crawled_urls = set(done_urls)
         if mode in ["all", "web"]:
-            urls = get_urls_from_db()
-            total_urls = len(urls)
-            set_sync_status("WEB", "running", total=total_urls)
+            refresh_sitemaps()
+            urls = deque(get_urls_from_db())
+            queued = set(urls)
+            progress["WEB"].set_total(len(urls))
+
+            def requeue(pages):
+                for page in pages:
+                    if page not in queued:
+                        queued.add(page)
+                        urls.append(page)
+                progress["WEB"].set_total(len(queued))
 
             if urls:
-                print(f"🌍 Nalezeno {total_urls} URL adres k indexaci.")
-                for idx, url in enumerate(urls, 1):
+                print(f"🌍 K indexaci je na řadě {len(urls)} URL adres.")
+                idx = 0
+                while urls:
+                    url = urls.popleft()
+                    idx += 1
+                    check_cancel()
+                    if url in done_urls:
+                        progress["WEB"].update(idx, skipped=True)
+                        continue
+
                     try:
                         web_text, pdf_links, page_title = scrape_uhk_page(url)
 
+                        # Starou verzi stránky mažeme až po úspěšném stažení nové
+                        check_cancel()
+                        requeue(discard_web_source(url))
+                        save_pdf_links(url, pdf_links)
+
                         if web_text:
                             # Průběžná iterace přes generátor
                             for chunk in semantic_chunking(web_text, f"Web: {url}"):
-                                title = chunk.get("title", "Webová stránka").strip()
-                                content = chunk.get("content", "").strip()
-
-                                if not content:
-                                    continue
-
-                                emb = get_embedding(f"URL: {url}\n{content}")
-                                if emb is not None:
-                                    # Vkládá: title, chunk, embedding, source_file=page_title, source_url=url
-                                    insert_into_next_table(title, content, emb, page_title, url)
-                                    print(f"   💾 Průběžně uloženo do DB: {title[:40]}...")
-                                    success_count += 1
+                                store_chunk(chunk, "Webová stránka", f"URL: {url}", page_title, url)
 
                         if pdf_links:
                             print(f"   📎 Nalezeno {len(pdf_links)} souborů na odkazu {url}.")
-                            for pdf_url in pdf_links:
-                                pdf_text = process_pdf_from_url(pdf_url)
-                                if pdf_text:
+                            # Stahujeme postupně, parsování ale běží paralelně v process poolu
+                            pdf_jobs = []
+                            try:
+                                for pdf_url in pdf_links:
+                                    # Stejné PDF (např. studijní řád) bývá odkázané z mnoha stránek - zpracujeme ho jednou za běh
+                                    if pdf_url in seen_pdfs:
+                                        continue
+                                    future = process_pdf_from_url(pdf_url)
+                                    if future is not None:
+                                        pdf_jobs.append((pdf_url, future))
+
+                                while pdf_jobs:
+                                    check_cancel()
+                                    pdf_url, future = pdf_jobs.pop(0)
+                                    pdf_text = collect_pdf_text(pdf_url, future)
+                                    if not pdf_text:
+                                        continue
+
+                                    txt_path, total_chars = pdf_text
                                     filename_short = pdf_url.split('/')[-1]
-
-                                    # Průběžná iterace přes generátor pro PDF
-                                    for chunk in semantic_chunking(pdf_text, f"PDF: {filename_short}"):
-                                        title = chunk.get("title", "PDF Dokument").strip()
-                                        content = chunk.get("content", "").strip()
-
-                                        if not content:
-                                            continue
-
-                                        emb = get_embedding(f"Zdroj PDF: {pdf_url}\n{content}")
-                                        if emb is not None:
-                                            # Vkládá: title, chunk, embedding, source_file=filename_short, source_url=pdf_url
-                                            insert_into_next_table(title, content, emb, filename_short, pdf_url)
-                                            print(f"   💾 Průběžně uloženo do DB: {title[:40]}...")
-                                            success_count += 1
-
+                                    try:
+                                        # Starou verzi PDF mažeme až když máme text nové (nestažené PDF zůstává)
+                                        check_cancel()
+                                        requeue(discard_web_source(pdf_url))
+                                        # Průběžná iterace přes generátor pro PDF
+                                        for chunk in semantic_chunking(iter_text_file(txt_path), f"PDF: {filename_short}",
+                                                                       total_chars=total_chars):
+                                            store_chunk(chunk, "PDF Dokument", f"Zdroj PDF: {pdf_url}", filename_short, pdf_url)
+                                    finally:
+                                        os.remove(txt_path)
+
+                                    mark_checkpoint("pdf", pdf_url)
+                                    # Až po uložení - PDF, které selže, zkusí znovu další stránka, která na něj odkazuje
+                                    seen_pdfs.add(pdf_url)
+                            finally:
+                                # Po chybě nebo zrušení uklidíme dočasné soubory úloh, které už nikdo nezpracuje
+                                for _, future in pdf_jobs:
+                                    discard_pdf_job(future)
+
+                        mark_checkpoint("url", url)
+                        crawled_urls.add(url)
+
+                    except IngestCancelled:
+                        raise
                     except Exception as e:
-                        log_sync_error("WEB", f"Chyba na {url}: {str(e)}")
+                        progress["WEB"].error(f"Chyba na {url}: {str(e)}")
                         print(f"   ❌ Chyba zpracování webu {url}: {e}")
 
-                    update_sync_progress("WEB", idx)
+                    progress["WEB"].update(idx)
             else:
-                print("⚠️ Žádná URL v databázi. Přidej je přes /admin.")
+                print("✅ Žádná URL není na řadě (nové URL přidej přes /admin nebo ze sitemapy).")
+
+            # Stránky odebrané z crawler_urls a PDF, na která už nic neodkazuje
+            check_cancel()
+            orphaned = discard_orphaned_web_rows()
+            if orphaned:
+                print(f"🧹 Odebráno {orphaned} záznamů zdrojů, které už nejsou v seznamu URL.")
 
         # --- FÁZE B: LOKÁLNÍ CSV (Studijní plány) ---
         if mode in ["all", "csv"]:
@@ -414,54 +889,157 @@ def run_ingest(mode="all"):
                 print(f"📊 Načítám lokální CSV: {csv_path}")
                 try:
                     with open(csv_path, "rb") as f:
-                        df = read_csv_smart(f)
-
-                    if df is not None:
-                        csv_chunks = csv_row_chunking(df, "Lokální Databáze Předmětů")
-                        total_rows = len(csv_chunks)
-                        set_sync_status("CSV", "running", total=total_rows)
-
-                        for idx, chunk in enumerate(csv_chunks, 1):
-                            try:
-                                emb = get_embedding(chunk["content"])
-                                if emb is not None:
-                                    # Vkládá: title, chunk, embedding, source_file="STAG Export", source_url=""
-                                    insert_into_next_table(chunk["title"], chunk["content"], emb, "STAG Export", "")
-                                    success_count += 1
-                            except Exception as e:
-                                log_sync_error("CSV", f"Chyba na řádku {idx}: {str(e)}")
-
-                            update_sync_progress("CSV", idx)
-
-                        print(f"✅ CSV zpracováno: {total_rows} předmětů.")
-                    else:
-                        set_sync_status("CSV", "running", total=0)
-                        log_sync_error("CSV", "Nelze načíst obsah CSV.")
+                        # Checkpointy řádků platí jen pro stejné CSV - po výměně souboru začne fáze CSV znovu
+                        if sync_csv_journal(csv_file_hash(f)):
+                            print("⚠️ CSV se od přerušeného běhu změnilo, stínovou tabulku CSV plním znovu.")
+                            done_rows = set()
+                        frames = read_csv_smart(f, chunksize=CSV_CHUNK_ROWS)
+
+                        if frames is not None:
+                            frames = track_csv_total(frames, progress["CSV"])
+
+                            idx = 0
+                            for idx, chunk in enumerate(csv_row_chunking(frames, "Lokální Databáze Předmětů"), 1):
+                                # Checkpoint řádku = pořadí předmětu v souboru (platí pro CSV s hashem v žurnálu)
+                                if str(idx) in done_rows:
+                                    progress["CSV"].update(idx, skipped=True)
+                                    continue
+                                check_cancel()
+                                try:
+                                    emb = get_embedding(chunk["content"])
+                                    if emb is not None:
+                                        # Vkládá: title, chunk, embedding, source_file="STAG Export", source_url=""
+                                        insert_into_next_table(chunk["title"], chunk["content"], emb, "STAG Export", "",
+                                                               checkpoint=("csv", str(idx)), partition="csv")
+                                        success_count += 1
+                                except Exception as e:
+                                    progress["CSV"].error(f"Chyba na řádku {idx}: {str(e)}")
+
+                                progress["CSV"].update(idx)
+
+                            # Prázdné řádky bez předmětu se do chunků nedostanou - srovnáme progress bar
+                            progress["CSV"].set_total(idx)
+                            print(f"✅ CSV zpracováno: {idx} předmětů.")
+                        else:
+                            progress["CSV"].error("Nelze načíst obsah CSV.")
+                except IngestCancelled:
+                    raise
                 except Exception as e:
-                    log_sync_error("CSV", f"Chyba při čtení CSV: {str(e)}")
+                    progress["CSV"].error(f"Chyba při čtení CSV: {str(e)}")
                     print(f"❌ Chyba při čtení CSV: {e}")
             else:
-                set_sync_status("CSV", "running", total=0)
-                log_sync_error("CSV", f"Soubor nenalezen: {csv_path}")
+                progress["CSV"].error(f"Soubor nenalezen: {csv_path}")
                 print(f"⚠️ CSV soubor nenalezen na cestě: {csv_path}. Přeskočeno.")
 
-        # --- FINÁLE: PROHOZENÍ TABULEK ---
-        print(f"🔄 Provádím atomické prohození tabulek (Zpracováno celkem {success_count} záznamů)...")
-        swap_tables_atomic()
+        # --- FÁZE C: GOOGLE DISK (jen změny od minulého běhu) ---
+        drive_token = None
+        if mode == "drive":
+            service = drive_service or get_drive_service(readonly=True)
+            if service is None:
+                raise Exception("Google Disk není dostupný (chybí credentials).")
+
+            previous_token = get_drive_page_token()
+            if previous_token is None:
+                # Token bereme před výpisem, aby se neztratilo nic, co se změní během něj
+                drive_token = get_start_page_token(service)
+                changed, removed = list_all_files(service), set()
+                print(f"📁 Úplný výpis Google Disku: {len(changed)} souborů.")
+                # Po nedokončeném prvním běhu zůstaly ve stínové tabulce i soubory, které mezitím zmizely
+                # a feed změn o nich už nic neřekne
+                orphaned = discard_unlisted_next_table_rows({drive_source_url(file_id) for file_id in changed},
+                                                            partition="drive")
+                if orphaned:
+                    print(f"🧹 Odebráno {orphaned} záznamů souborů, které už na Disku nejsou.")
+            else:
+                changed, removed, drive_token = collect_changes(service, previous_token)
+                print(f"📁 Změny na Google Disku: {len(changed)} nových/upravených, {len(removed)} odebraných.")
+
+            progress["DRIVE"].set_total(len(changed) + len(removed))
+            drive_failed = False
+            idx = 0
+            for file_id in removed:
+                idx += 1
+                check_cancel()
+                discard_next_table_rows(drive_source_url(file_id), partition="drive")
+                progress["DRIVE"].update(idx)
+
+            for file in changed.values():
+                idx += 1
+                check_cancel()
+                # Klíč i s časem změny - soubor upravený znovu po pádu se nepřeskočí
+                checkpoint_key = f"{file['id']}@{file.get('modifiedTime')}"
+                if checkpoint_key in done_drive:
+                    progress["DRIVE"].update(idx, skipped=True)
+                    continue
+
+                source_url = drive_source_url(file["id"])
+                try:
+                    text, total_chars, txt_path = read_drive_file(service, file)
+                    try:
+                        # Starou verzi souboru (nebo zbytky po pádu) mažeme až s novým textem v ruce - soubor,
+                        # který nejde stáhnout ani přečíst, zůstává ve stínové tabulce v minulé verzi
+                        check_cancel()
+                        discard_next_table_rows(source_url, partition="drive")
+                        if total_chars:
+                            for chunk in semantic_chunking(text, f"Disk: {file['name']}", total_chars=total_chars):
+                                store_chunk(chunk, file["name"], f"Dokument: {file['name']}", file["name"],
+                                            source_url, partition="drive")
+                    finally:
+                        if txt_path:
+                            os.remove(txt_path)
+                    mark_checkpoint("drive", checkpoint_key)
+                except IngestCancelled:
+                    raise
+                except Exception as e:
+                    drive_failed = True
+                    progress["DRIVE"].error(f"Chyba u souboru {file['name']}: {str(e)}")
+                    print(f"   ❌ Chyba zpracování souboru {file['name']}: {e}")
+
+                progress["DRIVE"].update(idx)
+
+            if drive_failed:
+                # Token neposuneme - nezpracované soubory se příště vezmou znovu
+                print("⚠️ Některé soubory z Disku selhaly, token feedu změn zůstává na minulé hodnotě.")
+                drive_token = None
 
-        if mode in ["all", "web"]: set_sync_status("WEB", "success")
-        if mode in ["all", "csv"]: set_sync_status("CSV", "success")
+        # --- FINÁLE: PROHOZENÍ TABULEK ---
+        print(f"🔄 Provádím atomické prohození tabulek (Zpracováno celkem {success_count} záznamů, "
+              f"{duplicate_count} duplicitních chunků přeskočeno)...")
+        check_cancel()
+        build_sparse_indexes(mode)
+        check_cancel()
+        if not swap_tables_atomic(mode, lease_owner=lease_owner):
+            raise IngestCancelled("lease_lost")
+        if crawled_urls:
+            # Plán crawlu se posouvá až s živými daty - po pádu se stránky projdou znovu
+            mark_urls_crawled(crawled_urls)
+        if drive_token:
+            save_drive_page_token(drive_token)
+        finish_ingest_journal()
+
+        for tracker in progress.values():
+            tracker.finish("success")
         print("🎉 Indexace úspěšně dokončena. Data jsou LIVE.")
+        return "success"
+
+    except IngestCancelled as e:
+        # Žurnál i stínové tabulky zůstávají - na zrušený běh lze později navázat
+        print(f"⏹️ Indexace ukončena ({e.status}).")
+        for tracker in progress.values():
+            tracker.finish(e.status)
+        return e.status
 
     except Exception as e:
         print(f"❌ Krizová chyba při indexaci: {e}")
-        if mode in ["all", "web"]:
-            log_sync_error("WEB", f"Kritická chyba: {str(e)}")
-            set_sync_status("WEB", "error")
-        if mode in ["all", "csv"]:
-            log_sync_error("CSV", f"Kritická chyba: {str(e)}")
-            set_sync_status("CSV", "error")
+        for tracker in progress.values():
+            tracker.error(f"Kritická chyba: {str(e)}")
+            tracker.finish("error")
+        return "error"
+    finally:
+        shutdown_pdf_pool()
 
 
 if __name__ == "__main__":
-    run_ingest("all")
\ No newline at end of file
+    # Přímé spuštění běží pod stejným zámkem jako worker, aby se dva běhy nepotkaly
+    from worker import run_with_lease
+    run_with_lease("all")
\ No newline at end of file
@@ -0,0 +1,231 @@
+import re
+import json
+import zlib
+import math
+import hashlib
+import unicodedata
+import numpy as np
+
+# Lexikální (sparse) část vyhledávání: BM25 nad tokeny s odstraněnou diakritikou a lehkým českým stemmingem.
+# Postings se počítají při indexaci pro každý oddíl zvlášť (build_postings) a chatbot je při načtení
+# spojí do jednoho indexu (BM25Index.from_postings).
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+STOPWORDS = {
+    "a", "aby", "ale", "ani", "ano", "az", "bez", "bude", "budou", "byl", "byla", "byli", "bylo", "byt", "co", "do",
+    "i", "jak", "jake", "jako", "je", "jeho", "jej", "jeji", "jen", "jsem", "jsme", "jsou", "jste", "k", "kam", "kde",
+    "kdo", "kdy", "kdyz", "ke", "ktera", "ktere", "kteri", "ktery", "ma", "mam", "mate", "me", "mi", "mit", "mne",
+    "mu", "muj", "na", "nad", "nam", "nas", "ne", "neni", "nebo", "o", "od", "ok", "on", "ona", "oni", "pak", "po",
+    "pod", "pro", "proc", "protoze", "pri", "s", "se", "si", "sve", "ta", "tak", "take", "taky", "te", "tedy", "ten",
+    "tento", "to", "toho", "tom", "tomu", "tu", "tuto", "ty", "u", "uz", "v", "ve", "vam", "vas", "z", "za", "ze",
+}
+
+# Koncovky pro lehký stemming (po odstranění diakritiky), seřazené od nejdelší
+_SUFFIXES = sorted([
+    "atech", "etem", "atum", "ovi", "ove", "ovy", "ech", "ich", "ych", "ami", "emi", "imi", "ymi", "eho", "emu",
+    "ata", "aty", "atu", "ama", "ovu", "ou", "em", "im", "ym", "am", "um", "es", "eti", "ete", "at", "us", "os",
+    "a", "e", "i", "o", "u", "y",
+], key=len, reverse=True)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def fold_diacritics(text):
+    """'Přijímací řízení' -> 'prijimaci rizeni'."""
+    normalized = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in normalized if not unicodedata.combining(ch))
+
+
+def stem(token):
+    """Lehký český stemming - odřízne nejčastější pádové koncovky. Tokeny s číslicemi (kódy předmětů) nechává být."""
+    if any(ch.isdigit() for ch in token):
+        return token
+    for suffix in _SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text):
+    """Tokeny pro BM25: malá písmena, bez diakritiky, bez stop slov, se stemmingem."""
+    if not text:
+        return []
+    tokens = _TOKEN_RE.findall(fold_diacritics(text.lower()))
+    return [stem(t) for t in tokens if len(t) > 1 and t not in STOPWORDS]
+
+
+def build_postings(rows):
+    """
+    Z řádků (id, title, chunk) jednoho oddílu sestaví postings pro BM25.
+    Výsledek je čistý slovník, aby šel uložit do DB (viz pack_postings).
+    """
+    ids = []
+    doc_len = []
+    postings = {}
+    for position, (record_id, title, chunk) in enumerate(rows):
+        counts = {}
+        tokens = tokenize(f"{title or ''}\n{chunk or ''}")
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, tf in counts.items():
+            entry = postings.setdefault(token, ([], []))
+            entry[0].append(position)
+            entry[1].append(tf)
+        ids.append(record_id)
+        doc_len.append(len(tokens))
+
+    return {"ids": ids, "doc_len": doc_len, "postings": {t: [p, f] for t, (p, f) in postings.items()}}
+
+
+def pack_postings(data):
+    return zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+
+
+def unpack_postings(blob):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+class BM25Index:
+    """BM25 nad celým korpusem. Pozice dokumentů odpovídají pořadí záznamů v rezidentním indexu chatbota."""
+
+    def __init__(self, num_docs, doc_len, postings, k1=BM25_K1, b=BM25_B):
+        self.num_docs = num_docs
+        self.k1 = k1
+        self.b = b
+        self.doc_len = np.asarray(doc_len, dtype=np.float32)
+        self.avgdl = float(self.doc_len.mean()) if num_docs else 0.0
+        self.postings = postings  # token -> (pozice np.int32, tf np.float32)
+
+    @classmethod
+    def from_postings(cls, parts, positions_by_id):
+        """
+        Spojí postings jednotlivých oddílů. `positions_by_id` mapuje ID záznamu na jeho pozici v indexu chatbota;
+        záznamy, které chatbot nenačetl (např. nevalidní embedding), se vynechají.
+        """
+        num_docs = len(positions_by_id)
+        doc_len = np.zeros(num_docs, dtype=np.float32)
+        merged = {}
+        for part in parts:
+            local_to_global = np.array([positions_by_id.get(i, -1) for i in part["ids"]], dtype=np.int64)
+            known = local_to_global >= 0
+            doc_len[local_to_global[known]] = np.asarray(part["doc_len"], dtype=np.float32)[known]
+            for token, (local_positions, tfs) in part["postings"].items():
+                global_positions = local_to_global[np.asarray(local_positions, dtype=np.int64)]
+                keep = global_positions >= 0
+                merged.setdefault(token, []).append((global_positions[keep], np.asarray(tfs, dtype=np.float32)[keep]))
+
+        postings = {
+            token: (np.concatenate([p for p, _ in chunks]).astype(np.int32), np.concatenate([f for _, f in chunks]))
+            for token, chunks in merged.items()
+        }
+        return cls(num_docs, doc_len, postings)
+
+    @classmethod
+    def from_documents(cls, rows):
+        """Index přímo z (id, title, chunk) - záložní cesta, když pro oddíl není uložený index z ingestu."""
+        rows = list(rows)
+        data = build_postings(rows)
+        return cls.from_postings([data], {row[0]: pos for pos, row in enumerate(rows)})
+
+    def idf(self, token):
+        df = len(self.postings[token][0])
+        return math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+
+    def scores(self, query_tokens):
+        """Vrátí pole BM25 skóre pro všechny dokumenty (nuly tam, kde se žádný token nevyskytuje)."""
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        if not self.num_docs:
+            return scores
+        for token in set(query_tokens):
+            if token not in self.postings:
+                continue
+            positions, tf = self.postings[token]
+            norm = self.k1 * (1 - self.b + self.b * self.doc_len[positions] / (self.avgdl or 1.0))
+            scores[positions] += self.idf(token) * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def candidates(self, query_tokens, limit):
+        """Pozice nejlepších `limit` dokumentů podle BM25 (jen ty s nenulovým skóre)."""
+        scores = self.scores(query_tokens)
+        hits = np.flatnonzero(scores)
+        if len(hits) > limit:
+            hits = hits[np.argpartition(scores[hits], -limit)[-limit:]]
+        return hits
+
+
+# --- Detekce téměř shodných chunků (MinHash + LSH) ---
+
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16  # 16 pásem po 4 řádcích - kandidáti od Jaccardovy podobnosti zhruba 0.5
+_MINHASH_PRIME = np.uint64((1 << 31) - 1)
+_rng = np.random.default_rng(20240901)  # Pevné semínko - podpisy musí být stejné napříč běhy
+_MINHASH_A = _rng.integers(1, int(_MINHASH_PRIME), MINHASH_PERMUTATIONS, dtype=np.uint64)
+_MINHASH_B = _rng.integers(0, int(_MINHASH_PRIME), MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+def _feature_hash(feature):
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def shingles(text, size=3):
+    """Množina trojic po sobě jdoucích tokenů (bez diakritiky, se stemmingem)."""
+    tokens = tokenize(text)
+    if len(tokens) < size:
+        return set(tokens)
+    return {" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+
+def minhash(text):
+    """MinHash podpis textu (pole MINHASH_PERMUTATIONS čísel), nebo None pro text bez tokenů."""
+    features = shingles(text)
+    if not features:
+        return None
+    hashes = np.array([_feature_hash(f) for f in features], dtype=np.uint64) % _MINHASH_PRIME
+    # (a * h + b) mod p pro všechny permutace najednou; h, a, b < 2^31, takže se vejdeme do uint64
+    permuted = (hashes[:, None] * _MINHASH_A + _MINHASH_B) % _MINHASH_PRIME
+    return permuted.min(axis=0)
+
+
+def estimated_jaccard(signature_a, signature_b):
+    return float(np.mean(signature_a == signature_b))
+
+
+class NearDuplicateFilter:
+    """
+    Pamatuje si MinHash podpisy už uložených chunků a pro nový text najde téměř shodný
+    (odhad Jaccardovy podobnosti trojic tokenů >= threshold). Kandidáty hledá přes LSH pásma,
+    takže nový chunk nemusí porovnávat se vším.
+    """
+
+    def __init__(self, threshold=0.8):
+        self.threshold = threshold
+        self._rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+        self._bands = [{} for _ in range(MINHASH_BANDS)]
+
+    def _band_keys(self, signature):
+        return [signature[i * self._rows:(i + 1) * self._rows].tobytes() for i in range(MINHASH_BANDS)]
+
+    def find(self, text, signature=None):
+        """Vrátí payload téměř shodného textu, nebo None."""
+        signature = minhash(text) if signature is None else signature
+        if signature is None:
+            return None
+        checked = set()
+        for band, key in zip(self._bands, self._band_keys(signature)):
+            for candidate_id, (other, payload) in band.get(key, {}).items():
+                if candidate_id in checked:
+                    continue
+                checked.add(candidate_id)
+                if estimated_jaccard(signature, other) >= self.threshold:
+                    return payload
+        return None
+
+    def add(self, text, payload, signature=None):
+        signature = minhash(text) if signature is None else signature
+        if signature is None:
+            return
+        entry_id = id(signature)
+        for band, key in zip(self._bands, self._band_keys(signature)):
+            band.setdefault(key, {})[entry_id] = (signature, payload)
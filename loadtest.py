@@ -0,0 +1,359 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import subprocess
+from datetime import datetime
+
+import numpy as np
+import requests
+
+from fake_openai import start_fake_openai, fake_embedding
+
+# Zátěžový test /api/chat. Spustí lokální fake OpenAI (fake_openai.py) s umělou latencí,
+# naplní vlastní databázi syntetickými daty, nastartuje aplikaci v zadané konfiguraci
+# a s rostoucím počtem souběžných "studentů" posílá vícekolové konverzace s historií.
+# Měří propustnost, percentily latence, chybovost a paměť workerů. Výsledek se připíše
+# do historie jako baseline pro danou konfiguraci a porovná s předchozím během.
+#
+#   python loadtest.py                                         # Flask dev server, 1 proces
+#   python loadtest.py --server gunicorn --workers 4 --threads 8
+#   python loadtest.py --concurrency 1,4,16,64 --duration 30 --latency-ms 800
+#
+# Potřebuje běžící MySQL (přihlašovací údaje z config.py); data jdou do samostatné DB (--db-name).
+
+DEFAULT_HISTORY_FILE = os.path.join("profiles", "loadtest.jsonl")
+
+SUBJECTS = [
+    ("ALG1", "Algoritmizace 1"), ("ZPRO", "Základy programování"), ("OA1", "Operační analýza 1"),
+    ("DBS1", "Databázové systémy 1"), ("MAT1", "Matematika 1"), ("SIT1", "Počítačové sítě 1"),
+    ("OOP", "Objektově orientované programování"), ("WEB1", "Tvorba webových aplikací 1"),
+    ("STAT", "Statistika"), ("UCET", "Účetnictví"), ("PRAV", "Právo v IT"), ("ANG1", "Angličtina 1"),
+]
+TOPICS = [
+    "zápis předmětů", "přijímací řízení", "státní závěrečná zkouška", "stipendium", "ubytování na kolejích",
+    "přerušení studia", "uznání předmětů", "individuální studijní plán", "kreditový systém", "poplatky za studium",
+    "zahraniční výjezd Erasmus", "bakalářská práce", "diplomová práce", "harmonogram akademického roku",
+]
+
+CONVERSATIONS = [
+    ["Kolik kreditů má předmět {code}?", "A kdo ho vyučuje?", "Kdy bývá zkouška?"],
+    ["Jak probíhá {topic}?", "Do kdy to musím stihnout?", "Kde najdu formulář?", "Díky, a co když to nestihnu?"],
+    ["Jaké jsou podmínky pro {topic}?", "Platí to i pro kombinované studium?"],
+    ["Je {code} povinný předmět?", "V jakém semestru se zapisuje?", "Můžu si ho uznat z jiné školy?"],
+    ["Potřebuju poradit s tématem {topic}.", "Na koho se mám obrátit na studijním oddělení?"],
+]
+
+
+def synthetic_documents(count, seed=42):
+    """Syntetické záznamy (title, chunk, source_file, source_url, oddíl) podobné skutečným webům a předmětům."""
+    rng = random.Random(seed)
+    docs = []
+    for i in range(count):
+        if i % 3 == 0:
+            code, name = rng.choice(SUBJECTS)
+            title = f"{code} - {name}"
+            text = (f"Předmět {name} ({code}) má {rng.choice([3, 4, 5, 6])} kreditů a vyučuje se v "
+                    f"{rng.choice(['zimním', 'letním'])} semestru. Garantem je doc. Ing. {rng.choice(['Novák', 'Svoboda', 'Dvořák'])}. "
+                    f"Zakončení: {rng.choice(['zápočet a zkouška', 'klasifikovaný zápočet', 'zkouška'])}. "
+                    f"Předmět je {rng.choice(['povinný', 'povinně volitelný', 'volitelný'])} v oboru Aplikovaná informatika.")
+            docs.append((title, text, "STAG Export", "", "csv"))
+        else:
+            topic = rng.choice(TOPICS)
+            title = f"{topic.capitalize()} ({i})"
+            sentences = [
+                f"Informace k tématu {topic} pro studenty FIM UHK.",
+                f"Žádost se podává přes studijní oddělení nejpozději do {rng.randint(1, 28)}. {rng.randint(1, 12)}.",
+                f"Podrobnosti upravuje studijní a zkušební řád, článek {rng.randint(1, 40)}.",
+                "Kontakt: studijní oddělení, budova J, kancelář J1" + str(rng.randint(10, 99)) + ".",
+                f"Termín pro {topic} zveřejňuje harmonogram akademického roku.",
+            ]
+            rng.shuffle(sentences)
+            docs.append((title, " ".join(sentences * rng.randint(1, 4)), "Web FIM", f"https://www.uhk.cz/fim/{i}", "web"))
+    return docs
+
+
+def seed_database(db_name, docs, dims, reseed=False):
+    """Založí databázi pro zátěžový test a naplní ji přes stejné funkce jako ingest (stínové tabulky + prohození)."""
+    import pymysql
+    from config import DB_HOST, DB_USER, DB_PASSWORD
+
+    conn = pymysql.connect(host=DB_HOST, user=DB_USER, password=DB_PASSWORD, autocommit=True)
+    conn.cursor().execute(f"CREATE DATABASE IF NOT EXISTS `{db_name}` CHARACTER SET utf8mb4")
+    conn.close()
+
+    # config.DB_NAME se čte při importu - databázové moduly proto importujeme až po nastavení prostředí
+    from database import init_db_schema, ensure_partitions, get_db_connection, prepare_next_table_for_update, \
+        insert_into_next_table, swap_tables_atomic
+    init_db_schema()
+    ensure_partitions()
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM embeddings")
+    existing = cursor.fetchone()[0]
+    conn.close()
+    if existing == docs and not reseed:
+        print(f"🗄️ Databáze {db_name} už obsahuje {existing} syntetických záznamů.")
+        return
+
+    print(f"🗄️ Plním databázi {db_name} ({docs} záznamů)...")
+    from ingest import build_sparse_indexes
+    prepare_next_table_for_update("all")
+    for title, chunk, source_file, source_url, partition in synthetic_documents(docs):
+        insert_into_next_table(title, chunk, fake_embedding(f"{title}\n{chunk}", dims), source_file, source_url,
+                               partition=partition)
+    build_sparse_indexes("all")
+    swap_tables_atomic("all")
+
+
+def start_app(server, port, workers, threads, env):
+    """Nastartuje aplikaci a počká, až odpovídá. Vrací Popen."""
+    if server == "gunicorn":
+        cmd = [sys.executable, "-m", "gunicorn", "-w", str(workers), "--threads", str(threads),
+               "-b", f"127.0.0.1:{port}", "application:app"]
+    else:
+        cmd = [sys.executable, "-c",
+               f"from application import app; app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Aplikace skončila při startu (kód {proc.returncode}): {' '.join(cmd)}")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return proc
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("Aplikace nenaběhla do 60 s.")
+
+
+def _rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _worker_pids(pid):
+    """Proces serveru a jeho potomci (workery gunicornu). Jen Linux (/proc)."""
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as fh:
+            pids += [int(child) for child in fh.read().split()]
+    except OSError:
+        pass
+    return pids
+
+
+class MemorySampler(threading.Thread):
+    """Během úrovně zátěže sleduje maximální RSS každého procesu serveru."""
+
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = {}
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            for pid in _worker_pids(self.pid):
+                rss = _rss_mb(pid)
+                if rss is not None:
+                    self.peak[pid] = max(self.peak.get(pid, 0), rss)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        return [round(rss, 1) for rss in self.peak.values()]
+
+
+def simulated_student(base_url, user_id, stop_at, results, lock, timeout):
+    """Jeden virtuální student: dokola vede vícekolové konverzace (historii drží server pod conversation_id)."""
+    rng = random.Random(user_id)
+    session = requests.Session()
+    while time.monotonic() < stop_at:
+        code, _ = rng.choice(SUBJECTS)
+        conversation_id = None
+        for template in rng.choice(CONVERSATIONS):
+            if time.monotonic() >= stop_at:
+                break
+            query = template.format(code=code, topic=rng.choice(TOPICS))
+            started = time.monotonic()
+            try:
+                response = session.post(f"{base_url}/api/chat", json={"query": query, "conversation_id": conversation_id},
+                                        timeout=timeout)
+                ok = response.status_code == 200
+                shed = response.status_code == 503  # Rychlé odmítnutí při přetížení (admission control)
+                if ok:
+                    conversation_id = response.json().get("conversation_id", conversation_id)
+            except (requests.RequestException, ValueError):
+                ok, shed = False, False
+            latency = time.monotonic() - started
+            with lock:
+                results.append((latency, ok, shed))
+
+
+def run_level(base_url, server_pid, concurrency, duration, timeout):
+    results = []
+    lock = threading.Lock()
+    sampler = MemorySampler(server_pid)
+    sampler.start()
+    started = time.monotonic()
+    stop_at = started + duration
+    users = [threading.Thread(target=simulated_student, args=(base_url, i, stop_at, results, lock, timeout), daemon=True)
+             for i in range(concurrency)]
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    elapsed = time.monotonic() - started
+    worker_rss = sampler.stop()
+
+    latencies = np.array([latency for latency, _, _ in results]) * 1000
+    errors = sum(1 for _, ok, _ in results if not ok)
+    shed = sum(1 for _, _, was_shed in results if was_shed)
+    level = {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed else 0.0,
+        "error_rate": round(errors / len(results), 4) if results else 1.0,
+        "shed_rate": round(shed / len(results), 4) if results else 0.0,
+        "worker_rss_mb": worker_rss,
+    }
+    for p in (50, 90, 95, 99):
+        level[f"p{p}_ms"] = round(float(np.percentile(latencies, p)), 1) if len(latencies) else None
+    return level
+
+
+def config_key(report):
+    return {k: report[k] for k in ("server", "workers", "threads", "latency_ms", "jitter_ms", "docs")}
+
+
+def load_baseline(history_file, key):
+    """Poslední záznam historie se stejnou konfigurací serveru a fake API."""
+    if not os.path.exists(history_file):
+        return None
+    baseline = None
+    with open(history_file, encoding="utf-8") as fh:
+        for line in fh:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            # Běh s regresemi se baseline nestává, jinak by se zhoršení postupně "vyrovnalo"
+            if config_key(record) == key and not record.get("regressions"):
+                baseline = record
+    return baseline
+
+
+def compare_with_baseline(report, baseline, tolerance):
+    """Vrátí seznam regresí oproti baseline (prázdný = v pořádku)."""
+    regressions = []
+    previous = {level["concurrency"]: level for level in baseline["levels"]}
+    for level in report["levels"]:
+        old = previous.get(level["concurrency"])
+        if not old:
+            continue
+        c = level["concurrency"]
+        if level["throughput_rps"] < old["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"c={c}: propustnost {level['throughput_rps']} < {old['throughput_rps']} req/s")
+        if old["p95_ms"] and level["p95_ms"] and level["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            regressions.append(f"c={c}: p95 {level['p95_ms']} > {old['p95_ms']} ms")
+        if level["error_rate"] > old["error_rate"] + 0.01:
+            regressions.append(f"c={c}: chybovost {level['error_rate']:.1%} > {old['error_rate']:.1%}")
+        if level["worker_rss_mb"] and old["worker_rss_mb"] and \
+                max(level["worker_rss_mb"]) > max(old["worker_rss_mb"]) * (1 + tolerance):
+            regressions.append(f"c={c}: RSS workeru {max(level['worker_rss_mb'])} > {max(old['worker_rss_mb'])} MB")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Zátěžový test /api/chat s lokálním fake OpenAI")
+    parser.add_argument("--server", default="flask", choices=["flask", "gunicorn"])
+    parser.add_argument("--workers", type=int, default=1, help="Počet procesů (jen gunicorn)")
+    parser.add_argument("--threads", type=int, default=8, help="Vláken na proces (jen gunicorn)")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32", help="Úrovně souběžnosti oddělené čárkou")
+    parser.add_argument("--duration", type=float, default=20, help="Délka jedné úrovně v sekundách")
+    parser.add_argument("--timeout", type=float, default=60, help="Timeout jednoho požadavku")
+    parser.add_argument("--latency-ms", type=float, default=300, help="Umělá latence fake OpenAI")
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--dims", type=int, default=1536, help="Dimenze fake embeddingů")
+    parser.add_argument("--docs", type=int, default=3000, help="Počet syntetických záznamů v DB")
+    parser.add_argument("--db-name", default="sofim_loadtest")
+    parser.add_argument("--reseed", action="store_true", help="Znovu naplní testovací databázi")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Povolené zhoršení oproti baseline")
+    parser.add_argument("--history", default=DEFAULT_HISTORY_FILE, help="JSONL soubor s baseline (prázdné = nezapisovat)")
+    args = parser.parse_args(argv)
+
+    fake = start_fake_openai(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, dims=args.dims)
+    env = dict(os.environ, SOFIM_ROLE="chat", DB_NAME=args.db_name, OPENAI_API_KEY="loadtest",
+               OPENAI_BASE_URL=f"http://127.0.0.1:{fake.server_port}/v1")
+    os.environ.update({k: env[k] for k in ("DB_NAME", "OPENAI_API_KEY", "OPENAI_BASE_URL")})
+    seed_database(args.db_name, args.docs, args.dims, args.reseed)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "server": args.server,
+        "workers": args.workers if args.server == "gunicorn" else 1,
+        "threads": args.threads if args.server == "gunicorn" else None,
+        "latency_ms": args.latency_ms,
+        "jitter_ms": args.jitter_ms,
+        "docs": args.docs,
+        "duration_s": args.duration,
+        "levels": [],
+    }
+
+    proc = start_app(args.server, args.port, args.workers, args.threads, env)
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        # Zahřátí - první dotaz načte index do paměti
+        requests.post(f"{base_url}/api/chat", json={"query": "Zahřátí", "history": []}, timeout=120)
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            level = run_level(base_url, proc.pid, concurrency, args.duration, args.timeout)
+            report["levels"].append(level)
+            print(f"👥 {concurrency:>4} souběžně: {level['throughput_rps']:>7} req/s, p50 {level['p50_ms']} ms, "
+                  f"p95 {level['p95_ms']} ms, p99 {level['p99_ms']} ms, chyby {level['error_rate']:.1%} "
+                  f"(z toho odmítnuto {level['shed_rate']:.1%}), "
+                  f"RSS workerů {level['worker_rss_mb']} MB")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        fake.shutdown()
+
+    baseline = load_baseline(args.history, config_key(report)) if args.history else None
+    regressions = compare_with_baseline(report, baseline, args.tolerance) if baseline else []
+    report["regressions"] = regressions
+
+    if args.history:
+        os.makedirs(os.path.dirname(args.history) or ".", exist_ok=True)
+        with open(args.history, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(report, ensure_ascii=False) + "\n")
+
+    if baseline is None:
+        print("📌 Pro tuto konfiguraci zatím není baseline - tento běh se jí stává.")
+    if regressions:
+        for regression in regressions:
+            print(f"❌ Regrese oproti {baseline['timestamp']}: {regression}")
+        return 1
+    print("✅ Bez regresí.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
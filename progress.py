@@ -0,0 +1,81 @@
+import time
+
+from config import PROGRESS_FLUSH_SECONDS
+from database import set_sync_status, flush_sync_progress
+
+
+class SyncProgress:
+    """
+    Průběh indexace jednoho typu (WEB / CSV) držený v paměti.
+    Počítadla, rychlost, odhad zbývajícího času a chyby se do sync_status zapisují
+    nejvýše jednou za PROGRESS_FLUSH_SECONDS, ne po každé URL nebo řádku CSV.
+    """
+
+    def __init__(self, sync_type, flush_interval=PROGRESS_FLUSH_SECONDS):
+        self.sync_type = sync_type
+        self.flush_interval = flush_interval
+        self.total = 0
+        self.processed = 0
+        self.worked = 0  # Položky skutečně zpracované v tomto běhu (bez přeskočených při navázání)
+        self.started_at = time.monotonic()
+        self._pending_errors = []
+        self._dirty = False
+        self._last_flush = 0.0
+
+    def start(self, total=0):
+        """Nastaví stav 'running' a vynuluje progress i chyby."""
+        self.total = total
+        self.processed = 0
+        self.worked = 0
+        self.started_at = time.monotonic()
+        self._pending_errors = []
+        self._dirty = False
+        self._last_flush = time.monotonic()
+        set_sync_status(self.sync_type, "running", total=total)
+
+    def set_total(self, total):
+        self.total = total
+        self._touch()
+
+    def update(self, processed, skipped=False):
+        """Zaznamená, že je zpracováno `processed` položek. Přeskočené položky se nepočítají do rychlosti."""
+        if not skipped:
+            self.worked += max(0, processed - self.processed)
+        self.processed = processed
+        self._touch()
+
+    def error(self, message):
+        self._pending_errors.append(message)
+        self._touch()
+
+    def rate_per_minute(self):
+        elapsed = time.monotonic() - self.started_at
+        if elapsed <= 0 or self.worked == 0:
+            return 0.0
+        return self.worked / elapsed * 60
+
+    def eta_seconds(self):
+        rate = self.rate_per_minute()
+        if rate <= 0 or self.total <= self.processed:
+            return None
+        return int((self.total - self.processed) / rate * 60)
+
+    def _touch(self):
+        self._dirty = True
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if not self._dirty:
+            return
+        errors = "".join(f"{msg}\n" for msg in self._pending_errors)
+        flush_sync_progress(self.sync_type, self.total, self.processed, round(self.rate_per_minute(), 1),
+                            self.eta_seconds(), errors)
+        self._pending_errors = []
+        self._dirty = False
+        self._last_flush = time.monotonic()
+
+    def finish(self, status):
+        """Zapíše poslední stav a ukončí běh ('success', 'error', 'cancelled', 'lease_lost')."""
+        self.flush()
+        set_sync_status(self.sync_type, status)
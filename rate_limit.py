@@ -0,0 +1,239 @@
+import os
+import re
+import time
+import socket
+import threading
+import requests
+
+from config import OPENAI_RATE_LIMITS, OPENAI_CHAT_RESERVE, OPENAI_CHAT_ACTIVE_RESERVE, OPENAI_CHAT_MAX_WAIT, \
+    OPENAI_USAGE_SYNC_SECONDS
+from database import sync_openai_usage
+from context_builder import count_tokens, count_message_tokens
+
+# Společný plánovač volání OpenAI. Chat i indexace čerpají z jednoho účtu, takže každý model má
+# token bucket na požadavky a na tokeny za minutu. Chat (priorita 'chat') má přednost:
+#   - v rámci procesu indexace čeká, dokud na bucket čeká nějaký chat,
+#   - indexace si nikdy nevezme posledních OPENAI_CHAT_RESERVE kapacity (při čerstvé aktivitě chatu
+#     v jiném procesu OPENAI_CHAT_ACTIVE_RESERVE),
+#   - mezi procesy (web workery, worker.py) se spotřeba sdílí přes tabulku openai_usage.
+# Hlavičky x-ratelimit-* z odpovědí OpenAI buckety průběžně srovnávají se skutečným stavem účtu
+# a 429 model na chvíli pozastaví pro všechny.
+
+DEFAULT_COMPLETION_TOKENS = 1000  # Odhad délky odpovědi, když požadavek nemá max_tokens
+CHAT_QUIET_SECONDS = 10  # Jak dlouho po posledním chatu v jiném procesu drží indexace větší rezervu
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+
+
+def parse_reset(value):
+    """'1s', '6m0s', '250ms' nebo prosté sekundy -> sekundy."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    parts = _DURATION_RE.findall(value)
+    return sum(float(number) * units[unit] for number, unit in parts) if parts else None
+
+
+class TokenBucket:
+    """Bucket s kapacitou `per_minute`, který se plynule doplňuje."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.capacity / 60.0)
+        self._updated = now
+
+    def available(self):
+        self._refill()
+        return self.level
+
+    def take(self, amount):
+        self._refill()
+        self.level -= amount
+
+    def seconds_until(self, amount):
+        """Za jak dlouho bude v bucketu `amount` (0 = hned). Víc než kapacitu nikdy nečekáme."""
+        missing = min(amount, self.capacity) - self.available()
+        return max(0.0, missing * 60.0 / self.capacity) if self.capacity else 60.0
+
+
+class ModelBudget:
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.paused_until = 0.0
+        self.chat_waiting = 0
+
+
+class OpenAIScheduler:
+    """Procesní singleton (viz `scheduler`). Vlákna Flasku i indexace volají `acquire` před každým požadavkem."""
+
+    def __init__(self, limits=OPENAI_RATE_LIMITS):
+        self._cond = threading.Condition()
+        self._budgets = {model: ModelBudget(rpm, tpm) for model, (rpm, tpm) in limits.items()}
+        self._pending_usage = {}  # (model, priorita) -> [požadavky, tokeny] od poslední synchronizace
+        self._seen_shared = {}  # (model, minuta, priorita) -> (požadavky, tokeny) ostatních procesů
+        self._chat_active_until = 0.0
+        self._last_sync = 0.0
+        self._syncing = False
+
+    def _budget(self, model):
+        if model not in self._budgets:
+            # Neznámý model - vezmeme limity nejpodobnějšího (prefix), jinak gpt-4o
+            base = next((m for m in self._budgets if model.startswith(m)), "gpt-4o")
+            rpm, tpm = OPENAI_RATE_LIMITS.get(base, OPENAI_RATE_LIMITS["gpt-4o"])
+            self._budgets[model] = ModelBudget(rpm, tpm)
+        return self._budgets[model]
+
+    def acquire(self, model, tokens, priority="chat", max_wait=None):
+        """
+        Zablokuje, dokud pro požadavek není místo. Chat čeká nejvýše OPENAI_CHAT_MAX_WAIT sekund (nebo `max_wait`,
+        pokud je kratší) a pak se pošle i tak - raději riskovat 429 než nechat studenta čekat.
+        Indexace čeká, jak dlouho je třeba.
+        """
+        self._maybe_sync()
+        wait_limit = OPENAI_CHAT_MAX_WAIT if max_wait is None else min(max_wait, OPENAI_CHAT_MAX_WAIT)
+        deadline = time.monotonic() + wait_limit
+        with self._cond:
+            budget = self._budget(model)
+            if priority == "chat":
+                budget.chat_waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    if priority == "chat":
+                        reserve = 0.0
+                    else:
+                        reserve = OPENAI_CHAT_ACTIVE_RESERVE if now < self._chat_active_until else OPENAI_CHAT_RESERVE
+
+                    wait = budget.paused_until - now
+                    if priority != "chat" and budget.chat_waiting:
+                        wait = max(wait, 0.5)
+                    wait = max(wait,
+                               budget.requests.seconds_until(1 + reserve * budget.requests.capacity),
+                               budget.tokens.seconds_until(tokens + reserve * budget.tokens.capacity))
+
+                    if wait <= 0 or (priority == "chat" and now >= deadline):
+                        budget.requests.take(1)
+                        budget.tokens.take(tokens)
+                        usage = self._pending_usage.setdefault((model, priority), [0, 0])
+                        usage[0] += 1
+                        usage[1] += tokens
+                        return
+                    if priority == "chat":
+                        wait = min(wait, deadline - now)
+                    self._cond.wait(timeout=min(wait, 5.0))
+            finally:
+                if priority == "chat":
+                    budget.chat_waiting -= 1
+                    self._cond.notify_all()
+
+    def observe(self, model, response):
+        """Srovná buckety podle hlaviček x-ratelimit-* a při 429 model pozastaví."""
+        headers = response.headers
+        with self._cond:
+            budget = self._budget(model)
+            for bucket, kind in ((budget.requests, "requests"), (budget.tokens, "tokens")):
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                if limit and limit.isdigit():
+                    bucket.capacity = float(limit)
+                if remaining and remaining.isdigit():
+                    bucket.available()
+                    bucket.level = min(bucket.level, float(remaining))
+
+            if response.status_code == 429:
+                pause = parse_reset(headers.get("retry-after")) \
+                        or parse_reset(headers.get("x-ratelimit-reset-requests")) or 5.0
+                budget.paused_until = max(budget.paused_until, time.monotonic() + pause)
+                print(f"⏳ OpenAI 429 pro {model}, pauza {pause:.1f} s")
+            self._cond.notify_all()
+
+    def _maybe_sync(self):
+        """Nejvýše jednou za OPENAI_USAGE_SYNC_SECONDS zapíše vlastní spotřebu a odečte spotřebu ostatních procesů."""
+        with self._cond:
+            now = time.monotonic()
+            if self._syncing or now - self._last_sync < OPENAI_USAGE_SYNC_SECONDS:
+                return
+            self._syncing = True
+            self._last_sync = now
+            pending = self._pending_usage
+            self._pending_usage = {}
+
+        try:
+            # PID až tady - forknuté web workery (gunicorn --preload) musí mít každý své ID
+            owner = f"{socket.gethostname()}:{os.getpid()}"
+            shared = sync_openai_usage(owner, [(m, p, r, t) for (m, p), (r, t) in pending.items()])
+        except Exception as e:
+            print(f"⚠️ Sdílení spotřeby OpenAI selhalo, plánuji jen lokálně: {e}")
+            shared = None
+
+        with self._cond:
+            self._syncing = False
+            if shared is None:
+                # Nezapsaná spotřeba se pošle příště
+                for key, (r, t) in pending.items():
+                    usage = self._pending_usage.setdefault(key, [0, 0])
+                    usage[0] += r
+                    usage[1] += t
+                return
+
+            seen = {}
+            for model, minute, priority, total_requests, total_tokens in shared:
+                key = (model, minute, priority)
+                seen_requests, seen_tokens = self._seen_shared.get(key, (0, 0))
+                new_requests, new_tokens = total_requests - seen_requests, total_tokens - seen_tokens
+                if new_requests > 0 or new_tokens > 0:
+                    budget = self._budget(model)
+                    budget.requests.take(max(0, new_requests))
+                    budget.tokens.take(max(0, new_tokens))
+                    if priority == "chat" and new_requests > 0:
+                        self._chat_active_until = time.monotonic() + CHAT_QUIET_SECONDS
+                seen[key] = (total_requests, total_tokens)
+            self._seen_shared = seen
+
+
+scheduler = OpenAIScheduler()
+
+
+def estimate_request_tokens(data):
+    """Odhad tokenů, které si požadavek ukousne z minutového limitu (vstup + očekávaný výstup)."""
+    if "messages" in data:
+        return count_message_tokens(data["messages"]) + data.get("max_tokens", DEFAULT_COMPLETION_TOKENS)
+    inputs = data.get("input", "")
+    if isinstance(inputs, list):
+        return sum(count_tokens(text) for text in inputs)
+    return count_tokens(inputs)
+
+
+def post_openai(url, headers, data, priority="chat", timeout=None, max_retries=None, deadline=None):
+    """
+    requests.post přes plánovač: počká na místo v limitech modelu, odpověď předá plánovači
+    a při 429 to zkusí znovu (chat jednou, indexace víckrát). Vrací poslední odpověď.
+    S `deadline` (deadlines.Deadline) se čekání i timeout požadavku vejdou do zbývajícího rozpočtu,
+    a když nic nezbývá, vyhodí DeadlineExceeded.
+    """
+    model = data["model"]
+    tokens = estimate_request_tokens(data)
+    if max_retries is None:
+        max_retries = 1 if priority == "chat" else 5
+    for attempt in range(max_retries + 1):
+        if deadline is None:
+            scheduler.acquire(model, tokens, priority)
+            attempt_timeout = timeout
+        else:
+            scheduler.acquire(model, tokens, priority, max_wait=deadline.timeout())
+            attempt_timeout = deadline.timeout(timeout)
+        response = requests.post(url, headers=headers, json=data, timeout=attempt_timeout)
+        scheduler.observe(model, response)
+        if response.status_code != 429:
+            break
+    return response
@@ -0,0 +1,104 @@
+import sys
+import time
+import argparse
+import numpy as np
+
+from config import EMBEDDING_SCAN_DIMS, EMBEDDING_RESCORE_CANDIDATES, CONTEXT_CANDIDATES
+
+# Zkrácené embeddingy pro rezidentní sken. text-embedding-3-* jsou trénované tak (Matryoshka), že prvních
+# N složek vektoru po normalizaci odpovídá tomu, co API vrátí s parametrem `dimensions=N`. Zkrácenou
+# verzi proto počítáme lokálně z uloženého plného vektoru - dotazy i chunky stejnou funkcí, bez
+# přeindexování - a plné vektory zůstávají na přesné přeskórování užšího výběru.
+#
+#   python reduced_embeddings.py                          # recall nad skutečnými daty z DB
+#   python reduced_embeddings.py --synthetic 20000        # nad syntetickými dokumenty (fake_openai)
+
+
+def reduce_embedding(vectors, dims=EMBEDDING_SCAN_DIMS):
+    """Prvních `dims` složek (vektoru nebo řádků matice) znovu normalizovaných na jednotkovou délku."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if not dims or dims >= vectors.shape[-1]:
+        return vectors
+    reduced = vectors[..., :dims]
+    norms = np.linalg.norm(reduced, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return reduced / norms
+
+
+def _normalized(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def recall_report(matrix, dims_list, rescore_list, k=CONTEXT_CANDIDATES, queries=200, seed=7):
+    """
+    Recall@k zkráceného skenu (s přeskórováním plnými vektory a bez něj) proti přesnému skenu v plné dimenzi.
+    Dotazy jsou náhodně vybrané uložené chunky; samotný chunk se z výsledků vynechává.
+    """
+    rng = np.random.default_rng(seed)
+    full = _normalized(np.asarray(matrix, dtype=np.float32))
+    sample = rng.choice(len(full), min(queries, len(full)), replace=False)
+
+    def top(scores, limit, exclude):
+        scores = scores.copy()
+        scores[exclude] = -np.inf
+        return np.argsort(-scores, kind="stable")[:limit]
+
+    exact = {q: set(top(full @ full[q], k, q)) for q in sample}
+    rows = []
+    for dims in dims_list:
+        reduced = reduce_embedding(full, dims)
+        started = time.perf_counter()
+        approx_scores = {q: reduced @ reduced[q] for q in sample}
+        scan_ms = (time.perf_counter() - started) * 1000 / len(sample)
+
+        plain = np.mean([len(exact[q] & set(top(approx_scores[q], k, q))) / k for q in sample])
+        for rescore in rescore_list:
+            recalls = []
+            for q in sample:
+                shortlist = top(approx_scores[q], rescore, q)
+                rescored = shortlist[np.argsort(-(full[shortlist] @ full[q]), kind="stable")[:k]]
+                recalls.append(len(exact[q] & set(rescored)) / k)
+            rows.append({"dims": dims, "rescore": rescore, "recall_no_rescore": round(float(plain), 4),
+                         "recall": round(float(np.mean(recalls)), 4), "scan_ms": round(scan_ms, 2),
+                         "matrix_mb": round(reduced.nbytes / 1024 / 1024, 1)})
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recall zkrácených embeddingů proti plné dimenzi")
+    parser.add_argument("--dims", default="128,256,512,768", help="Zkrácené dimenze oddělené čárkou")
+    parser.add_argument("--rescore", default=f"50,{EMBEDDING_RESCORE_CANDIDATES},500",
+                        help="Velikosti užšího výběru pro přeskórování plnými vektory")
+    parser.add_argument("--k", type=int, default=CONTEXT_CANDIDATES)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--synthetic", type=int, metavar="DOKUMENTŮ",
+                        help="Místo dat z DB použije syntetické dokumenty s embeddingy z fake_openai")
+    args = parser.parse_args(argv)
+
+    if args.synthetic:
+        from fake_openai import fake_embedding
+        from loadtest import synthetic_documents
+        matrix = np.vstack([fake_embedding(f"{title}\n{chunk}")
+                            for title, chunk, _, _, _ in synthetic_documents(args.synthetic)])
+    else:
+        from database import load_embeddings_from_db
+        items = load_embeddings_from_db()
+        if not items:
+            print("❌ V databázi nejsou žádné embeddingy.")
+            return 1
+        matrix = np.vstack([item["vector"] for item in items])
+
+    print(f"📐 {matrix.shape[0]} vektorů × {matrix.shape[1]}, recall@{args.k} proti plné dimenzi")
+    rows = recall_report(matrix, [int(d) for d in args.dims.split(",")], [int(r) for r in args.rescore.split(",")],
+                         k=args.k, queries=args.queries)
+    print(f"{'dims':>6} {'přeskór.':>9} {'recall bez':>11} {'recall':>8} {'sken ms':>8} {'matice MB':>10}")
+    for row in rows:
+        print(f"{row['dims']:>6} {row['rescore']:>9} {row['recall_no_rescore']:>11.3f} {row['recall']:>8.3f} "
+              f"{row['scan_ms']:>8.2f} {row['matrix_mb']:>10.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
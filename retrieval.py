@@ -0,0 +1,473 @@
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import requests
+
+from database import load_embeddings_from_db, get_embedding_generations, load_sparse_index, load_partition_vectors, \
+    load_partition_texts, fetch_chunks
+from lexical import BM25Index, build_postings, unpack_postings, tokenize
+from reduced_embeddings import reduce_embedding
+from context_builder import build_context, trim_history, count_message_tokens
+from rate_limit import post_openai
+from deadlines import DeadlineExceeded
+from config import OPENAI_API_KEY, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, OPENAI_EMBEDDING_URL, LLM_API_URL, \
+    HYBRID_FUSION, HYBRID_ALPHA, HYBRID_RRF_K, HYBRID_SHORTLIST_MIN_DOCS, HYBRID_SHORTLIST_SIZE, SEARCH_SHARDS, \
+    SEARCH_SHARDS_MIN_DOCS, EMBEDDING_SCAN_DIMS, EMBEDDING_RESCORE_CANDIDATES, CHAT_REWRITE_TIMEOUT, \
+    CHAT_EMBEDDING_TIMEOUT, CHAT_GENERATION_MIN_SECONDS, CHUNK_CACHE_SIZE
+
+# Vyhledávání a odpovědi nad rezidentním indexem - sdílí je chat (application.py) i dávková evaluace
+# (batch_questions.py v ingest workeru). Modul nezakládá Flask aplikaci ani schéma DB, import nemá
+# vedlejší efekty.
+
+NO_MATCH_RESPONSE = "Bohužel k tomuto dotazu nemám v databázi žádné informace."
+
+# --- Rezidentní index (po oddílech) ---
+# Každý oddíl (web, csv) se drží v paměti a znovu se načte jen tehdy, když ingest prohodí právě jeho tabulku.
+# V paměti jsou jen ID, vektory, BM25 a slova z názvů; text a zdroje se dotahují až pro vítězné záznamy.
+
+def title_token_positions(titles):
+    """Celá slova z názvů -> pozice záznamů (odpovídá dřívějšímu regexu \\bKÓD\\b nad názvem)."""
+    title_positions = {}
+    for pos, title in enumerate(titles):
+        for word in set(re.findall(r'\w+', (title or "").lower())):
+            title_positions.setdefault(word, []).append(pos)
+    return {word: np.array(pos, dtype=np.int32) for word, pos in title_positions.items()}
+
+
+class SearchIndex:
+    """
+    Spojený index pro hybridní vyhledávání: ID záznamů, normalizovaná matice vektorů (dense),
+    BM25 (sparse) a slova z názvů pro boost kódů předmětů. Text a zdroje vítězných záznamů vrací
+    `records` - čte je z DB podle primárního klíče a naposledy použité drží v malé LRU cache.
+    """
+
+    def __init__(self, ids, vectors, title_tokens, postings_parts, records=None, checksums=None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.checksums = checksums
+        if len(self.ids):
+            matrix = np.asarray(vectors, dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            self.matrix = matrix / norms
+        else:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.full_matrix = self.matrix
+
+        # Zkrácený sken: matice pro sken v nižší dimenzi (float32) a plné vektory jen na přeskórování
+        # ve float16. Na záznam to je 2 * 1536 + 4 * dims bajtů místo 4 * 1536 (při 256 dims asi dvě třetiny).
+        self.scan_dims = EMBEDDING_SCAN_DIMS if 0 < EMBEDDING_SCAN_DIMS < self.matrix.shape[1] else 0
+        if self.scan_dims:
+            self.full_matrix = self.matrix.astype(np.float16)
+            self.matrix = reduce_embedding(self.matrix, self.scan_dims)
+
+        # Velký index se plným skenem prochází paralelně po shardech nad sdílenou pamětí
+        self.sharded = None
+        if SEARCH_SHARDS > 1 and len(self.ids) >= SEARCH_SHARDS_MIN_DOCS:
+            from sharded_search import ShardedMatrix
+            self.sharded = ShardedMatrix(self.matrix, SEARCH_SHARDS)
+            self.matrix = self.sharded.matrix
+            if not self.scan_dims:
+                self.full_matrix = self.matrix
+
+        positions_by_id = {record_id: pos for pos, record_id in enumerate(self.ids.tolist())}
+        self.bm25 = BM25Index.from_postings(postings_parts, positions_by_id)
+        self.title_tokens = title_tokens
+
+        # Cache patří k indexu: ID se mezi generacemi oddílu mohou opakovat (CSV se staví od začátku)
+        self._records = records
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    @classmethod
+    def from_items(cls, items):
+        """Index z hotových záznamů (jako z load_embeddings_from_db) - text pak zůstává v paměti."""
+        vectors = np.vstack([item["vector"] for item in items]) if items else None
+        postings = [build_postings((item["id"], item["title"], item["text"]) for item in items)]
+        return cls([item["id"] for item in items], vectors, title_token_positions([item["title"] for item in items]),
+                   postings, records={item["id"]: item for item in items})
+
+    def __len__(self):
+        return len(self.ids)
+
+    def full_vectors(self, positions):
+        """Normalizované plné vektory vybraných řádků (přeskórování po zkráceném skenu)."""
+        return self.full_matrix[positions].astype(np.float32)
+
+    def records(self, positions):
+        """
+        Záznamy (id, title, text, source, url, vector) na daných pozicích ve stejném pořadí. Záznam,
+        který mezitím z živé tabulky zmizel nebo jehož ID už patří jinému záznamu (prohození oddílu
+        uprostřed dotazu - otisk z DB nesedí s indexem), se vynechá.
+        """
+        ids = [int(self.ids[pos]) for pos in positions]
+        if self._records is not None:
+            found = self._records
+        else:
+            found = {}
+            with self._cache_lock:
+                for record_id in ids:
+                    if record_id in self._cache:
+                        self._cache.move_to_end(record_id)
+                        found[record_id] = self._cache[record_id]
+            missing = {record_id: pos for pos, record_id in zip(positions, ids) if record_id not in found}
+            if missing:
+                fetched = {}
+                for record_id, record in fetch_chunks(list(missing)).items():
+                    checksum = record.pop("checksum")
+                    if self.checksums is None or checksum == self.checksums[missing[record_id]]:
+                        fetched[record_id] = record
+                found.update(fetched)
+                with self._cache_lock:
+                    self._cache.update(fetched)
+                    while len(self._cache) > CHUNK_CACHE_SIZE:
+                        self._cache.popitem(last=False)
+
+        return [dict(found[record_id], vector=self.full_vectors(pos))
+                for pos, record_id in zip(positions, ids) if record_id in found]
+
+
+_index_lock = threading.Lock()
+_partition_cache = {}  # oddíl -> (generace, ID, otisky záznamů, slova z názvů, BM25 postings)
+_combined_cache = (None, None, {})  # (generace všech oddílů, SearchIndex, oddíl -> (generace, řádky v indexu))
+
+
+def _load_partition(partition, generation):
+    ids, titles, vectors, checksums = load_partition_vectors(partition)
+    stored = load_sparse_index(partition)
+    if stored and stored[0] == generation:
+        postings = unpack_postings(stored[1])
+    else:
+        # Oddíl z doby před lexikálním indexem - spočítáme postings tady (text se hned zase zahodí)
+        postings = build_postings(load_partition_texts(partition))
+    return generation, ids, vectors, checksums, title_token_positions(titles), postings
+
+
+def _merge_title_tokens(parts):
+    """Slova z názvů jednotlivých oddílů -> pozice ve spojeném indexu (oddíly jdou za sebou)."""
+    merged = {}
+    offset = 0
+    for title_tokens, size in parts:
+        for word, positions in title_tokens.items():
+            merged.setdefault(word, []).append(positions + offset)
+        offset += size
+    return {word: np.concatenate(positions) for word, positions in merged.items()}
+
+
+def get_search_index():
+    """
+    Spojený index všech oddílů. Vektory se v paměti drží jen jednou - ve spojeném indexu; při přestavbě
+    se nezměněné oddíly vezmou z jeho plných vektorů a z DB se načte jen prohozený oddíl.
+    """
+    global _combined_cache
+    generations = get_embedding_generations()
+    if not generations:
+        # Databáze ještě nebyla převedena na oddíly
+        return SearchIndex.from_items(load_embeddings_from_db())
+
+    with _index_lock:
+        key = tuple(sorted(generations.items()))
+        if _combined_cache[0] == key:
+            return _combined_cache[1]
+
+        previous, previous_rows = _combined_cache[1], _combined_cache[2]
+        vectors, rows, offset = [], {}, 0
+        for partition in sorted(generations):
+            generation = generations[partition]
+            cached = _partition_cache.get(partition)
+            kept = previous_rows.get(partition)
+            if cached is not None and cached[0] == generation and kept is not None and kept[0] == generation:
+                part_vectors = previous.full_matrix[kept[1]:kept[2]]
+            else:
+                print(f"🔃 Načítám oddíl '{partition}' (generace {generation})...")
+                generation, ids, part_vectors, checksums, title_tokens, postings = _load_partition(partition,
+                                                                                                  generation)
+                cached = _partition_cache[partition] = (generation, ids, checksums, title_tokens, postings)
+            if len(cached[1]):
+                vectors.append(part_vectors)
+            rows[partition] = (generation, offset, offset + len(cached[1]))
+            offset += len(cached[1])
+
+        parts = [_partition_cache[p] for p in sorted(generations)]
+        ids = np.concatenate([part[1] for part in parts])
+        title_tokens = _merge_title_tokens([(part[3], len(part[1])) for part in parts])
+        index = SearchIndex(ids, np.vstack(vectors) if vectors else None, title_tokens, [part[4] for part in parts],
+                            checksums=np.concatenate([part[2] for part in parts]))
+        _combined_cache = (key, index, rows)
+        return index
+
+
+def drop_search_index():
+    """Uvolní rezidentní index z paměti (další get_search_index ho načte znovu)."""
+    global _combined_cache
+    with _index_lock:
+        _partition_cache.clear()
+        _combined_cache = (None, None, {})
+
+
+# --- Pomocné funkce ---
+
+def get_query_embedding(query, deadline=None):
+    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
+    # Stejný model i dimenze jako ingest.get_embedding, jinak by dotaz a uložené vektory nebyly srovnatelné
+    data = {"input": query, "model": EMBEDDING_MODEL, "dimensions": EMBEDDING_DIMENSIONS}
+    timeout = deadline.timeout(CHAT_EMBEDDING_TIMEOUT, reserve=CHAT_GENERATION_MIN_SECONDS) if deadline else None
+    response = post_openai(OPENAI_EMBEDDING_URL, headers, data, timeout=timeout, deadline=deadline)
+    if response.status_code == 200:
+        return np.array(response.json()["data"][0]["embedding"])
+    return None
+
+
+def cosine_similarity(v1, v2):
+    norm_v1 = np.linalg.norm(v1)
+    norm_v2 = np.linalg.norm(v2)
+    if norm_v1 == 0 or norm_v2 == 0:
+        return 0
+    return np.dot(v1, v2) / (norm_v1 * norm_v2)
+
+
+def is_subject_code(word):
+    """
+    Rozpozná, zda slovo vypadá jako kód předmětu (např. ALG1, OA1, KP/ALG).
+    Vyloučí běžná slova jako 'kontakt', 'katedra', 'na'.
+    """
+    if not (2 <= len(word) <= 8):
+        return False
+
+    stopwords = {'pro', 'kde', 'kdy', 'jak', 'co', 'na', 'do', 'se', 'ze', 'ke', 've',
+                 'test', 'info', 'data', 'stag', 'fim', 'uhk', 'pan', 'pani',
+                 'doc', 'prof', 'ing', 'mgr', 'bc', 'phd', 'kontakt', 'vedouci'}
+
+    if word.lower() in stopwords:
+        return False
+
+    if any(char.isdigit() for char in word):
+        return True
+
+    if word.isalpha() and len(word) <= 5:
+        return True
+
+    return False
+
+
+def find_top_k_matches(query_embedding, embeddings, query_text, k=8, fusion=HYBRID_FUSION, dense_scores=None):
+    """
+    Najde K nejlepších shod hybridně: kosinová podobnost embeddingů + BM25 nad tokeny bez diakritiky,
+    plus CHYTRÝ boost pro kódy předmětů v názvu. `embeddings` je SearchIndex (nebo prostý seznam záznamů).
+    Fúze: 'linear' (cosine + HYBRID_ALPHA * normalizované BM25) nebo 'rrf' (Reciprocal Rank Fusion).
+    `dense_scores` jsou předem spočítaná skóre všech řádků index.matrix pro tento dotaz (dávkový sken
+    v batch_questions.py) - sken se pak už nedělá.
+    """
+    index = embeddings if isinstance(embeddings, SearchIndex) else SearchIndex.from_items(embeddings or [])
+    if not len(index):
+        return []
+
+    # Očištění dotazu na jednotlivá smysluplná slova
+    raw_tokens = [t for t in re.findall(r'\b\w+\b', query_text) if len(t) > 3]
+
+    sparse = index.bm25.scores(tokenize(query_text))
+
+    # Tvůj původní masivní boost pro kódy předmětů
+    code_boost = np.zeros(len(index), dtype=np.float32)
+    for token in raw_tokens:
+        if is_subject_code(token):
+            positions = index.title_tokens.get(token.lower())
+            if positions is not None:
+                code_boost[positions] += 0.5
+
+    # U velkého korpusu počítáme dense skóre jen pro užší výběr z BM25 (a zásahy kódů předmětů).
+    # Shardovaný index skenuje celý korpus paralelně, užší výběr by ho obcházel.
+    if index.sharded is None and len(index) > HYBRID_SHORTLIST_MIN_DOCS and sparse.any():
+        candidates = np.union1d(index.bm25.candidates(tokenize(query_text), HYBRID_SHORTLIST_SIZE),
+                                np.flatnonzero(code_boost))
+    else:
+        candidates = np.arange(len(index))
+
+    full_scan = len(candidates) == len(index)
+    if query_embedding is not None and np.linalg.norm(query_embedding) > 0:
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        query_vector = query_vector / np.linalg.norm(query_vector)
+        scan_vector = reduce_embedding(query_vector, index.scan_dims)
+        if dense_scores is None and index.sharded is not None and full_scan and fusion != "rrf" \
+                and not index.scan_dims:
+            # Lineární fúze se dá spočítat po shardech - každý vrátí lokální top-k, tady se jen slijí
+            sparse_norm = sparse / sparse.max() if sparse.max() > 0 else sparse
+            terms = []
+            for term in (HYBRID_ALPHA * sparse_norm, code_boost):
+                hits = np.flatnonzero(term)
+                terms.append((hits, term[hits]))
+            positions, _ = index.sharded.top_k(query_vector, k, terms, threshold=0.15)
+            return index.records(positions)
+        if dense_scores is not None:
+            dense = dense_scores[candidates]
+        elif index.sharded is not None and full_scan:
+            dense = index.sharded.scores(scan_vector)
+        else:
+            dense = index.matrix[candidates] @ scan_vector
+
+        if index.scan_dims:
+            # Zkrácený sken jen vybírá: nejlepší podle něj + nejlepší podle BM25 + zásahy kódů předmětů
+            # se přeskórují plnými vektory a fúze dál počítá už jen s nimi
+            lexical = sparse[candidates]
+            keep = np.argsort(-dense, kind="stable")[:EMBEDDING_RESCORE_CANDIDATES]
+            top_lexical = np.argsort(-lexical, kind="stable")[:EMBEDDING_RESCORE_CANDIDATES]
+            keep = np.union1d(keep, top_lexical[lexical[top_lexical] > 0])
+            keep = np.union1d(keep, np.flatnonzero(code_boost[candidates]))
+            candidates = candidates[keep]
+            dense = index.full_vectors(candidates) @ query_vector
+    else:
+        # Bez embeddingu dotazu aspoň lexikální vyhledávání
+        dense = np.zeros(len(candidates), dtype=np.float32)
+
+    sparse, code_boost = sparse[candidates], code_boost[candidates]
+
+    if fusion == "rrf":
+        dense_rank = np.empty(len(candidates))
+        dense_rank[np.argsort(-dense)] = np.arange(1, len(candidates) + 1)
+        sparse_rank = np.empty(len(candidates))
+        sparse_rank[np.argsort(-sparse)] = np.arange(1, len(candidates) + 1)
+        final = 1.0 / (HYBRID_RRF_K + dense_rank) + np.where(sparse > 0, 1.0 / (HYBRID_RRF_K + sparse_rank), 0.0)
+        final = final + code_boost
+        # RRF nemá absolutní škálu - práh 0.15 proto hlídáme na samotné kosinové podobnosti
+        eligible = (dense > 0.15) | (code_boost > 0)
+    else:
+        sparse_norm = sparse / sparse.max() if sparse.max() > 0 else sparse
+        final = dense + HYBRID_ALPHA * sparse_norm + code_boost
+        # Snížila jsem hranici na 0.15, protože při k=8 chceme pustit i širší kontext
+        eligible = final > 0.15
+
+    order = np.argsort(-final, kind="stable")[:k]
+    return index.records([candidates[i] for i in order if eligible[i]])
+
+
+def rewrite_query_for_search(user_query, history, deadline=None, priority="chat"):
+    """LLM přepis dotazu s využitím historie chatu. Při chybě nebo vypršení času vrací původní dotaz."""
+    # Vytáhneme max 3 poslední konverzace, ať to nežere moc tokenů (u serverových konverzací je to
+    # shrnutí + poslední tah)
+    history_text = ""
+    labels = {"user": "Student", "assistant": "Sofim", "system": "Shrnutí"}
+    for msg in history[-6:]:
+        history_text += f"{labels.get(msg['role'], 'Sofim')}: {msg['content']}\n"
+
+    system_prompt = """
+    Jsi expertní AI pro optimalizaci vyhledávacích dotazů v univerzitní databázi (RAG).
+    Máš k dispozici nedávnou historii konverzace. Tvým úkolem je přepsat poslední dotaz studenta tak, aby fungoval jako samostatný vyhledávací dotaz bez kontextu.
+
+    Příklad:
+    Historie: 
+    Student: Kdo je proděkan pro studium?
+    Sofim: Je to doc. Ing. Petra Poulová, Ph.D.
+    Dotaz k přepsání: Kde ji najdu?
+    TVŮJ VÝSTUP: Kde najdu doc. Ing. Petru Poulovou, Ph.D. kancelář kontakt?
+
+    Pravidla:
+    - Vrať POUZE optimalizovaný vyhledávací text, nic jiného.
+    - ZACHOVEJ ZKRATKY (např. OA1, ZPRO)!
+    """
+
+    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
+    prompt = f"Historie:\n{history_text}\n\nDotaz k přepsání: {user_query}" if history else f"Dotaz k přepsání: {user_query}"
+
+    data = {
+        "model": "gpt-4o-mini",  # Tady stačí levnější mini model
+        "messages": [{"role": "system", "content": system_prompt}, {"role": "user", "content": prompt}],
+        "temperature": 0
+    }
+
+    try:
+        timeout = deadline.timeout(CHAT_REWRITE_TIMEOUT, reserve=CHAT_GENERATION_MIN_SECONDS) if deadline else None
+        response = post_openai(LLM_API_URL, headers, data, priority=priority, timeout=timeout, deadline=deadline)
+        if response.status_code == 200:
+            return response.json()["choices"][0]["message"]["content"].strip()
+    except Exception:
+        pass
+    return user_query
+
+
+def get_response_from_llm(context_list, query, history, search_query=None, deadline=None, priority="chat"):
+    """
+    Odpověď gpt-4o nad kandidáty z vyhledávání. Kontext se skládá v tokenovém rozpočtu (context_builder):
+    rozmanité zdroje přes MMR, z každého jen nejrelevantnější pasáž. Vrací i použité položky
+    (indexy v 'used_indices' se vztahují k nim) a velikost promptu. Když odpověď nestihne `deadline`,
+    vrací 'timed_out': True.
+    """
+    items, context_text, context_tokens = build_context(context_list, f"{query} {search_query or ''}")
+    history = trim_history(history)
+
+    system_prompt = """
+    Jsi nápomocný AI asistent 'Sofim' pro Studijní oddělení FIM UHK. 
+    Odpovídej na otázky studentů POUZE na základě poskytnutého kontextu z databáze a historie konverzace.
+
+    MUSÍŠ odpovědět ve validním JSON formátu s následující strukturou:
+    {
+      "odpoved": "Tvoje odpověď formátovaná v Markdownu...",
+      "pouzite_zdroje": [0, 2] // Indexy zdrojů z aktuálního kontextu.
+    }
+    """
+
+    messages = [{"role": "system", "content": system_prompt}]
+
+    # Vložíme historii jako reálné zprávy pro LLM
+    for msg in history:
+        messages.append({"role": msg["role"], "content": msg["content"]})
+
+    messages.append(
+        {"role": "user", "content": f"Kontext z databáze:\n{context_text}\n\nAktuální dotaz studenta: {query}"})
+
+    prompt_tokens = count_message_tokens(messages)
+    print(f"📏 Prompt: ~{prompt_tokens} tokenů (kontext {context_tokens}, {len(items)}/{len(context_list)} zdrojů, "
+          f"historie {len(history)} zpráv)")
+    result = {"items": items, "prompt_tokens": prompt_tokens}
+
+    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
+    data = {
+        "model": "gpt-4o",
+        "messages": messages,
+        "temperature": 0.3,
+        "response_format": {"type": "json_object"}
+    }
+
+    try:
+        response = post_openai(LLM_API_URL, headers, data, priority=priority,
+                               timeout=deadline.timeout() if deadline else None, deadline=deadline)
+        if response.status_code == 200:
+            import json
+            content = response.json()["choices"][0]["message"]["content"]
+            try:
+                parsed = json.loads(content)
+                return dict(result,
+                            text=parsed.get("odpoved", "Omlouvám se, ale nepodařilo se mi vygenerovat smysluplnou odpověď."),
+                            used_indices=parsed.get("pouzite_zdroje", []))
+            except json.JSONDecodeError:
+                return dict(result, text=content, used_indices=[])
+    except (DeadlineExceeded, requests.Timeout):
+        return dict(result, text=None, used_indices=[], timed_out=True)
+    except Exception as e:
+        return dict(result, text=f"Chyba API: {str(e)}", used_indices=[])
+
+    return dict(result, text=f"Chyba API (Status {response.status_code})", used_indices=[])
+
+
+def cited_sources(llm_result):
+    """
+    Zdroje, na které se odpověď odkazuje (pouzite_zdroje), bez duplicit podle názvu. 'alt_urls' jsou
+    další stránky, na kterých se tentýž text vyskytl (při ingestu se uložil jen jednou).
+    """
+    sources = []
+    seen = set()
+    context_items = llm_result["items"]
+    for idx in llm_result["used_indices"]:
+        if isinstance(idx, int) and 0 <= idx < len(context_items):
+            match = context_items[idx]
+            src_name = match.get('title') or match.get('source', 'Zdroj')
+            src_url = match.get('url', '')
+
+            if src_name not in seen:
+                sources.append({
+                    "name": src_name,
+                    "url": src_url,
+                    "alt_urls": [url for url in match.get('alt_urls', []) if url != src_url]
+                })
+                seen.add(src_name)
+    return sources
@@ -0,0 +1,238 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import multiprocessing
+from datetime import datetime
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from config import SEARCH_SHARDS
+
+# Paralelní dense sken přes více jader. Normalizovaná matice embeddingů leží ve sdílené paměti
+# (multiprocessing.shared_memory), pool procesů ji má namapovanou a každý proces skóruje svůj úsek
+# řádků (shard). Pro lineární fúzi shard rovnou vrací lokální top-k a v hlavním procesu se jen slijí;
+# pro RRF (potřebuje globální pořadí) vrací celé skóre svého úseku.
+# Výsledky jsou stejné jako u jednoprocesového skenu ve find_top_k_matches - stejný skalární součin
+# po řádcích, stejné sčítání fúze a stejné řazení včetně shod (stabilně podle pozice).
+#
+#   python sharded_search.py --docs 20000,100000 --shards 1,2,4,8   # benchmark škálování
+
+DEFAULT_HISTORY_FILE = os.path.join("profiles", "sharded_search.jsonl")
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+# Stav v procesu workeru: namapované matice podle jména segmentu (drží se poslední dvě generace indexu)
+_attached = {}
+_ATTACHED_LIMIT = 2
+
+
+def get_pool(workers=SEARCH_SHARDS):
+    """Jeden pool na proces aplikace (aplikace ho zakládá při startu přes start_pool)."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        # Pool zděděný forkem (gunicorn --preload) v potomkovi nefunguje - jeho řídicí vlákno zůstalo v rodiči
+        if _pool is None or _pool_pid != os.getpid():
+            # fork: worker nepotřebuje importovat aplikaci (spawn i forkserver by znovu spustily application.py)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def start_pool(workers=SEARCH_SHARDS):
+    """
+    Založí pool a hned spustí jeho procesy. Volá se při startu aplikace, dokud v ní neběží vlákna
+    pro požadavky - fork z vícevláknového procesu není bezpečný.
+    """
+    pool = get_pool(workers)
+    pool.submit(int).result()  # s fork kontextem se při prvním úkolu spustí všechny procesy najednou
+    return pool
+
+
+def _attach(name, shape):
+    entry = _attached.get(name)
+    if entry is None:
+        while len(_attached) >= _ATTACHED_LIMIT:
+            old_shm, old_matrix = _attached.pop(next(iter(_attached)))
+            del old_matrix
+            old_shm.close()
+        shm = shared_memory.SharedMemory(name=name)
+        entry = _attached[name] = (shm, np.ndarray(shape, dtype=np.float32, buffer=shm.buf))
+    return entry[1]
+
+
+def _shard_final(name, shape, start, stop, query, terms):
+    """Skóre úseku: dense + přičtené členy fúze (řídké - pozice a hodnoty), ve stejném pořadí sčítání."""
+    final = _attach(name, shape)[start:stop] @ query
+    for positions, values in terms:
+        term = np.zeros(stop - start, dtype=values.dtype)
+        inside = (positions >= start) & (positions < stop)
+        term[positions[inside] - start] = values[inside]
+        final = final + term
+    return final
+
+
+def _shard_top_k(name, shape, start, stop, query, terms, k, threshold):
+    final = _shard_final(name, shape, start, stop, query, terms)
+    if len(final) > k:
+        # Všechny pozice se skóre aspoň k-tého nejlepšího (i shody), ať pořadí sedí s plným argsortem
+        kth = np.partition(-final, k - 1)[k - 1]
+        local = np.flatnonzero(-final <= kth)
+    else:
+        local = np.arange(len(final))
+    local = local[np.lexsort((local, -final[local]))][:k]
+    local = local[final[local] > threshold]
+    return local + start, final[local]
+
+
+def _shard_scores(name, shape, start, stop, query):
+    return _shard_final(name, shape, start, stop, query, [])
+
+
+class ShardedMatrix:
+    """
+    Normalizovaná matice vektorů ve sdílené paměti rozdělená na `shards` úseků.
+    `matrix` je pohled na sdílený segment - SearchIndex ho používá místo vlastní kopie.
+    """
+
+    def __init__(self, matrix, shards=SEARCH_SHARDS, pool=None):
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.shape = matrix.shape
+        self._shm = shared_memory.SharedMemory(create=True, size=max(matrix.nbytes, 1))
+        self._owner_pid = os.getpid()
+        self.matrix = np.ndarray(self.shape, dtype=np.float32, buffer=self._shm.buf)
+        self.matrix[:] = matrix
+        self.pool = pool or get_pool()
+        self.bounds = np.linspace(0, self.shape[0], max(1, min(shards, self.shape[0])) + 1).astype(int)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _ranges(self):
+        return zip(self.bounds[:-1], self.bounds[1:])
+
+    def top_k(self, query_vector, k, terms=(), threshold=-np.inf):
+        """
+        Top-k pozic podle dense skóre + `terms` (seznam (pozice, hodnoty) přičítaných v tomto pořadí),
+        jen se skóre nad `threshold`. Vrací (pozice, skóre) seřazené sestupně, shody podle pozice.
+        """
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        futures = [self.pool.submit(_shard_top_k, self._shm.name, self.shape, start, stop, query_vector,
+                                    list(terms), k, threshold) for start, stop in self._ranges()]
+        parts = [future.result() for future in futures]
+        positions = np.concatenate([p for p, _ in parts])
+        scores = np.concatenate([s for _, s in parts])
+        order = np.lexsort((positions, -scores))[:k]
+        return positions[order], scores[order]
+
+    def scores(self, query_vector):
+        """Dense skóre všech řádků (pro fúze, které potřebují globální pořadí)."""
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        futures = [self.pool.submit(_shard_scores, self._shm.name, self.shape, start, stop, query_vector)
+                   for start, stop in self._ranges()]
+        return np.concatenate([future.result() for future in futures])
+
+    def __del__(self):
+        # Segment ruší jen proces, který ho založil (forkované workery dědí i tento objekt)
+        if getattr(self, "_owner_pid", None) == os.getpid():
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+# --- Benchmark ---
+
+def _reference_top_k(matrix, query, terms, k, threshold):
+    """Jednoprocesový sken ve tvaru find_top_k_matches (plný argsort)."""
+    final = matrix @ query
+    for positions, values in terms:
+        term = np.zeros(len(final), dtype=values.dtype)
+        term[positions] = values
+        final = final + term
+    order = np.argsort(-final, kind="stable")[:k]
+    order = order[final[order] > threshold]
+    return order, final[order]
+
+
+def _percentile(values, q):
+    return round(float(np.percentile(values, q)) * 1000, 2)
+
+
+def run_benchmark(doc_counts, shard_counts, dims=1536, queries=30, k=16, seed=7):
+    rng = np.random.default_rng(seed)
+    results = []
+    for docs in doc_counts:
+        matrix = rng.standard_normal((docs, dims), dtype=np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        query_set = [(matrix[rng.integers(docs)] + 0.5 * rng.standard_normal(dims, dtype=np.float32))
+                     for _ in range(queries)]
+        query_set = [q / np.linalg.norm(q) for q in query_set]
+        # Řídký člen jako BM25 + boost kódu předmětu: pár stovek zásahů
+        hits = np.sort(rng.choice(docs, min(300, docs), replace=False))
+        terms = [(hits, (0.2 * rng.random(len(hits))).astype(np.float32))]
+
+        timings = []
+        for query in query_set:
+            started = time.perf_counter()
+            _reference_top_k(matrix, query, terms, k, 0.15)
+            timings.append(time.perf_counter() - started)
+        baseline = float(np.median(timings))
+        results.append({"docs": docs, "shards": 0, "p50_ms": _percentile(timings, 50),
+                        "p95_ms": _percentile(timings, 95), "speedup": 1.0, "identical": True})
+        print(f"📐 {docs} dokumentů × {dims}: jeden proces p50 {results[-1]['p50_ms']} ms")
+
+        for shards in shard_counts:
+            pool = ProcessPoolExecutor(max_workers=shards, mp_context=multiprocessing.get_context("fork"))
+            sharded = ShardedMatrix(matrix, shards, pool=pool)
+            sharded.top_k(query_set[0], k, terms, 0.15)  # zahřátí - namapování segmentu ve workerech
+
+            timings, identical = [], True
+            for query in query_set:
+                started = time.perf_counter()
+                positions, scores = sharded.top_k(query, k, terms, 0.15)
+                timings.append(time.perf_counter() - started)
+                expected_positions, expected_scores = _reference_top_k(matrix, query, terms, k, 0.15)
+                identical &= np.array_equal(positions, expected_positions) and np.array_equal(scores, expected_scores)
+            pool.shutdown()
+            del sharded
+
+            p50 = float(np.median(timings))
+            results.append({"docs": docs, "shards": shards, "p50_ms": _percentile(timings, 50),
+                            "p95_ms": _percentile(timings, 95), "speedup": round(baseline / p50, 2),
+                            "identical": bool(identical)})
+            print(f"   🧩 {shards} shardů: p50 {results[-1]['p50_ms']} ms, p95 {results[-1]['p95_ms']} ms, "
+                  f"zrychlení {results[-1]['speedup']}×{'' if identical else ' ❌ VÝSLEDKY SE LIŠÍ'}")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark paralelního dense skenu po shardech")
+    parser.add_argument("--docs", default="20000,100000", help="Velikosti korpusu oddělené čárkou")
+    parser.add_argument("--shards", default="1,2,4,8", help="Počty shardů (procesů) oddělené čárkou")
+    parser.add_argument("--dims", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--history", default=DEFAULT_HISTORY_FILE, help="Kam připsat výsledek (JSONL)")
+    args = parser.parse_args(argv)
+
+    print(f"🖥️ Dostupná jádra: {os.cpu_count()}")
+    results = run_benchmark([int(d) for d in args.docs.split(",")], [int(s) for s in args.shards.split(",")],
+                            dims=args.dims, queries=args.queries)
+
+    record = {"timestamp": datetime.now().isoformat(timespec="seconds"), "cpu_count": os.cpu_count(),
+              "dims": args.dims, "results": results}
+    if args.history:
+        os.makedirs(os.path.dirname(args.history) or ".", exist_ok=True)
+        with open(args.history, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(record) + "\n")
+    return 0 if all(r["identical"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
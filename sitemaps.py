@@ -0,0 +1,108 @@
+import sys
+import gzip
+import argparse
+import requests
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+from database import import_sitemap_entries, get_sitemaps
+
+# Hromadný import URL pro crawler ze sitemap.xml (i sitemap indexů a .xml.gz).
+# U každé URL se uloží lastmod a z changefreq interval dalšího crawlu; web sync pak prochází jen
+# stránky, které jsou na řadě nebo se podle lastmod změnily. Registrované sitemapy se obnovují
+# na začátku každého web syncu.
+#
+#   python sitemaps.py https://www.uhk.cz/sitemap.xml --prefix https://www.uhk.cz/cs/fakulta-informatiky-a-managementu
+
+HEADERS = {"User-Agent": "SofimBot/1.0 (UHK Internal)"}
+MAX_SITEMAP_DEPTH = 3  # Sitemap index může odkazovat na další indexy
+CHANGEFREQ_HOURS = {"always": 1, "hourly": 1, "daily": 24, "weekly": 168, "monthly": 720, "yearly": 8760,
+                    "never": 8760}
+# Chyby jedné sitemapy: síť, nevalidní XML, poškozený/useknutý .xml.gz (BadGzipFile je OSError)
+SITEMAP_ERRORS = (requests.RequestException, ET.ParseError, OSError, EOFError)
+
+
+def _local_name(tag):
+    # Sitemapy bývají s namespace i bez něj
+    return tag.rsplit("}", 1)[-1]
+
+
+def _child_text(element, name):
+    for child in element:
+        if _local_name(child.tag) == name:
+            return (child.text or "").strip()
+    return ""
+
+
+def parse_lastmod(value):
+    """W3C datetime ('2024-05-01', '2024-05-01T10:00:00+02:00', '...Z') -> naivní lokální čas (jako NOW() v DB)."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed.astimezone().replace(tzinfo=None) if parsed.tzinfo else parsed
+
+
+def fetch_sitemap(sitemap_url, url_prefix="", depth=0, seen=None):
+    """Projde sitemapu (i index) a vrací seznam (url, lastmod, changefreq_hours) pro URL začínající `url_prefix`."""
+    seen = set() if seen is None else seen
+    if sitemap_url in seen or depth > MAX_SITEMAP_DEPTH:
+        return []
+    seen.add(sitemap_url)
+
+    response = requests.get(sitemap_url, headers=HEADERS, timeout=30)
+    response.raise_for_status()
+    content = response.content
+    if content[:2] == b"\x1f\x8b":
+        content = gzip.decompress(content)
+    root = ET.fromstring(content)
+
+    entries = []
+    if _local_name(root.tag) == "sitemapindex":
+        for sitemap in root:
+            child_url = _child_text(sitemap, "loc")
+            if child_url:
+                try:
+                    entries.extend(fetch_sitemap(child_url, url_prefix, depth + 1, seen))
+                except SITEMAP_ERRORS as e:
+                    print(f"   ⚠️ Sitemapu {child_url} nelze načíst: {e}")
+    else:
+        for url in root:
+            loc = _child_text(url, "loc")
+            if loc and loc.startswith(url_prefix):
+                entries.append((loc, parse_lastmod(_child_text(url, "lastmod")),
+                                CHANGEFREQ_HOURS.get(_child_text(url, "changefreq").lower())))
+    return entries
+
+
+def import_sitemap(sitemap_url, url_prefix=""):
+    """Stáhne sitemapu a uloží její URL do crawler_urls. Vrací počet URL."""
+    entries = fetch_sitemap(sitemap_url, url_prefix)
+    count = import_sitemap_entries(sitemap_url, entries, url_prefix)
+    print(f"🗺️ Sitemapa {sitemap_url}: {count} URL")
+    return count
+
+
+def refresh_sitemaps():
+    """Obnoví lastmod ze všech registrovaných sitemap (na začátku web syncu). Chyba jedné sitemapy sync nezastaví."""
+    for sitemap_url, url_prefix in get_sitemaps():
+        try:
+            import_sitemap(sitemap_url, url_prefix)
+        except Exception as e:
+            # Cokoli z jedné sitemapy (včetně zápisu do DB) - ostatní sitemapy i sync pokračují
+            print(f"⚠️ Sitemapu {sitemap_url} se nepodařilo obnovit: {e}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import URL pro crawler ze sitemap.xml")
+    parser.add_argument("sitemap_url")
+    parser.add_argument("--prefix", default="", help="Importovat jen URL začínající tímto prefixem")
+    args = parser.parse_args(argv)
+    import_sitemap(args.sitemap_url, args.prefix)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
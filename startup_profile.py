@@ -0,0 +1,131 @@
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+from datetime import datetime
+
+# Profil startu webového procesu: kolik trvá import aplikace (po modulech), kolik paměti zabere
+# a za jak dlouho po startu přijde první odpověď. Výsledky se porovnají s rozpočtem a připíšou
+# do historie, aby šlo sledovat, jestli start postupně nebobtná.
+#
+#   python startup_profile.py                     # jen import (nepotřebuje DB ani OpenAI)
+#   python startup_profile.py --first-answer      # i první dotaz na /api/chat (potřebuje DB a OpenAI / fake server)
+
+# Moduly, které do chat workeru nepatří - používá je jen indexace (worker.py)
+INGEST_ONLY_MODULES = ["pandas", "pypdf", "docx", "bs4"]
+
+DEFAULT_HISTORY_FILE = os.path.join("profiles", "startup_profile.jsonl")
+
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+\d+\s+\|\s*(\S+)")
+
+
+def profile_import(role, module="application"):
+    """
+    Naimportuje aplikaci v čistém podprocesu s `-X importtime`.
+    Vrací slovník s celkovým časem, RSS, nejdražšími balíčky a seznamem načtených modulů jen pro indexaci.
+    """
+    code = (
+        f"import time, resource, sys, json; t = time.perf_counter(); import {module}; "
+        f"print('PROFILE ' + json.dumps(["
+        f"round((time.perf_counter() - t) * 1000, 1), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, "
+        f"[m for m in {INGEST_ONLY_MODULES!r} if m in sys.modules]]))"
+    )
+    env = dict(os.environ, SOFIM_ROLE=role)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, env=env)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Import aplikace selhal:\n{proc.stderr[-2000:]}")
+
+    # Vlastní (self) čas sečtený po balíčcích - součty dávají dohromady celý import
+    packages = {}
+    for line in proc.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        top = match.group(2).split(".")[0]
+        packages[top] = packages.get(top, 0) + int(match.group(1))
+
+    profile_line = [line for line in proc.stdout.splitlines() if line.startswith("PROFILE ")][-1]
+    import_ms, maxrss_kb, loaded = json.loads(profile_line[len("PROFILE "):])
+    top_packages = sorted(packages.items(), key=lambda kv: kv[1], reverse=True)[:15]
+
+    return {
+        "import_ms": import_ms,
+        "rss_mb": round(maxrss_kb / 1024, 1),
+        "top_packages_ms": {name: round(us / 1000, 1) for name, us in top_packages},
+        "ingest_modules_loaded": loaded,
+    }
+
+
+def profile_first_answer(role, question):
+    """Spustí aplikaci v podprocesu a změří čas od startu po první odpověď /api/chat."""
+    code = (
+        "import time, json; t = time.perf_counter(); import application; "
+        "client = application.app.test_client(); "
+        f"r = client.post('/api/chat', json={{'query': {question!r}, 'history': []}}); "
+        "print('PROFILE ' + json.dumps({'status': r.status_code, 'ms': round((time.perf_counter() - t) * 1000, 1)}))"
+    )
+    env = dict(os.environ, SOFIM_ROLE=role)
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env)
+    if proc.returncode != 0:
+        raise RuntimeError(f"První dotaz selhal:\n{proc.stderr[-2000:]}")
+    profile_line = [line for line in proc.stdout.splitlines() if line.startswith("PROFILE ")][-1]
+    result = json.loads(profile_line[len("PROFILE "):])
+    return {"first_answer_ms": result["ms"], "first_answer_status": result["status"]}
+
+
+def check_budget(report, budget_import_ms, budget_rss_mb, budget_first_answer_ms):
+    """Vrátí seznam překročení rozpočtu (prázdný = vše v pořádku)."""
+    violations = []
+    if report["import_ms"] > budget_import_ms:
+        violations.append(f"import {report['import_ms']} ms > {budget_import_ms} ms")
+    if report["rss_mb"] > budget_rss_mb:
+        violations.append(f"RSS {report['rss_mb']} MB > {budget_rss_mb} MB")
+    if report["role"] == "chat" and report["ingest_modules_loaded"]:
+        violations.append(f"chat worker načetl závislosti indexace: {', '.join(report['ingest_modules_loaded'])}")
+    if "first_answer_ms" in report and report["first_answer_ms"] > budget_first_answer_ms:
+        violations.append(f"první odpověď {report['first_answer_ms']} ms > {budget_first_answer_ms} ms")
+    return violations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profil startu SOFIM webu")
+    parser.add_argument("--role", default="chat", choices=["chat", "full"])
+    parser.add_argument("--first-answer", action="store_true", help="Změří i první odpověď na /api/chat")
+    parser.add_argument("--question", default="Kolik kreditů má předmět ALG1?")
+    parser.add_argument("--budget-import-ms", type=float, default=1500)
+    parser.add_argument("--budget-rss-mb", type=float, default=150)
+    parser.add_argument("--budget-first-answer-ms", type=float, default=15000)
+    parser.add_argument("--history", default=DEFAULT_HISTORY_FILE, help="JSONL soubor s historií měření")
+    args = parser.parse_args(argv)
+
+    report = {"timestamp": datetime.now().isoformat(timespec="seconds"), "role": args.role}
+    report.update(profile_import(args.role))
+    if args.first_answer:
+        report.update(profile_first_answer(args.role, args.question))
+
+    print(f"⏱️ Import aplikace (role {args.role}): {report['import_ms']} ms, RSS {report['rss_mb']} MB")
+    for name, ms in report["top_packages_ms"].items():
+        print(f"   {name:<25} {ms:>8} ms")
+    if "first_answer_ms" in report:
+        print(f"💬 První odpověď: {report['first_answer_ms']} ms (HTTP {report['first_answer_status']})")
+
+    violations = check_budget(report, args.budget_import_ms, args.budget_rss_mb, args.budget_first_answer_ms)
+    report["budget_ok"] = not violations
+
+    if args.history:
+        os.makedirs(os.path.dirname(args.history) or ".", exist_ok=True)
+        with open(args.history, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(report, ensure_ascii=False) + "\n")
+
+    if violations:
+        for violation in violations:
+            print(f"❌ Rozpočet překročen: {violation}")
+        return 1
+    print("✅ Start je v rozpočtu.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
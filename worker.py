@@ -0,0 +1,199 @@
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+
+from config import INGEST_LEASE_SECONDS, INGEST_POLL_SECONDS
+from database import (
+    init_db_schema,
+    acquire_ingest_lease,
+    release_ingest_lease,
+    enqueue_ingest_job,
+    claim_next_job,
+    finish_job,
+    requeue_orphaned_jobs,
+    is_cancel_requested,
+    enqueue_due_schedules,
+    set_ingest_schedule,
+    remove_ingest_schedule,
+    get_resumable_run,
+    EVALUATION_MODE
+)
+
+# Samostatný proces pro indexaci. Webová aplikace jen zařazuje úlohy do fronty (tabulka ingest_jobs),
+# worker je vybírá a spouští run_ingest mimo webový proces - pandas, pypdf ani BeautifulSoup
+# tak nesoupeří s chatem o GIL a restart webu běžící indexaci nezabije. Stejnou frontou chodí i evaluace
+# sad otázek zadané z admin panelu (mode = EVALUATION_MODE, batch_questions.py).
+#
+# Spuštění:
+#   python worker.py                        # smyčka workeru
+#   python worker.py enqueue web            # zařadí úlohu
+#   python worker.py enqueue bulk           # hromadná přestavba přes OpenAI Batch API (bulk_ingest.py)
+#   python worker.py schedule all 1440      # pravidelný běh každých 1440 minut
+#   python worker.py schedule drive 60      # změny na Google Disku každou hodinu
+#   python worker.py unschedule all
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+INGEST_MODES = ["all", "web", "csv", "drive", "bulk", "resume"]
+SCHEDULE_MODES = [mode for mode in INGEST_MODES if mode != "resume"]  # Navázání se plánovat nedá
+
+
+class LeaseHeartbeat(threading.Thread):
+    """
+    Na pozadí prodlužuje zámek a hlídá požadavek na zrušení úlohy.
+    Pokud zámek ztratíme (např. dlouhý výpadek DB), běh se raději ukončí, než aby běžely dva najednou -
+    s důvodem 'lease_lost', aby se to v adminu nepletlo se zrušením uživatelem. Za ztracený se zámek
+    považuje i tehdy, když se ho déle než INGEST_LEASE_SECONDS nepodařilo prodloužit: mohl propadnout
+    a převzít ho jiný worker, i když DB zatím není dostupná a heartbeat to nemůže ověřit.
+    """
+
+    def __init__(self, job_id=None):
+        super().__init__(daemon=True)
+        self.job_id = job_id
+        self.cancelled = threading.Event()
+        self.reason = None
+        self._stop_event = threading.Event()
+        # Volající zámek právě získal; od začátku prodloužení počítáme konzervativně (DB ho nastaví později)
+        self._lease_until = time.monotonic() + INGEST_LEASE_SECONDS
+
+    def stop_reason(self):
+        """Pro run_ingest(should_cancel=...): None, nebo důvod ukončení ('cancelled' / 'lease_lost')."""
+        if not self.cancelled.is_set() and time.monotonic() >= self._lease_until:
+            print("⚠️ Zámek indexace se nepodařilo včas prodloužit, ukončuji běh.")
+            self._request_stop("lease_lost")
+        return self.reason if self.cancelled.is_set() else None
+
+    def _request_stop(self, reason):
+        if not self.cancelled.is_set():
+            self.reason = reason
+            self.cancelled.set()
+
+    def run(self):
+        while not self._stop_event.wait(INGEST_LEASE_SECONDS / 3):
+            try:
+                renewed_at = time.monotonic()
+                if not acquire_ingest_lease(WORKER_ID, INGEST_LEASE_SECONDS):
+                    print("⚠️ Zámek indexace byl ztracen, ukončuji běh.")
+                    self._request_stop("lease_lost")
+                    continue
+                self._lease_until = renewed_at + INGEST_LEASE_SECONDS
+                if self.job_id is not None and is_cancel_requested(self.job_id):
+                    print(f"⏹️ Úloha #{self.job_id} byla zrušena z admin panelu.")
+                    self._request_stop("cancelled")
+            except Exception as e:
+                print(f"⚠️ Heartbeat workeru selhal: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def _run_holding_lease(mode, job_id=None):
+    """Spustí indexaci nebo evaluaci; volající už drží zámek (heartbeat ho během běhu prodlužuje)."""
+    heartbeat = LeaseHeartbeat(job_id)
+    heartbeat.start()
+    try:
+        # Těžké závislosti (pandas, pypdf, ...) se načítají až tady
+        if mode == EVALUATION_MODE:
+            from batch_questions import run_evaluation_job
+            return run_evaluation_job(job_id, should_cancel=heartbeat.stop_reason)
+        from ingest import run_ingest
+        return run_ingest(mode, should_cancel=heartbeat.stop_reason, lease_owner=WORKER_ID)
+    finally:
+        heartbeat.stop()
+
+
+def run_with_lease(mode, job_id=None):
+    """Spustí indexaci pod zámkem jediného běžce. Vrací výsledek run_ingest, nebo 'locked'."""
+    init_db_schema()
+    if not acquire_ingest_lease(WORKER_ID, INGEST_LEASE_SECONDS):
+        print("⚠️ Indexace už běží jinde (zámek je obsazený).")
+        return "locked"
+
+    try:
+        return _run_holding_lease(mode, job_id)
+    finally:
+        release_ingest_lease(WORKER_ID)
+
+
+def process_one_job():
+    """Jeden průchod frontou. Vrací True, pokud se nějaká úloha zpracovala."""
+    if not acquire_ingest_lease(WORKER_ID, INGEST_LEASE_SECONDS):
+        return False
+
+    try:
+        if requeue_orphaned_jobs(WORKER_ID) and get_resumable_run():
+            print("🩹 Nalezena úloha přerušená pádem workeru, zařazuji navázání.")
+            enqueue_ingest_job("resume")
+
+        job = claim_next_job(WORKER_ID)
+        if not job:
+            return False
+
+        job_id, mode = job
+        print(f"📥 Přebírám úlohu #{job_id} (Režim: {mode}).")
+        try:
+            result = _run_holding_lease(mode, job_id)
+        except Exception as e:
+            finish_job(job_id, "error", str(e))
+            raise
+    finally:
+        release_ingest_lease(WORKER_ID)
+
+    if result == "success":
+        finish_job(job_id, "done")
+    elif result == "cancelled":
+        finish_job(job_id, "cancelled")
+    elif result == "lease_lost":
+        resumable = "" if mode == EVALUATION_MODE else " (lze navázat)"
+        finish_job(job_id, "lease_lost", f"Worker ztratil zámek indexace, běh byl ukončen{resumable}.")
+    elif result is None:
+        finish_job(job_id, "done", "Není na co navázat.")
+    else:
+        finish_job(job_id, "error", f"Indexace skončila stavem: {result}")
+    return True
+
+
+def worker_loop():
+    print(f"👷 Ingest worker {WORKER_ID} startuje (fronta každých {INGEST_POLL_SECONDS} s).")
+    init_db_schema()
+    while True:
+        try:
+            for mode in enqueue_due_schedules():
+                print(f"⏰ Plánovaný běh zařazen do fronty: {mode}")
+            if process_one_job():
+                continue
+        except Exception as e:
+            print(f"❌ Chyba workeru: {e}")
+        time.sleep(INGEST_POLL_SECONDS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SOFIM ingest worker")
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("run", help="Spustí smyčku workeru (výchozí)")
+    p_enqueue = sub.add_parser("enqueue", help="Zařadí indexaci do fronty")
+    p_enqueue.add_argument("mode", choices=INGEST_MODES)
+    p_schedule = sub.add_parser("schedule", help="Naplánuje pravidelnou indexaci")
+    p_schedule.add_argument("mode", choices=SCHEDULE_MODES)
+    p_schedule.add_argument("interval_minutes", type=int)
+    p_unschedule = sub.add_parser("unschedule", help="Zruší plánovanou indexaci")
+    p_unschedule.add_argument("mode", choices=SCHEDULE_MODES)
+    args = parser.parse_args(argv)
+
+    init_db_schema()
+    if args.command == "enqueue":
+        print(f"📥 Úloha #{enqueue_ingest_job(args.mode)} zařazena.")
+    elif args.command == "schedule":
+        set_ingest_schedule(args.mode, args.interval_minutes)
+        print(f"⏰ Režim {args.mode} naplánován každých {args.interval_minutes} minut.")
+    elif args.command == "unschedule":
+        remove_ingest_schedule(args.mode)
+        print(f"🗑️ Plán pro režim {args.mode} zrušen.")
+    else:
+        worker_loop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())